@@ -0,0 +1,158 @@
+"""Short-lived cache of /analyze responses with request coalescing
+
+Responses are keyed on the normalized (wallet, coin, limit), plus any date
+window, bucket and valuation, and kept for ANALYZE_CACHE_TTL seconds together with an
+ETag, so clients can revalidate with If-None-Match. Identical requests arriving while an analysis is
+running wait for it instead of starting their own.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import metrics
+from cache import SingleFlight, TTLCache, make_backend
+from wallet_analyzer import normalize_wallet
+
+ANALYZE_CACHE_TTL = float(os.getenv('ANALYZE_CACHE_TTL', '30'))
+
+def cache_key(wallet, coin, limit, window=None, bucket=None, valuation=None):
+    """Key on the normalized wallet (see normalize_wallet)"""
+    wallet = normalize_wallet(wallet)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        pass
+    key = f'analyze:{coin.upper()}:{wallet}:{limit}'
+    if window is not None or bucket is not None or valuation is not None:
+        start, end = window or (None, None)
+        key += f':{start or ""}..{end or ""}:{bucket or ""}:{valuation or ""}'
+    return key
+
+def make_etag(body):
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches etag (weak comparison)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
+
+def cacheable(status, body):
+    # Errors and price-less fallbacks are retried by the next request rather than pinned for the TTL
+    return status == 200 and 'warning' not in body
+
+def response_headers(status, body, etag, outcome):
+    """ETag, Cache-Control and X-Cache (hit/miss/coalesced) headers for an /analyze response"""
+    return {
+        'ETag': etag,
+        'Cache-Control': f'private, max-age={int(ANALYZE_CACHE_TTL)}' if cacheable(status, body) else 'no-store',
+        'X-Cache': outcome,
+    }
+
+class AnalysisCache:
+    """(status, body) results by key, with hit/miss/coalescing counters
+
+    get_or_run returns (status, body, etag, outcome) where outcome is 'hit',
+    'miss' (this call ran the analysis) or 'coalesced' (it waited on one).
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.flight = SingleFlight()
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _count(self, outcome):
+        with self._lock:
+            if outcome == 'hit':
+                self.hits += 1
+            elif outcome == 'miss':
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+    def _lookup(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        self._count('hit')
+        return 200, entry['body'], entry['etag'], 'hit'
+
+    def _store(self, key, status, body):
+        etag = make_etag(body)
+        if cacheable(status, body):
+            self.cache.set(key, {'body': body, 'etag': etag})
+        return status, body, etag
+
+    def get_or_run(self, key, run):
+        """Cached result for key, or run() -> (status, body) once for all concurrent callers"""
+        hit = self._lookup(key)
+        if hit is not None:
+            return hit
+
+        leader = []
+
+        def load():
+            leader.append(True)
+            return self._store(key, *run())
+
+        status, body, etag = self.flight.do(key, load)
+        outcome = 'miss' if leader else 'coalesced'
+        self._count(outcome)
+        return status, body, etag, outcome
+
+    async def get_or_run_async(self, key, run):
+        """Async counterpart of get_or_run; run() returns an awaitable of (status, body)"""
+        import asyncio  # Only the ASGI app gets here; the Flask app shouldn't pay for importing it
+
+        hit = self._lookup(key)
+        if hit is not None:
+            return hit
+
+        task = self._tasks.get(key)
+        outcome = 'coalesced'
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            outcome = 'miss'
+            task = asyncio.ensure_future(self._run_async(key, run))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+
+        # Shielded so one waiter disconnecting doesn't cancel the analysis for the rest
+        status, body, etag = await asyncio.shield(task)
+        self._count(outcome)
+        return status, body, etag, outcome
+
+    async def _run_async(self, key, run):
+        return self._store(key, *await run())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hitRatio': round(self.hits / lookups, 4) if lookups else None,
+                'ttl': self.cache.default_ttl,
+            }
+
+# Backend is memory (per process), sqlite (shared by every worker on the host) or redis
+analysis_cache = AnalysisCache(TTLCache(
+    make_backend(
+        os.getenv('ANALYZE_CACHE_BACKEND', 'memory'),
+        path=os.getenv('ANALYZE_CACHE_PATH', 'analyze_cache.sqlite3'),
+        url=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    ),
+    default_ttl=ANALYZE_CACHE_TTL,
+    stale_ttl=0,
+))
+
+metrics.register('wallet_analyze_cache_requests_total', '/analyze requests by cache outcome',
+                 lambda: {'hit': analysis_cache.hits, 'miss': analysis_cache.misses, 'coalesced': analysis_cache.coalesced},
+                 label='outcome', kind='counter')
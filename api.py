@@ -1,8 +1,14 @@
-from flask import Flask, request, jsonify
+from dotenv import load_dotenv
+
+# Before the imports below, which read their settings from the environment when imported
+load_dotenv()
+
+from flask import Flask, Response, abort, g, make_response, request, jsonify
 from flask_cors import CORS
 import os
-from dotenv import load_dotenv
-import requests
+import json
+import metrics
+import scheduler
 
 app = Flask(__name__)
 CORS(app, resources={
@@ -17,88 +23,198 @@ CORS(app, resources={
     }
 })
 
-# Load Moralis API key from .env
-load_dotenv()
-MORALIS_API_KEY = os.getenv('MORALIS_API_KEY')
+@app.before_request
+def start_price_refresher():
+    # Per worker, on its first request rather than at import, so a preloading master never runs one
+    price_refresher.start_refresher()
+
+@app.before_request
+def start_server_timing():
+    g.server_timing = metrics.start_request()
 
-if not MORALIS_API_KEY:
-    print('Moralis API key not found in .env file.')
-    exit(1)
+@app.after_request
+def add_server_timing(response):
+    header = metrics.finish_request(g.pop('server_timing', None))
+    if header is not None:
+        response.headers['Server-Timing'] = header
+    return response
+
+@app.teardown_request
+def stop_server_timing(error=None):
+    # Requests that raised skip after_request
+    metrics.finish_request(g.pop('server_timing', None))
 
 # Import functions from wallet_analyzer.py
+import wallet_analyzer
+import price_refresher
+import jobs
+from analysis_cache import analysis_cache, cache_key, etag_matches, response_headers
 from wallet_analyzer import (
-    analyze_transactions,
-    CHAIN_MAP
+    analyze_batch,
+    analyze_portfolio,
+    is_evm_address,
+    analyze_period,
+    parse_analysis,
+    parse_pair,
+    format_analysis
 )
 
+def request_json():
+    """The request body's JSON object, {} when there is none; any other JSON value is rejected with a 400"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        abort(make_response(jsonify({
+            'error': 'Request body must be a JSON object'
+        }), 400))
+    return data
+
+def run_analysis(wallet, coin, chain, limit, window=None, bucket=None, valuation=None):
+    """Analyze one wallet, returning (status, body)
+
+    A price no source could provide comes back as None, and the body then
+    carries the flows without USD values.
+    """
+    try:
+        # Analyze transactions with limit
+        inflow, outflow, price, decimals, days, cost_basis = analyze_period(
+            wallet, coin, chain, limit, window, bucket, valuation)
+    except Exception as e:
+        error_message = str(e)
+        if "rate limit" in error_message.lower():
+            error_message = "Service is experiencing high demand. Please try again in a few minutes."
+        return 500, {
+            'error': error_message
+        }
+    return 200, format_analysis(wallet, coin, inflow, outflow, price, limit, decimals, window, days, cost_basis)
+
 @app.route('/analyze', methods=['POST'])
 def analyze_wallet():
-    try:
-        data = request.json
-        wallet = data.get('wallet')
-        coin = data.get('coin')
-        limit = data.get('limit', 100)  # Default to 100 if not specified
+    parsed = parse_analysis(request_json())
+    if isinstance(parsed, str):
+        return jsonify({
+            'error': parsed
+        }), 400
+    wallet, coin, chain, limit, window, bucket, valuation = parsed
 
-        if not wallet or not coin:
-            return jsonify({
-                'error': 'Wallet address and coin symbol are required'
-            }), 400
+    # Identical requests share one cached or in-flight analysis
+    status, body, etag, outcome = analysis_cache.get_or_run(
+        cache_key(wallet, coin, limit, window, bucket, valuation),
+        lambda: run_analysis(wallet, coin, chain, limit, window, bucket, valuation)
+    )
+    headers = response_headers(status, body, etag, outcome)
+    if status == 200 and etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    return jsonify(body), status, headers
 
-        # Validate coin symbol
-        coin = coin.upper()
-        if coin == 'BTC':
-            chain = 'btc'
-        elif coin not in CHAIN_MAP:
-            return jsonify({
-                'error': f'{coin} is not supported. Supported coins: BTC, {", ".join(CHAIN_MAP.keys())}'
-            }), 400
-        else:
-            chain = CHAIN_MAP[coin]
+@app.route('/analyze/cache', methods=['GET'])
+def analyze_cache_stats():
+    """Hit, miss and coalesced counts and hit ratio of the /analyze response cache"""
+    return jsonify(analysis_cache.stats())
 
-        try:
-            # Analyze transactions with limit
-            inflow, outflow, price, decimals = analyze_transactions(wallet, coin, chain, limit)
-            inflow_usd = inflow * price
-            outflow_usd = outflow * price
-            net_amount = inflow - outflow
-            net_usd = inflow_usd - outflow_usd
+@app.route('/analyze/jobs', methods=['POST'])
+def create_analysis_job():
+    """Queue an analysis on the background job pool; poll the returned job for progress and the result"""
+    parsed = parse_analysis(request_json())
+    if isinstance(parsed, str):
+        return jsonify({
+            'error': parsed
+        }), 400
+    if not isinstance(parsed[3], int) or parsed[3] < 0:
+        return jsonify({
+            'error': 'limit must be a non-negative integer'
+        }), 400
+    job = jobs.runner.submit(*parsed)
+    return jsonify(job), 202, {'Location': f'/analyze/jobs/{job["id"]}'}
 
-            return jsonify({
-                'wallet': wallet,
-                'coin': coin,
-                'received': f'{inflow:.8f}',
-                'receivedUsd': f'{inflow_usd:,.2f}',
-                'sent': f'{outflow:.8f}',
-                'sentUsd': f'{outflow_usd:,.2f}',
-                'net': f'{net_amount:.8f}',
-                'netUsd': f'{net_usd:,.2f}',
-                'transactionsAnalyzed': limit if limit > 0 else 'all'
-            })
-        except Exception as e:
-            if "Unable to fetch" in str(e):
-                # Price fetching error - return results without USD values
-                return jsonify({
-                    'wallet': wallet,
-                    'coin': coin,
-                    'received': f'{inflow:.8f}',
-                    'receivedUsd': 'Price Unavailable',
-                    'sent': f'{outflow:.8f}',
-                    'sentUsd': 'Price Unavailable',
-                    'net': f'{net_amount:.8f}',
-                    'netUsd': 'Price Unavailable',
-                    'transactionsAnalyzed': limit if limit > 0 else 'all',
-                    'warning': 'Price data temporarily unavailable. USD values could not be calculated.'
-                })
-            else:
-                raise
+@app.route('/analyze/jobs/<job_id>', methods=['GET'])
+def analysis_job(job_id):
+    """Status, progress and (once done) result of a background analysis"""
+    job = jobs.runner.get(job_id)
+    if job is None:
+        return jsonify({
+            'error': 'Job not found'
+        }), 404
+    return jsonify(job)
 
-    except Exception as e:
-        error_message = str(e)
-        if "rate limit" in error_message.lower():
-            error_message = "Service is experiencing high demand. Please try again in a few minutes."
+@app.route('/portfolio', methods=['POST'])
+def analyze_wallet_portfolio():
+    """Analyze one EVM address on every EVM chain concurrently, with per-chain and total USD values"""
+    data = request_json()
+    wallet = (data.get('wallet') or '').strip()
+    limit = data.get('limit', 100)
+
+    if not is_evm_address(wallet):
         return jsonify({
-            'error': error_message
-        }), 500
+            'error': 'wallet must be an EVM address (0x followed by 40 hex digits)'
+        }), 400
+    if not isinstance(limit, int) or limit < 0:
+        return jsonify({
+            'error': 'limit must be a non-negative integer'
+        }), 400
+    return jsonify(analyze_portfolio(wallet, limit))
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Span timings, upstream counters and cache/queue metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_stats():
+    """Per-upstream queue depth, wait time and throttling counters"""
+    return jsonify(scheduler.stats())
+
+@app.route('/price-refresher', methods=['GET'])
+def price_refresher_status():
+    """Background price refresher state and per-coin staleness alarms"""
+    return jsonify(price_refresher.status())
+
+@app.route('/price-sources', methods=['GET'])
+def price_source_stats():
+    """Per-source latency/error EWMAs and request, error and win counts of the price resolver"""
+    return jsonify(wallet_analyzer.price_resolver.stats())
+
+# Largest number of pairs accepted by a single /analyze/batch request
+BATCH_MAX_PAIRS = int(os.getenv('BATCH_MAX_PAIRS', '10000'))
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_wallet_batch():
+    data = request_json()
+    items = data.get('pairs')
+    limit = data.get('limit', 100)
+
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'error': 'pairs must be a non-empty list of {"wallet", "coin"} objects or "wallet,coin" strings'
+        }), 400
+    if len(items) > BATCH_MAX_PAIRS:
+        return jsonify({
+            'error': f'At most {BATCH_MAX_PAIRS} pairs can be analyzed per request'
+        }), 400
+
+    pairs = []
+    for item in items:
+        try:
+            if isinstance(item, dict):
+                wallet, coin = item.get('wallet'), item.get('coin')
+                if not wallet or not coin:
+                    raise ValueError
+                pairs.append((wallet, coin.upper()))
+            else:
+                pairs.append(parse_pair(item))
+        except (AttributeError, ValueError):
+            return jsonify({
+                'error': f'Invalid pair: {item!r}. Expected {{"wallet", "coin"}} or "wallet,coin"'
+            }), 400
+
+    def generate():
+        # One JSON record per line, flushed as each pair finishes
+        for record in analyze_batch(pairs, limit):
+            yield json.dumps(record) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 if __name__ == '__main__':
+    if not os.getenv('MORALIS_API_KEY'):
+        print('Moralis API key not found in .env file.')
+        exit(1)
     app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
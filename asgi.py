@@ -0,0 +1,230 @@
+"""ASGI entry point serving /analyze from the async analysis engine
+
+Run with an ASGI server, e.g.: uvicorn asgi:app --port 5001
+One event loop holds hundreds of concurrent analyses, so a single worker
+replaces a pool of blocking gunicorn processes.
+"""
+import json
+
+from dotenv import load_dotenv
+
+# Before the imports below, which read their settings from the environment when imported
+load_dotenv()
+
+import async_analyzer
+import jobs
+import metrics
+import price_refresher
+import scheduler
+import wallet_analyzer
+from analysis_cache import analysis_cache, cache_key, etag_matches, response_headers
+from wallet_analyzer import format_analysis, parse_analysis
+
+# Keep in sync with the CORS origins in api.py
+ALLOWED_ORIGINS = {
+    "http://localhost:8000",
+    "https://kalenkilgore.github.io",
+    "https://multichain-crypto-wallet-analyzer-sol.onrender.com"
+}
+
+_session = None
+
+def get_session():
+    """Lazily create the shared aiohttp session on the running loop"""
+    global _session
+    if _session is None or _session.closed:
+        _session = async_analyzer.create_session()
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+def cors_headers(scope):
+    origin = dict(scope['headers']).get(b'origin', b'').decode()
+    if origin not in ALLOWED_ORIGINS:
+        return []
+    return [
+        (b'access-control-allow-origin', origin.encode()),
+        (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+        (b'access-control-allow-headers', b'Content-Type, Authorization, Accept'),
+        (b'vary', b'Origin'),
+    ]
+
+def encode_headers(headers):
+    return [(name.lower().encode(), str(value).encode()) for name, value in headers.items()]
+
+async def send_json(send, scope, status, payload, headers=None):
+    body = json.dumps(payload, sort_keys=True).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ] + encode_headers(headers or {}) + cors_headers(scope),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_not_modified(send, scope, headers):
+    await send({'type': 'http.response.start', 'status': 304, 'headers': encode_headers(headers) + cors_headers(scope)})
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def portfolio(data):
+    """Same validation and response shape as the Flask /portfolio route, returning (status, payload)"""
+    wallet = (data.get('wallet') or '').strip()
+    limit = data.get('limit', 100)
+    if not wallet_analyzer.is_evm_address(wallet):
+        return 400, {'error': 'wallet must be an EVM address (0x followed by 40 hex digits)'}
+    if not isinstance(limit, int) or limit < 0:
+        return 400, {'error': 'limit must be a non-negative integer'}
+    return 200, await async_analyzer.analyze_portfolio(get_session(), wallet, limit)
+
+def create_job(data):
+    """Queue an analysis on the background job pool, returning (status, payload, headers)"""
+    parsed = parse_analysis(data)
+    if isinstance(parsed, str):
+        return 400, {'error': parsed}, {}
+    if not isinstance(parsed[3], int) or parsed[3] < 0:
+        return 400, {'error': 'limit must be a non-negative integer'}, {}
+    job = jobs.runner.submit(*parsed)
+    return 202, job, {'Location': f'/analyze/jobs/{job["id"]}'}
+
+async def analyze_wallet(data):
+    """Same validation and response shape as the Flask /analyze route
+
+    Returns (status, payload, headers); identical requests share one cached or in-flight analysis.
+    """
+    parsed = parse_analysis(data)
+    if isinstance(parsed, str):
+        return 400, {'error': parsed}, {}
+    wallet, coin, chain, limit, window, bucket, valuation = parsed
+
+    async def run():
+        try:
+            inflow, outflow, price, decimals, days, cost_basis = await async_analyzer.analyze_period(
+                get_session(), wallet, coin, chain, limit, window, bucket, valuation)
+        except Exception as e:
+            error_message = str(e)
+            if "rate limit" in error_message.lower():
+                error_message = "Service is experiencing high demand. Please try again in a few minutes."
+            return 500, {'error': error_message}
+        return 200, format_analysis(wallet, coin, inflow, outflow, price, limit, decimals, window, days, cost_basis)
+
+    status, payload, etag, outcome = await analysis_cache.get_or_run_async(
+        cache_key(wallet, coin, limit, window, bucket, valuation), run)
+    return status, payload, response_headers(status, payload, etag, outcome)
+
+async def app(scope, receive, send):
+    token = metrics.start_request() if scope['type'] == 'http' else None
+    if token is None:
+        await handle(scope, receive, send)
+        return
+
+    async def send_with_timing(message):
+        # Timing stops when the response starts, so the header can still be added
+        nonlocal token
+        if message['type'] == 'http.response.start' and token is not None:
+            header = metrics.finish_request(token)
+            token = None
+            message = dict(message, headers=list(message.get('headers', [])) + [(b'server-timing', header.encode())])
+        await send(message)
+
+    try:
+        await handle(scope, receive, send_with_timing)
+    finally:
+        if token is not None:
+            metrics.finish_request(token)
+
+async def handle(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                price_refresher.start_refresher()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_session()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+    if method == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 200, 'headers': cors_headers(scope)})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    if scope['path'] == '/metrics' and method == 'GET':
+        body = metrics.render().encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/plain; version=0.0.4'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+        return
+    if scope['path'] == '/scheduler' and method == 'GET':
+        await send_json(send, scope, 200, scheduler.stats())
+        return
+    if scope['path'] == '/price-refresher' and method == 'GET':
+        await send_json(send, scope, 200, price_refresher.status())
+        return
+    if scope['path'] == '/price-sources' and method == 'GET':
+        await send_json(send, scope, 200, wallet_analyzer.price_resolver.stats())
+        return
+    if scope['path'] == '/analyze/cache' and method == 'GET':
+        await send_json(send, scope, 200, analysis_cache.stats())
+        return
+    if scope['path'].startswith('/analyze/jobs/') and method == 'GET':
+        job = jobs.runner.get(scope['path'][len('/analyze/jobs/'):])
+        if job is None:
+            await send_json(send, scope, 404, {'error': 'Job not found'})
+        else:
+            await send_json(send, scope, 200, job)
+        return
+    if scope['path'] not in ('/analyze', '/analyze/jobs', '/portfolio'):
+        await send_json(send, scope, 404, {'error': 'Not found'})
+        return
+    if method != 'POST':
+        await send_json(send, scope, 405, {'error': 'Method not allowed'})
+        return
+
+    try:
+        data = json.loads(await read_body(receive) or b'{}')
+    except ValueError:
+        await send_json(send, scope, 400, {'error': 'Request body must be JSON'})
+        return
+    if not isinstance(data, dict):
+        await send_json(send, scope, 400, {'error': 'Request body must be a JSON object'})
+        return
+
+    if scope['path'] == '/analyze/jobs':
+        status, payload, headers = create_job(data)
+        await send_json(send, scope, status, payload, headers)
+        return
+    if scope['path'] == '/portfolio':
+        status, payload = await portfolio(data)
+        await send_json(send, scope, status, payload)
+        return
+
+    status, payload, headers = await analyze_wallet(data)
+    if status == 200 and etag_matches(dict(scope['headers']).get(b'if-none-match', b'').decode(), headers['ETag']):
+        await send_not_modified(send, scope, headers)
+        return
+    await send_json(send, scope, status, payload, headers)
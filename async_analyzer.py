@@ -0,0 +1,379 @@
+"""Asyncio version of the wallet_analyzer pipeline
+
+Every coroutine here mirrors its sync counterpart in wallet_analyzer.py and
+reuses the same parsing and aggregation helpers, so both paths return
+identical results. As there, upstream failures raise AnalysisError, so one
+bad wallet can't take down the event loop.
+"""
+import asyncio
+import operator
+import os
+import time
+
+import aiohttp
+
+import metrics
+import page_decode
+import scheduler
+import wallet_analyzer as wa
+from http_pool import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+
+# Open connections a session may hold across all upstream hosts, and per host (0 = no per-host cap)
+ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', '100'))
+ASYNC_POOL_PER_HOST = int(os.getenv('ASYNC_POOL_PER_HOST', '0'))
+
+# Shared with the sync path, so callers catch one type whichever engine ran
+AnalysisError = wa.AnalysisError
+
+def create_session():
+    """Create a pooled aiohttp session; call from inside the running loop"""
+    connector = aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE, limit_per_host=ASYNC_POOL_PER_HOST)
+    timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def fetch(session, url, params=None, headers=None, timeout=None, decode=None, max_retries=None):
+    """GET url through its upstream's token bucket and return (status, decoded JSON or raw text)
+
+    decode(raw bytes) replaces page_decode.loads for 200 responses; max_retries is scheduler.http_get's.
+    """
+    bucket = scheduler.bucket_for(url)
+    cost = scheduler.request_cost(url)
+    upstream = scheduler.upstream_name(url)
+    # Only override the session's timeouts when asked; aiohttp treats timeout=None as "no timeout"
+    request_timeout = {'timeout': timeout} if timeout is not None else {}
+    attempt = 0
+    while True:
+        if bucket is not None:
+            await bucket.wait_async(cost)
+        start = time.perf_counter()
+        async with session.get(url, params=params, headers=headers, **request_timeout) as resp:
+            raw = await resp.read()
+            body = raw.decode(resp.get_encoding())
+            status = resp.status
+            delay = scheduler.retry_delay(status, resp.headers, attempt, max_retries)
+        metrics.upstream_response(upstream, status, len(raw), time.perf_counter() - start)
+        if delay is None:
+            break
+        metrics.upstream_retry(upstream, 'throttled')
+        if bucket is not None:
+            bucket.pause(delay)
+        else:
+            await asyncio.sleep(delay)
+        attempt += 1
+
+    if status != 200:
+        return status, body
+    return status, (decode or page_decode.loads)(raw)
+
+async def btc_json(session, url, params=None):
+    try:
+        with metrics.span('btc_page'):
+            status, data = await fetch(session, url, params)
+    except Exception as e:
+        raise AnalysisError(f'Error fetching BTC transactions: {e}')
+    if status != 200:
+        raise AnalysisError(f'Error fetching BTC transactions (status {status}): {data}')
+    return data
+
+async def full_io(session, tx, field, next_field):
+    """Async counterpart of wallet_analyzer.full_io"""
+    items = list(tx.get(field) or [])
+    url = tx.get(next_field)
+    while url:
+        data = await btc_json(session, url)
+        items += data.get(field) or []
+        url = data.get(next_field)
+    return items
+
+async def iter_btc_pages(session, addresses, want=0):
+    """Async counterpart of wallet_analyzer.iter_btc_pages; each round's requests go out together"""
+    address_set = set(addresses)
+    pager = wa.BtcPager(addresses, want)
+    while not pager.done:
+        requests = pager.requests()
+        responses = await asyncio.gather(*(btc_json(session, url, query) for _, url, query in requests))
+        for (batch, _, _), data in zip(requests, responses):
+            try:
+                txs = pager.advance(batch, data)
+            except AnalysisError:
+                raise
+            except Exception as e:
+                raise AnalysisError(f'Error fetching BTC transactions: {e}')
+            yield [
+                wa.btc_tx(tx, address_set, await full_io(session, tx, 'inputs', 'next_inputs'),
+                          await full_io(session, tx, 'outputs', 'next_outputs'))
+                for tx in txs if tx.get('block_height', -1) >= 0
+            ]
+
+async def iter_btc_txs(session, wallet, limit=100):
+    """Async counterpart of wallet_analyzer.iter_btc_txs"""
+    addresses = wa.btc_addresses(wallet)
+    if limit > 0:
+        txs = wa.newest_btc_txs([page async for page in iter_btc_pages(session, addresses, limit)], limit)
+        for i in range(0, len(txs), wa.BTC_PAGE_SIZE):
+            yield txs[i:i + wa.BTC_PAGE_SIZE]
+        return
+    seen = set()
+    async for page in iter_btc_pages(session, addresses):
+        page = [tx for tx in page if tx['hash'] not in seen]
+        seen.update(tx['hash'] for tx in page)
+        yield page
+
+async def source_price(session, url, source_headers, extract):
+    """Async counterpart of wallet_analyzer.source_price"""
+    status, data = await fetch(session, url, headers=source_headers,
+                               timeout=aiohttp.ClientTimeout(total=wa.PRICE_SOURCE_TIMEOUT), max_retries=0)
+    if status != 200:
+        raise Exception(f'status {status}')
+    price = float(extract(data))
+    if not price > 0:
+        raise ValueError(f'invalid price {price}')
+    return price
+
+async def resolve_price(session, coin_symbol, sources):
+    """First valid price from the sources, hedged or raced by the shared price resolver"""
+    calls = [(name, lambda url=url, h=h, extract=extract: source_price(session, url, h, extract))
+             for name, url, h, extract in sources]
+    try:
+        return await wa.price_resolver.resolve_async(calls)
+    except wa.PriceUnavailable:
+        raise wa.PriceUnavailable(f"Unable to fetch {coin_symbol} price from any source")
+
+async def optional_price(price):
+    """Async counterpart of wallet_analyzer.optional_price, awaiting a price lookup"""
+    try:
+        return await price
+    except wa.PriceUnavailable:
+        return None
+
+# In-flight price loads on this event loop, so concurrent misses share one fetch
+_price_tasks = {}
+
+async def cached_price(coin_id, load):
+    """Serve a fresh or stale cached price; at most one load per coin runs at a time"""
+    value, fresh = wa.price_cache.lookup(coin_id)
+    if fresh:
+        return value
+
+    task = _price_tasks.get(coin_id)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(_load_price(coin_id, load))
+        _price_tasks[coin_id] = task
+        task.add_done_callback(lambda t: _price_tasks.pop(coin_id, None) if _price_tasks.get(coin_id) is t else None)
+
+    if value is not None:
+        # Stale-while-revalidate: answer now, the task refreshes the cache
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return value
+    return await asyncio.shield(task)
+
+async def _load_price(coin_id, load):
+    price = await load()
+    wa.set_cached_price(coin_id, price)
+    return price
+
+async def get_btc_price(session):
+    """Get Bitcoin price using multiple sources with caching"""
+    return await cached_price('bitcoin', lambda: fetch_btc_price(session))
+
+async def fetch_btc_price(session):
+    """Fetch Bitcoin price from whichever source answers first"""
+    return await resolve_price(session, 'BTC', wa.price_sources('BTC', 'bitcoin'))
+
+async def get_native_price(session, wallet, chain, coin_symbol):
+    """Get native token price from multiple sources with caching"""
+    return await cached_price(wa.price_key(coin_symbol), lambda: fetch_native_price(session, wallet, chain, coin_symbol))
+
+async def fetch_native_price(session, wallet, chain, coin_symbol):
+    """Fetch native token price from whichever source answers first"""
+    return await resolve_price(session, wa.price_coin(coin_symbol), wa.native_price_sources(wallet, chain, coin_symbol))
+
+async def get_sol_price(session):
+    """Get SOL price from multiple sources with caching"""
+    return await cached_price('solana', lambda: fetch_sol_price(session))
+
+async def fetch_sol_price(session):
+    """Fetch SOL price from whichever source answers first"""
+    return await resolve_price(session, 'SOL', wa.sol_price_sources())
+
+async def fetch_page(session, url, params, label, decode=None):
+    try:
+        with metrics.span('moralis_page'):
+            status, data = await fetch(session, url, params=params, headers=wa.moralis_headers(), decode=decode)
+    except Exception as e:
+        raise AnalysisError(f'Error fetching {label}: {e}')
+    if status != 200:
+        raise AnalysisError(f'Error fetching {label} (status {status}): {data}')
+    return data
+
+async def iter_tx_pages(session, url, chain, limit, label, decode=None, window=None):
+    """Yield the newest limit txs (0 for all) page by page, fetching the next page while this one is used
+
+    As in wallet_analyzer.iter_tx_pages, a window is filtered upstream and paging stops at its start.
+    """
+    params = dict(wa.page_params(chain, limit), **wa.window_params(window))
+    remaining = limit
+    task = asyncio.ensure_future(fetch_page(session, url, params, label, decode))
+    try:
+        while task is not None:
+            data = await task
+            page = wa.page_txs(data)
+            passed = False
+            if window is not None:
+                page, passed = wa.clip_page(page, window)
+            if limit > 0:
+                page = page[:remaining]
+                remaining -= len(page)
+
+            task = None
+            cursor = data.get('cursor') if isinstance(data, dict) else None
+            if cursor and not passed and (limit == 0 or remaining > 0):
+                params = dict(params, cursor=cursor)
+                task = asyncio.ensure_future(fetch_page(session, url, params, label, decode))
+                await asyncio.sleep(0)  # Let the request go out before the caller takes the loop
+            yield page
+    finally:
+        if task is not None:
+            task.cancel()
+
+async def paginate(session, url, chain, limit, label, window=None):
+    """Follow Moralis cursors until the listing, the window or the user's limit runs out"""
+    return [tx async for page in iter_tx_pages(session, url, chain, limit, label, window=window) for tx in page]
+
+async def stream_flows(pages, flows, wallet):
+    """Async counterpart of wallet_analyzer.stream_flows"""
+    totals = flows([], wallet)
+    async for page in pages:
+        with metrics.span('aggregate'):
+            totals = tuple(map(operator.add, totals, flows(page, wallet)))
+    return totals
+
+async def daily_flows(pages, flows, wallet):
+    """Async counterpart of wallet_analyzer.daily_flows"""
+    days = {}
+    async for page in pages:
+        with metrics.span('aggregate'):
+            wa.add_daily_flows(days, page, flows, wallet)
+    return days
+
+async def get_native_transactions(session, wallet, chain, limit=100, window=None):
+    """Get native token transactions using Moralis API"""
+    return await paginate(session, f'{wa.MORALIS_API}/{wallet}', chain, limit, 'native transfers', window)
+
+async def get_erc20_transfers(session, wallet, chain, limit=100, window=None):
+    """Get ERC20 transfers using Moralis API"""
+    return await paginate(session, f'{wa.MORALIS_API}/{wallet}/erc20/transfers', chain, limit, 'ERC20 transfers', window)
+
+async def get_sol_transactions(session, wallet, limit=100, window=None):
+    """Get SOL balance, transfers and swaps from the Solana gateway concurrently"""
+    base = f'{wa.SOLANA_GATEWAY}/account/mainnet/{wallet}'
+    history_params = {
+        'limit': min(100, limit) if limit > 0 else 100,
+        'order': 'DESC',
+        **wa.window_params(window, ('fromDate', 'toDate'))
+    }
+
+    try:
+        headers = wa.moralis_headers()
+        (balance_status, balance_data), (transfers_status, transfers_data), (swaps_status, swaps_data) = await asyncio.gather(
+            fetch(session, f'{base}/balance', headers=headers),
+            fetch(session, f'{base}/transfers', params=history_params, headers=headers),
+            fetch(session, f'{base}/swaps', params=history_params, headers=headers),
+        )
+    except Exception as e:
+        raise AnalysisError(f'Error fetching SOL data: {e}')
+
+    if balance_status != 200:
+        raise AnalysisError(f'Error: Invalid Solana wallet address or API error: {balance_data}')
+    native_balance = float(balance_data.get('solana', 0))
+
+    if transfers_status != 200:
+        transfers_data = []
+    if swaps_status != 200:
+        swaps_data = []
+
+    return wa.build_sol_transactions(wallet, native_balance, transfers_data, swaps_data, limit, window)
+
+async def analyze_btc_transactions(session, wallet, limit=100):
+    """Analyze Bitcoin transactions"""
+    (total_received, total_sent), price = await asyncio.gather(
+        metrics.timed('btc_transactions', stream_flows(iter_btc_txs(session, wallet, limit), wa.btc_flows, wallet)),
+        metrics.timed('price', optional_price(get_btc_price(session))),
+    )
+    return total_received, total_sent, price, wa.DECIMALS['BTC']
+
+async def as_pages(pages):
+    """Async iterator over already fetched pages, for the aggregators"""
+    for page in pages:
+        yield page
+
+async def analyze_window(session, wallet, coin_symbol, chain, limit, window, aggregate, index=None):
+    """Async counterpart of wallet_analyzer.analyze_window"""
+    decimals = wa.coin_decimals(coin_symbol)
+
+    def value(flows):
+        return flows if index is None else wa.valued_flows(flows, index, decimals)
+
+    if coin_symbol == 'BTC':
+        if window is not None:
+            raise AnalysisError('from_date, to_date and bucket are not supported for BTC')
+        result, price = await asyncio.gather(
+            metrics.timed('btc_transactions', aggregate(iter_btc_txs(session, wallet, limit), value(wa.btc_flows), wallet)),
+            metrics.timed('price', optional_price(get_btc_price(session))),
+        )
+    elif coin_symbol == 'SOL':
+        transactions, price = await asyncio.gather(
+            metrics.timed('sol_gateway', get_sol_transactions(session, wallet, limit, window)),
+            metrics.timed('price', optional_price(get_sol_price(session))),
+        )
+        result = await aggregate(as_pages([transactions]), value(wa.sol_flows), wallet)
+    else:
+        url = f'{wa.MORALIS_API}/{wallet}'
+        if page_decode.COMPACT_PAGES:
+            pages = iter_tx_pages(session, url, chain, limit, 'native transfers', page_decode.native_page, window)
+            flows = page_decode.native_flows
+        else:
+            pages = iter_tx_pages(session, url, chain, limit, 'native transfers', window=window)
+            flows = wa.native_flows
+        result, price = await asyncio.gather(
+            metrics.timed('native_transactions', aggregate(pages, value(flows), wallet)),
+            metrics.timed('price', optional_price(get_native_price(session, wallet, chain, coin_symbol))),
+        )
+
+    return result, price, decimals
+
+async def analyze_transactions(session, wallet, coin_symbol, chain, limit=100, window=None):
+    """Async counterpart of wallet_analyzer.analyze_transactions"""
+    if coin_symbol == 'BTC' and window is None:
+        return await analyze_btc_transactions(session, wallet, limit)
+    (inflow, outflow), price, decimals = await analyze_window(session, wallet, coin_symbol, chain, limit, window, stream_flows)
+    return inflow, outflow, price, decimals
+
+async def analyze_period(session, wallet, coin_symbol, chain, limit=100, window=None, bucket=None, valuation=None):
+    """Async counterpart of wallet_analyzer.analyze_period"""
+    index = None
+    if valuation == 'historical':
+        import price_history
+        index = price_history.get_index(coin_symbol)
+        if index is None:
+            raise AnalysisError(f'No price history loaded for {coin_symbol}')
+    elif bucket is None:
+        return (*await analyze_transactions(session, wallet, coin_symbol, chain, limit, window), None, None)
+    result, price, decimals = await analyze_window(session, wallet, coin_symbol, chain, limit, window,
+                                                   stream_flows if bucket is None else daily_flows, index)
+    inflow, outflow, days, cost_basis = wa.period_totals(result, bucket, index)
+    return inflow, outflow, price, decimals, days, cost_basis
+
+async def analyze_portfolio(session, wallet, limit=100, max_workers=wa.PORTFOLIO_WORKERS):
+    """Async counterpart of wallet_analyzer.analyze_portfolio"""
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def analyze_chain(coin_symbol):
+        async with semaphore:
+            try:
+                return await analyze_transactions(session, wallet, coin_symbol, wa.CHAIN_MAP[coin_symbol], limit)
+            except Exception as e:
+                return str(e)
+
+    results = await asyncio.gather(*(analyze_chain(coin_symbol) for coin_symbol in wa.EVM_COINS))
+    return wa.portfolio_summary(wallet, dict(zip(wa.EVM_COINS, results)), limit)
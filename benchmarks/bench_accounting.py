@@ -0,0 +1,55 @@
+"""Micro-benchmark: float accounting vs exact base-unit accounting, end to end
+
+Each variant sums one wallet's native txs and renders the /analyze amounts:
+- float: per-tx float(value) / 1e18, round(..., 8), float USD (the old path)
+- int: native_flows, per-tx ints in wei, one Decimal conversion at the edge
+
+Usage: python benchmarks/bench_accounting.py [--sizes 100 10000 100000]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+from bench_aggregation import WALLET, float_loop, make_transactions, timed
+from wallet_analyzer import format_analysis, native_flows
+
+PRICE = 3456.78
+
+def float_accounting(transactions):
+    inflow, outflow = float_loop(transactions, WALLET)
+    inflow = round(inflow, 8)
+    outflow = round(outflow, 8)
+    net = inflow - outflow
+    return {
+        'received': f'{inflow:.8f}',
+        'sent': f'{outflow:.8f}',
+        'net': f'{net:.8f}',
+        'receivedUsd': f'{inflow * PRICE:,.2f}',
+        'sentUsd': f'{outflow * PRICE:,.2f}',
+        'netUsd': f'{inflow * PRICE - outflow * PRICE:,.2f}',
+    }
+
+def int_accounting(transactions):
+    inflow, outflow = native_flows(transactions, WALLET)
+    return format_analysis(WALLET, 'ETH', inflow, outflow, PRICE, 0, 18)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark float vs exact integer accounting')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000, 100_000])
+    args = parser.parse_args()
+
+    print(f'{"txs":>7}  {"float":>9}  {"int":>9}  {"int/float":>9}  float vs exact')
+    for size in args.sizes:
+        txs = make_transactions(size)
+        repeat = max(3, 100_000 // size)
+        float_time, float_result = timed(float_accounting, txs, repeat=repeat)
+        int_time, int_result = timed(int_accounting, txs, repeat=repeat)
+        differs = [key for key in float_result if float_result[key] != int_result[key]]
+        print(f'{size:>7}  {float_time * 1000:>7.2f}ms  {int_time * 1000:>7.2f}ms  '
+              f'{float_time / int_time:>8.2f}x  {", ".join(differs) or "same"}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Micro-benchmark: per-dict float loop vs exact integer aggregation (native_flows) vs columns
+
+The columnar variant pulls values and addresses out into NumPy arrays, picks
+each direction with one vectorized comparison and sums the picked values as
+exact ints. It is the layout the analysis path would need to decode pages
+into; it doesn't beat native_flows, so the analysis path keeps the loop.
+
+Usage: python benchmarks/bench_aggregation.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+from wallet_analyzer import native_flows
+
+WALLET = '0x742d35Cc6634C0532925a3b844Bc454e4438f44e'
+
+def float_loop(transactions, wallet):
+    """The original analyze_transactions loop, kept as the baseline"""
+    inflow = 0.0
+    outflow = 0.0
+    for tx in transactions:
+        if not tx.get('value') and not tx.get('native_value'):
+            continue
+        value = float(tx.get('value') or tx.get('native_value') or '0') / 1e18
+        to_address = tx.get('to_address', tx.get('to', '')).lower()
+        from_address = tx.get('from_address', tx.get('from', '')).lower()
+        if to_address == wallet.lower():
+            inflow += value
+        elif from_address == wallet.lower():
+            outflow += value
+    return inflow, outflow
+
+def exact_loop(transactions, wallet):
+    """Reference sums with Python ints"""
+    inflow = outflow = 0
+    wallet = wallet.lower()
+    for tx in transactions:
+        value = int(tx['value'])
+        if tx['to_address'].lower() == wallet:
+            inflow += value
+        elif tx['from_address'].lower() == wallet:
+            outflow += value
+    return inflow, outflow
+
+def columnar_flows(transactions, wallet):
+    """native_flows over columns: vectorized direction masks, exact sums of the picked values"""
+    values = np.array([tx.get('value') or tx.get('native_value') or '0' for tx in transactions], dtype=object)
+    to_addresses = np.char.lower(np.array([tx.get('to_address') or tx.get('to') or '' for tx in transactions], dtype='S'))
+    from_addresses = np.char.lower(np.array([tx.get('from_address') or tx.get('from') or '' for tx in transactions], dtype='S'))
+    key = wallet.lower().encode()
+    inflow = to_addresses == key
+    outflow = ~inflow & (from_addresses == key)
+    return sum(map(int, values[inflow])), sum(map(int, values[outflow]))
+
+def make_transactions(count, seed=7):
+    rng = random.Random(seed)
+    txs = []
+    for n in range(count):
+        other = f'0x{rng.getrandbits(160):040x}'
+        value = str(rng.randrange(10 ** rng.randint(12, 24)))
+        if n % 2:
+            txs.append({'value': value, 'to_address': WALLET.lower(), 'from_address': other})
+        else:
+            txs.append({'value': value, 'from_address': WALLET, 'to_address': other})
+    return txs
+
+def timed(fn, *args, repeat=3):
+    """Best wall time over repeat runs, and the result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inflow/outflow aggregation')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f'{"txs":>9}  {"float loop":>11}  {"int loop":>9}  {"columnar":>9}  {"int/float":>9}  '
+          f'{"col/int":>7}  exact  float error (wei)')
+    for size in args.sizes:
+        txs = make_transactions(size)
+        loop_time, (float_in, float_out) = timed(float_loop, txs, WALLET)
+        int_time, (wei_in, wei_out) = timed(native_flows, txs, WALLET)
+        columnar_time, columnar_result = timed(columnar_flows, txs, WALLET)
+        exact = (wei_in, wei_out) == exact_loop(txs, WALLET) == columnar_result
+        float_error = abs(int(float_in * 10 ** 18) - wei_in) + abs(int(float_out * 10 ** 18) - wei_out)
+        print(f'{size:>9}  {loop_time * 1000:>9.1f}ms  {int_time * 1000:>7.1f}ms  {columnar_time * 1000:>7.1f}ms  '
+              f'{loop_time / int_time:>8.1f}x  {int_time / columnar_time:>6.2f}x  {str(exact):<5}  {float_error}')
+
+if __name__ == '__main__':
+    main()
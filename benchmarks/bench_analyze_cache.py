@@ -0,0 +1,68 @@
+"""Benchmark: uncached vs cached /analyze for a burst of identical requests
+
+A popular wallet is hit by --clients concurrent identical POST /analyze
+requests, followed by the same burst again (repeat traffic within the TTL):
+- uncached: every request runs its own analysis (the previous behaviour)
+- cached: the first burst is coalesced into one analysis and the repeat is
+  served from the response cache; a final revalidation with If-None-Match
+  should return 304
+
+Usage: python benchmarks/bench_analyze_cache.py [--clients 50] [--pages 5] [--latency 0.02]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import api
+import wallet_analyzer as wa
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+BODY = {'wallet': '0x742d35cc6634c0532925a3b844bc454e4438f44e', 'coin': 'ETH', 'limit': 0}
+
+def uncached():
+    chain = wa.resolve_chain(BODY['coin'])
+    return api.run_analysis(BODY['wallet'], BODY['coin'], chain, BODY['limit'])[1]
+
+def cached():
+    with api.app.test_client() as client:
+        return client.post('/analyze', json=BODY).get_json()
+
+def burst(fn, clients):
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        return list(pool.map(lambda _: fn(), range(clients)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /analyze response cache')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=5, help='Moralis pages for the wallet')
+    parser.add_argument('--latency', type=float, default=0.02, help='Stub latency per request in seconds')
+    args = parser.parse_args()
+
+    with StubServer(make_upstream_route(pages=args.pages), latency=args.latency, process=True) as server:
+        use_stub_upstreams(wa, server.url)
+        wa.warm_price(BODY['wallet'], BODY['coin'], wa.resolve_chain(BODY['coin']))  # Price lookups aren't measured
+        print(f"{args.clients} identical requests x 2 bursts, {args.pages} pages per analysis, "
+              f'{args.latency * 1000:.0f} ms upstream latency')
+
+        results = []
+        for name, fn in (('uncached', uncached), ('cached', cached)):
+            server.reset_stats()
+            start = time.perf_counter()
+            results += burst(fn, args.clients) + burst(fn, args.clients)
+            elapsed = time.perf_counter() - start
+            print(f'{name:<9} {elapsed * 1000:>8.1f} ms  upstream requests {server.requests:>5}')
+
+        print(f'cache: {api.analysis_cache.stats()}')
+        with api.app.test_client() as client:
+            etag = client.post('/analyze', json=BODY).headers['ETag']
+            status = client.post('/analyze', json=BODY, headers={'If-None-Match': etag}).status_code
+        print(f'revalidation with If-None-Match: {status}')
+        print(f'identical results: {all(result == results[0] for result in results)}')
+
+if __name__ == '__main__':
+    main()
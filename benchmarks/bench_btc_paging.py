@@ -0,0 +1,61 @@
+"""Benchmark: BTC history paging for an address set, unbatched vs batched vs stored
+
+An xpub-style set of --addresses addresses, each with --txs confirmed txs,
+is analyzed with limit=0 against the stub:
+- per-address: BTC_BATCH_SIZE=1, one /addrs/{address}/full request per page
+- batched: BTC_BATCH_SIZE addresses per /addrs/{a;b;c}/full request
+- stored: the same with a tx store, first run and a re-analysis that only
+  asks for txs above the stored blocks
+
+Usage: python benchmarks/bench_btc_paging.py [--addresses 12] [--txs 200] [--batch 3] [--latency 0.02]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import wallet_analyzer as wa
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+from tx_store import TxStore
+
+def run(server, wallet):
+    server.reset_stats()
+    start = time.perf_counter()
+    inflow, outflow, _, _ = wa.analyze_transactions(wallet, 'BTC', 'btc', 0)
+    return time.perf_counter() - start, server.requests, (inflow, outflow)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched and stored BTC history paging')
+    parser.add_argument('--addresses', type=int, default=12)
+    parser.add_argument('--txs', type=int, default=200, help='Confirmed txs per address')
+    parser.add_argument('--batch', type=int, default=3, help='Addresses per batched request')
+    parser.add_argument('--latency', type=float, default=0.02, help='Stub latency per request in seconds')
+    args = parser.parse_args()
+
+    wallet = ';'.join(f'bc1qbench{n:04d}' for n in range(args.addresses))
+    with StubServer(make_upstream_route(pages=1, page_size=args.txs), latency=args.latency) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        use_stub_upstreams(wa, server.url)
+        wa.get_btc_price()  # Price lookups aren't measured
+        print(f'{args.addresses} addresses x {args.txs} txs, {args.latency * 1000:.0f} ms upstream latency')
+
+        results = []
+        wa.BTC_BATCH_SIZE = 1
+        modes = [('per-address', None), (f'batched x{args.batch}', None),
+                 ('stored, first run', TxStore(os.path.join(tmp, 'txs.sqlite3'))), ('stored, re-analysis', None)]
+        for name, store in modes:
+            if name.startswith('batched'):
+                wa.BTC_BATCH_SIZE = args.batch
+            if store is not None:
+                wa.tx_store = store
+            elapsed, requests, result = run(server, wallet)
+            results.append(result)
+            print(f'{name:<20} {elapsed * 1000:>8.1f} ms  upstream requests {requests:>4}')
+        print(f'identical totals: {all(result == results[0] for result in results)}')
+
+if __name__ == '__main__':
+    main()
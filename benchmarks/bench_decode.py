@@ -0,0 +1,117 @@
+"""Benchmark decoding a Moralis native tx page: full dicts vs compact records
+
+Pages carry every field Moralis returns for a native tx (about 25, with
+calldata), of which flows read three. Per 100-tx page, reports decode CPU
+time, decode plus flows (best of 3), and the memory the decoded page holds:
+
+- resp.json: stdlib json into dicts (the old path)
+- orjson:    orjson into dicts
+- compact:   page_decode.native_page into NativeTx records, with each
+             library PAGE_DECODER can use that is installed
+
+Every variant's flows are checked to match native_flows.
+
+Usage: python benchmarks/bench_decode.py [--pages 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import page_decode
+from wallet_analyzer import native_flows
+
+WALLET = '0x' + 'ab' * 20
+
+def moralis_tx(n):
+    incoming = n % 3 != 0
+    counterparty = f'0x{n:040x}'
+    return {
+        'hash': f'0x{n:064x}',
+        'nonce': str(n),
+        'transaction_index': str(n % 200),
+        'from_address_entity': None,
+        'from_address_entity_logo': None,
+        'from_address': counterparty if incoming else WALLET,
+        'from_address_label': None,
+        'to_address_entity': None,
+        'to_address_entity_logo': None,
+        'to_address': WALLET if incoming else counterparty,
+        'to_address_label': None,
+        'value': str((n % 7 + 1) * 10 ** 17 + n),
+        'gas': '21000',
+        'gas_price': str(20_000_000_000 + n),
+        'input': '0x' + 'a9059cbb' + f'{n:064x}' * 2,
+        'receipt_cumulative_gas_used': str(1_000_000 + n),
+        'receipt_gas_used': '21000',
+        'receipt_contract_address': None,
+        'receipt_root': None,
+        'receipt_status': '1',
+        'block_timestamp': '2024-05-01T12:00:00.000Z',
+        'block_number': str(19_000_000 - n // 2),
+        'block_hash': f'0x{n * 7:064x}',
+        'transfer_index': [19_000_000 - n // 2, n % 200],
+        'transaction_fee': '0.000420000000000000',
+    }
+
+def page_bytes(page, size=100):
+    txs = [moralis_tx(page * size + n) for n in range(size)]
+    return json.dumps({'page': page, 'page_size': size, 'cursor': f'cursor{page}', 'result': txs}).encode()
+
+def decode_variants():
+    variants = [('resp.json', lambda raw: json.loads(raw.decode('utf-8')), native_flows)]
+    if page_decode.orjson is not None:
+        variants.append(('orjson', page_decode.orjson.loads, native_flows))
+    for name, module in [('json', json), ('orjson', page_decode.orjson), ('msgspec', page_decode.msgspec)]:
+        if module is not None:
+            variants.append((f'compact {name}', page_decode.make_native_page(name), page_decode.native_flows))
+    return variants
+
+def best(run, repeats=3):
+    """Lowest CPU seconds of repeats runs"""
+    times = []
+    for _ in range(repeats):
+        start = time.process_time()
+        run()
+        times.append(time.process_time() - start)
+    return min(times)
+
+def retained_bytes(decode, raw):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    data = decode(raw)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del data
+    return held
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full vs compact decoding of Moralis pages')
+    parser.add_argument('--pages', type=int, default=200)
+    args = parser.parse_args()
+
+    pages = [page_bytes(n) for n in range(args.pages)]
+    expected = [native_flows(json.loads(raw)['result'], WALLET) for raw in pages]
+    print(f'{args.pages} pages of 100 txs, {sum(map(len, pages)) / len(pages) / 1024:.1f} KiB each')
+    print(f'{"decoder":<16} {"decode":>12} {"+ flows":>12} {"held":>12}')
+
+    baseline = None
+    for name, decode, flows in decode_variants():
+        decode_time = best(lambda: [decode(raw) and None for raw in pages]) / len(pages)
+        total_time = best(lambda: [flows(decode(raw)['result'], WALLET) for raw in pages]) / len(pages)
+        results = [flows(decode(raw)['result'], WALLET) for raw in pages]
+        if results != expected:
+            sys.exit(f'{name}: flows differ from native_flows')
+
+        held = retained_bytes(decode, pages[0])
+        baseline = baseline or (total_time, held)
+        print(f'{name:<16} {decode_time * 1e6:>9.0f} µs {total_time * 1e6:>9.0f} µs {held / 1024:>8.1f} KiB'
+              f'   {baseline[0] / total_time:4.1f}x faster, {baseline[1] / held:4.1f}x smaller')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Compare bare requests.get against the pooled http_get on a local stub
+
+Usage: python benchmarks/bench_http_pool.py [--requests 500] [--threads 8]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from http_pool import close_sessions, http_get
+from latency import percentile
+from stub_server import StubServer
+
+def run(get, url, total, threads):
+    latencies = []
+
+    def one(_):
+        start = time.perf_counter()
+        resp = get(url)
+        resp.json()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(total)))
+    return time.perf_counter() - start, latencies
+
+def report(name, server, elapsed, latencies):
+    latencies.sort()
+    p99 = percentile(latencies, 0.99)
+    print(f'{name:<14} {len(latencies) / elapsed:>9.0f} req/s  '
+          f'mean {statistics.mean(latencies) * 1000:6.2f} ms  '
+          f'p99 {p99 * 1000:6.2f} ms  '
+          f'handshakes {server.connections}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pooled vs bare HTTP GETs')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        url = f'{server.url}/api/v2.2/0xabc'
+
+        elapsed, latencies = run(requests.get, url, args.requests, args.threads)
+        report('requests.get', server, elapsed, latencies)
+
+        server.reset_stats()
+        close_sessions()
+        elapsed, latencies = run(http_get, url, args.requests, args.threads)
+        report('http_get', server, elapsed, latencies)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark: cost of the built-in metrics
+
+- per span: a bare `with metrics.span(...)` block, with metrics on and off
+  and with a Server-Timing collector active
+- end to end: a limit=0 native analysis against the stub with metrics on vs off
+
+Usage: python benchmarks/bench_metrics.py [--spans 200000] [--pages 200] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import metrics
+import wallet_analyzer as wa
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+WALLET = '0x742d35cc6634c0532925a3b844bc454e4438f44e'
+
+def per_span(count):
+    start = time.perf_counter()
+    for _ in range(count):
+        with metrics.span('bench'):
+            pass
+    return (time.perf_counter() - start) / count
+
+def analysis(repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = wa.analyze_transactions(WALLET, 'ETH', 'eth', 0)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark metrics overhead')
+    parser.add_argument('--spans', type=int, default=200_000)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    metrics.METRICS_ENABLED = False
+    off = per_span(args.spans)
+    metrics.METRICS_ENABLED = True
+    on = per_span(args.spans)
+    metrics.SERVER_TIMING = True
+    token = metrics.start_request()
+    timed = per_span(args.spans)
+    metrics.finish_request(token)
+    metrics.SERVER_TIMING = False
+    print(f'per span: off {off * 1e9:.0f} ns, on {on * 1e9:.0f} ns, on + Server-Timing {timed * 1e9:.0f} ns')
+
+    with StubServer(make_upstream_route(pages=args.pages), process=True) as server:
+        use_stub_upstreams(wa, server.url)
+        analysis(1)  # Warm the connection pool and price cache
+        results = []
+        for enabled in (False, True):
+            metrics.METRICS_ENABLED = enabled
+            elapsed, result = analysis(args.repeat)
+            results.append(result)
+            print(f'analysis of {args.pages} pages, metrics {"on " if enabled else "off"}: {elapsed * 1000:.1f} ms')
+        print(f'identical results: {results[0] == results[1]}')
+
+if __name__ == '__main__':
+    main()
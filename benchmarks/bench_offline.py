@@ -0,0 +1,142 @@
+"""Benchmark offline re-aggregation of a dump across worker processes
+
+Writes an NDJSON dump of --pages Moralis native pages (100 txs each) spread
+over --wallets ETH wallets, plus BlockCypher pages for a BTC address set,
+in shuffled order so every wallet's pages land in many chunks. Then runs
+offline.aggregate_dumps with 1, 2, 4, ... processes (up to --processes) and
+reports wall time, tx/s, speedup over one process and speedup per process,
+checking each run's totals against the sums written into the dump. Every
+figure is measured wall-clock time, including pool start-up, returning the
+partial sums and merging them.
+
+Pools larger than the host's CPU count only measure oversubscription, so
+they are skipped; run it on a host with at least --processes idle cores.
+
+Usage: python benchmarks/bench_offline.py [--pages 2000] [--wallets 200] [--processes <CPUs>] [--chunks 64]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import offline
+
+BTC_WALLET = 'bc1qbench0;bc1qbench1'
+
+def moralis_page(wallet, page, totals):
+    """A 100-tx Moralis page for wallet, adding its flows to totals"""
+    txs = []
+    for i in range(100):
+        n = page * 100 + i
+        incoming = n % 3 != 0
+        counterparty = f'0x{n:040x}'
+        value = (n % 7 + 1) * 10 ** 17 + n
+        totals[0 if incoming else 1] += value
+        txs.append({
+            'hash': f'0x{n:064x}',
+            'nonce': str(n),
+            'from_address': counterparty if incoming else wallet,
+            'to_address': wallet if incoming else counterparty,
+            'value': str(value),
+            'gas': '21000',
+            'gas_price': str(20_000_000_000 + n),
+            'input': '0x',
+            'receipt_gas_used': '21000',
+            'receipt_status': '1',
+            'block_timestamp': '2024-05-01T12:00:00.000Z',
+            'block_number': str(19_000_000 - n),
+            'block_hash': f'0x{n * 7:064x}',
+            'transaction_fee': '0.000420000000000000',
+        })
+    totals[2] += len(txs)
+    return {'cursor': f'page-{page}', 'page': page, 'page_size': 100, 'result': txs}
+
+def btc_listing(address, other, page, totals):
+    """A BlockCypher listing of address; every fifth tx pays the set's other address and counts once"""
+    txs = []
+    for i in range(50):
+        n = page * 50 + i
+        internal = n % 5 == 0
+        value = 10_000 + n
+        txs.append({
+            'hash': f'{address}-{n:060x}',
+            'block_height': 800_000 + n,
+            'confirmed': '2024-05-01T12:00:00Z',
+            'inputs': [{'addresses': [address if internal else f'bc1qpayer{n}'], 'output_value': value}],
+            'outputs': [{'addresses': [other if internal else address], 'value': value}],
+        })
+        if internal:
+            # Listed under both addresses, counted in the first one's listing only
+            if address < other:
+                totals[0] += value
+                totals[1] += value
+                totals[2] += 1
+        else:
+            totals[0] += value
+            totals[2] += 1
+    return {'address': address, 'txs': txs}
+
+def write_dump(path, pages, wallets):
+    """Write a shuffled dump; returns the expected {(wallet, coin): [inflow, outflow, txs]}"""
+    expected = {}
+    records = []
+    rng = random.Random(7)
+    for page in range(pages):
+        wallet = f'0x{rng.randrange(wallets):040x}'
+        totals = expected.setdefault((wallet, 'ETH'), [0, 0, 0])
+        records.append({'wallet': wallet, 'coin': 'ETH', 'page': moralis_page(wallet, page, totals)})
+    addresses = BTC_WALLET.split(';')
+    totals = expected.setdefault((BTC_WALLET, 'BTC'), [0, 0, 0])
+    for page in range(max(1, pages // 50)):
+        for address, other in (addresses, addresses[::-1]):
+            records.append({'wallet': BTC_WALLET, 'coin': 'BTC', 'page': btc_listing(address, other, page, totals)})
+    rng.shuffle(records)
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return expected
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline re-aggregation across processes')
+    parser.add_argument('--pages', type=int, default=2000, help='Moralis pages of 100 txs in the dump')
+    parser.add_argument('--wallets', type=int, default=200, help='ETH wallets the pages are spread over')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Largest pool size to run')
+    parser.add_argument('--chunks', type=int, default=64, help='Chunks to split the dump into')
+    args = parser.parse_args()
+    cpus = os.cpu_count() or 1
+    if args.processes > cpus:
+        print(f'Only {cpus} CPUs here: pools above {cpus} processes are skipped, since their speedup would '
+              f'measure oversubscription rather than scaling')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dump.ndjson')
+        expected = write_dump(path, args.pages, args.wallets)
+        size = os.path.getsize(path)
+        chunk_bytes = max(1, size // args.chunks)
+        ranges = offline.chunk_ranges(path, chunk_bytes)
+        txs = sum(totals[2] for totals in expected.values())
+        print(f'{txs} txs, {len(expected)} wallets, {size / 2 ** 20:.0f} MB in {len(ranges)} chunks; '
+              f'{os.cpu_count()} CPUs here')
+
+        print(f'{"processes":>9} {"wall":>9} {"tx/s":>10} {"speedup":>8} {"per process":>12}')
+        baseline = None
+        processes = 1
+        while processes <= min(args.processes, cpus):
+            start = time.perf_counter()
+            totals, bad, first_error = offline.aggregate_dumps([path], processes, chunk_bytes)
+            elapsed = time.perf_counter() - start
+            if bad or totals != expected:
+                sys.exit(f'{processes} processes: totals differ from the dump ({bad} bad records, first: {first_error})')
+            baseline = baseline or elapsed
+            print(f'{processes:>9} {elapsed:>7.2f} s {txs / elapsed:>10,.0f} {baseline / elapsed:>7.2f}x '
+                  f'{baseline / elapsed / processes:>11.2f}x')
+            processes *= 2
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark: one EVM address across every EVM chain, serial vs concurrent
+
+Each chain's Moralis listing answers with its own latency (the slowest at
+--slowest seconds per page), so a portfolio's wall time can be compared to
+the sum of its chains and to the slowest one:
+- serial: /analyze once per chain, one after another (what clients did)
+- portfolio: analyze_portfolio, every chain at once on the shared pool
+- async portfolio: the ASGI engine's analyze_portfolio on one event loop
+
+Usage: python benchmarks/bench_portfolio.py [--pages 3] [--slowest 0.08]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import async_analyzer
+import wallet_analyzer as wa
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+WALLET = '0x742d35cc6634c0532925a3b844bc454e4438f44e'
+
+def make_chain_latency_route(route, latencies):
+    """Delay Moralis pages by their chain's latency"""
+    def delayed(path, query):
+        time.sleep(latencies.get(query.get('chain'), 0))
+        return route(path, query)
+    return delayed
+
+def serial(limit):
+    return [wa.analyze_pair(WALLET, coin, wa.CHAIN_MAP[coin], limit) for coin in wa.EVM_COINS]
+
+async def async_portfolio(limit):
+    session = async_analyzer.create_session()
+    try:
+        return await async_analyzer.analyze_portfolio(session, WALLET, limit)
+    finally:
+        await session.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serial vs concurrent multi-chain analysis')
+    parser.add_argument('--pages', type=int, default=3, help='Moralis pages per chain')
+    parser.add_argument('--slowest', type=float, default=0.08, help='Seconds per page on the slowest chain')
+    args = parser.parse_args()
+
+    chains = [wa.CHAIN_MAP[coin] for coin in wa.EVM_COINS]
+    # Spread from a quarter of the slowest latency up to the slowest
+    latencies = {chain: args.slowest * (1 + 3 * i / (len(chains) - 1)) / 4 for i, chain in enumerate(chains)}
+    route = make_chain_latency_route(make_upstream_route(pages=args.pages), latencies)
+    with StubServer(route) as server:
+        use_stub_upstreams(wa, server.url)
+        wa.get_prices(wa.EVM_COINS)  # Price lookups aren't measured
+        print(f'{len(chains)} chains x {args.pages} pages, {min(latencies.values()) * 1000:.0f}-'
+              f'{args.slowest * 1000:.0f} ms per page')
+        print(f'sum of chains ~{sum(latencies.values()) * args.pages * 1000:.0f} ms, '
+              f'slowest chain ~{args.slowest * args.pages * 1000:.0f} ms')
+
+        totals = []
+        for name, fn in (('serial', lambda: serial(0)),
+                         ('portfolio', lambda: wa.analyze_portfolio(WALLET, 0)['chains']),
+                         ('async portfolio', lambda: asyncio.run(async_portfolio(0))['chains'])):
+            start = time.perf_counter()
+            records = fn()
+            elapsed = time.perf_counter() - start
+            totals.append([record.get('net') for record in records])
+            print(f'{name:<16} {elapsed * 1000:>8.1f} ms')
+        print(f'identical results: {all(total == totals[0] for total in totals)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Benchmark: per-coin price lookups vs batched multi-coin lookups
+
+Prices BTC plus every coin in CHAIN_MAP from a cold cache against the stub:
+- per-coin: warm_price for each coin in turn (the previous batch behaviour)
+- batched: one get_prices call for every coin
+- coalesced: one thread per coin, each calling get_prices([coin]) at once
+
+Usage: python benchmarks/bench_price_batch.py [--latency 0.02]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import wallet_analyzer as wa
+from cache import MemoryBackend, TTLCache
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+WALLET = '0x742d35cc6634c0532925a3b844bc454e4438f44e'
+COINS = ['BTC'] + list(wa.CHAIN_MAP)
+
+def per_coin():
+    for coin in COINS:
+        wa.warm_price(WALLET, coin, wa.resolve_chain(coin))
+
+def batched():
+    wa.get_prices(COINS)
+
+def coalesced():
+    with ThreadPoolExecutor(max_workers=len(COINS)) as pool:
+        list(pool.map(lambda coin: wa.get_prices([coin]), COINS))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched price lookups')
+    parser.add_argument('--latency', type=float, default=0.02, help='Stub latency per request in seconds')
+    args = parser.parse_args()
+
+    with StubServer(make_upstream_route(), latency=args.latency) as server:
+        use_stub_upstreams(wa, server.url)
+        print(f'{len(COINS)} coins, {args.latency * 1000:.0f} ms upstream latency')
+        for name, fn in (('per-coin', per_coin), ('batched', batched), ('coalesced', coalesced)):
+            wa.price_cache = TTLCache(MemoryBackend())
+            server.reset_stats()
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            priced = sum(wa.price_cache.get(wa.price_key(coin)) is not None for coin in COINS)
+            print(f'{name:<10} {elapsed * 1000:>7.1f} ms  upstream requests {server.requests:>3}  priced {priced}/{len(COINS)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark: sequential vs hedged vs raced price resolution against slow/flaky stub sources
+
+The stub imitates four price sources with different latency and error profiles:
+- moralis: usually 30 ms, but 15% of requests take 1 s (a slow tail)
+- coingecko: 60 ms
+- binance: 40 ms, 10% of requests fail with 500
+- coinbase: 80 ms
+
+Each mode resolves --lookups ETH prices with the cache bypassed and reports
+latency percentiles, upstream requests per lookup (cost) and which source won.
+
+Usage: python benchmarks/bench_price_hedging.py [--lookups 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import wallet_analyzer as wa
+from latency import percentile
+from price_resolver import PriceResolver
+from stub_server import StubServer, use_stub_upstreams
+
+WALLET = '0x742d35cc6634c0532925a3b844bc454e4438f44e'
+
+def make_price_route(seed=11):
+    rng = random.Random(seed)
+
+    def route(path, query):
+        if path.startswith('/api/v2.2/erc20/'):
+            time.sleep(1.0 if rng.random() < 0.15 else 0.03)
+            return 200, {'usdPrice': 2500.0}
+        if path.startswith('/simple/price'):
+            time.sleep(0.06)
+            return 200, {query['ids']: {'usd': 2500.0}}
+        if path.startswith('/ticker/price'):
+            time.sleep(0.04)
+            if rng.random() < 0.1:
+                return 500, {'msg': 'internal error'}
+            return 200, {'price': '2500.0'}
+        if path.startswith('/prices/'):
+            time.sleep(0.08)
+            return 200, {'data': {'amount': '2500.0'}}
+        return 404, {'message': 'not found'}
+
+    return route
+
+def sequential():
+    """The previous behaviour: each source in priority order until one answers"""
+    for name, url, source_headers, extract in wa.native_price_sources(WALLET, 'eth', 'ETH'):
+        try:
+            return wa.source_price(url, source_headers, extract), name
+        except Exception:
+            continue
+    raise Exception('Unable to fetch ETH price from any source')
+
+def resolved():
+    return wa.fetch_native_price(WALLET, 'eth', 'ETH'), None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark hedged price resolution')
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    with StubServer(make_price_route(), process=True) as server:
+        use_stub_upstreams(wa, server.url)
+        print(f'{"mode":<11} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8}  requests/lookup  wins')
+        for mode in ('sequential', 'hedge', 'race'):
+            if mode != 'sequential':
+                wa.price_resolver = PriceResolver(mode=mode)
+            lookup = sequential if mode == 'sequential' else resolved
+            time.sleep(1.2)  # Let requests still in flight from the previous mode drain
+            server.reset_stats()
+            latencies = []
+            winners = Counter()
+            for _ in range(args.lookups):
+                start = time.perf_counter()
+                price, winner = lookup()
+                latencies.append(time.perf_counter() - start)
+                winners[winner] += 1
+            time.sleep(1.2)  # Count the losers' requests too
+            latencies.sort()
+            if mode != 'sequential':
+                winners = Counter({name: s['wins'] for name, s in wa.price_resolver.stats().items()})
+            print(f'{mode:<11} ' + ' '.join(f'{percentile(latencies, q) * 1000:>6.0f}ms' for q in (0.5, 0.95, 0.99, 1.0)) +
+                  f'  {server.requests / args.lookups:>15.2f}  ' + ', '.join(f'{name} {n}' for name, n in winners.most_common()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Replayable load benchmark over recorded upstream fixtures
+
+record runs analyses against the real upstreams (or any compatible server
+given with --upstream) and saves every response as a fixture; see
+fixtures.py for the layout. run replays a fixture directory, or the
+synthetic stub when none is given, from a forked stub server with fixed
+latency, random jitter and injected 429s, and for each chain drives:
+
+  analyze  analyze_pair -> analyze_transactions on a thread pool
+  http     POST /analyze over HTTP against the Flask app
+
+Each (chain, target) runs in a fresh forked process so peak RSS and the
+price cache are its own. Reports req/s, p50/p99, errors, upstream calls
+(retries included) and peak RSS. The response cache is off, but concurrent
+identical POSTs still share one analysis, so replaying a fixture with
+--repeat shows fewer upstream calls per request over http than analyze.
+
+Usage:
+  python benchmarks/bench_replay.py record --pairs pairs.txt --limit 100 --out fixtures/mainnet
+  python benchmarks/bench_replay.py run [--fixtures fixtures/mainnet] [--repeat 10]
+      [--latency 0.05] [--jitter 0.02] [--throttle-rate 0.01] [--concurrency 16]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Recording from the real APIs needs the real key from .env, which an environment default would shadow
+if sys.argv[1:2] != ['record'] or '--upstream' in sys.argv:
+    os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+os.environ.setdefault('ANALYZE_CACHE_TTL', '0')
+
+import requests
+from werkzeug.serving import make_server
+
+import api
+import wallet_analyzer
+from fixtures import Recorder, load, make_replay_route, save
+from latency import percentile
+from stub_server import StubServer, make_faulty_route, make_upstream_route, use_stub_upstreams
+
+COINS = ['ETH', 'BNB', 'SOL', 'BTC']
+TARGETS = ['analyze', 'http']
+
+def record(args):
+    if args.upstream:
+        use_stub_upstreams(wallet_analyzer, args.upstream.rstrip('/'))
+    with open(args.pairs) as f:
+        pairs = [pair for pair in wallet_analyzer.read_pairs(f) if isinstance(pair, tuple)]
+
+    bodies = []
+    with Recorder(wallet_analyzer) as recorder:
+        for wallet, coin in pairs:
+            record = wallet_analyzer.analyze_pair(wallet, coin, wallet_analyzer.resolve_chain(coin), args.limit)
+            if 'error' in record:
+                print(f'{wallet} {coin}: {record["error"]}, not recorded', file=sys.stderr)
+                continue
+            bodies.append({'wallet': wallet, 'coin': coin, 'limit': args.limit})
+    save(args.out, list(recorder.responses.values()), bodies)
+    print(f'recorded {len(recorder.responses)} responses for {len(bodies)} analyses into {args.out}')
+
+def synthetic_bodies(wallets):
+    return [{'wallet': f'0x{n:040x}', 'coin': coin, 'limit': 0} for coin in COINS for n in range(wallets)]
+
+def analyze_one(body):
+    coin = body['coin']
+    record = wallet_analyzer.analyze_pair(body['wallet'], coin, wallet_analyzer.resolve_chain(coin), body['limit'])
+    return 'error' not in record
+
+def http_caller():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/analyze'
+    local = threading.local()
+
+    def post_one(body):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        try:
+            return local.session.post(url, json=body, timeout=60).status_code == 200
+        except requests.RequestException:
+            return False
+
+    return post_one
+
+def drive(target, bodies, concurrency, conn):
+    """Child process: run bodies through target and send back timings and peak RSS"""
+    call = analyze_one if target == 'analyze' else http_caller()
+    latencies = []
+    errors = 0
+
+    def one(body):
+        nonlocal errors
+        start = time.perf_counter()
+        ok = call(body)
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, bodies))
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    conn.send((elapsed, latencies, errors, peak_rss))
+    conn.close()
+
+def run_isolated(target, bodies, concurrency):
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=drive, args=(target, bodies, concurrency, sender))
+    child.start()
+    result = receiver.recv()
+    child.join()
+    return result
+
+def report(coin, target, elapsed, latencies, errors, calls, peak_rss):
+    latencies = sorted(latencies)
+    p50 = percentile(latencies, 0.5)
+    p99 = percentile(latencies, 0.99)
+    print(f'{coin:<5} {target:<8} {len(latencies) / elapsed:>8.1f} req/s  p50 {p50 * 1000:7.1f} ms  '
+          f'p99 {p99 * 1000:7.1f} ms  errors {errors:>3}  upstream {calls:>6} '
+          f'({calls / len(latencies):5.1f}/req)  peak RSS {peak_rss:6.1f} MiB')
+
+def run(args):
+    if args.fixtures:
+        responses, bodies = load(args.fixtures)
+        route = make_replay_route(responses)
+        bodies = bodies * args.repeat
+        print(f'replaying {len(responses)} recorded responses from {args.fixtures}')
+    else:
+        route = make_upstream_route(pages=args.pages)
+        bodies = synthetic_bodies(args.wallets)
+        print('no fixtures given; replaying the synthetic stub')
+    route = make_faulty_route(route, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                              retry_after=args.retry_after, seed=args.seed)
+    print(f'latency {args.latency * 1000:.0f} ms + up to {args.jitter * 1000:.0f} ms jitter, '
+          f'{args.throttle_rate:.1%} 429s, concurrency {args.concurrency}')
+
+    by_coin = {}
+    for body in bodies:
+        by_coin.setdefault(body['coin'].upper(), []).append(body)
+
+    failed = False
+    with StubServer(route, latency=args.latency, process=True) as server:
+        use_stub_upstreams(wallet_analyzer, server.url)
+        for coin, coin_bodies in by_coin.items():
+            for target in args.targets:
+                server.reset_stats()
+                elapsed, latencies, errors, peak_rss = run_isolated(target, coin_bodies, args.concurrency)
+                report(coin, target, elapsed, latencies, errors, server.requests, peak_rss)
+                failed = failed or errors > 0
+    if failed:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Record upstream fixtures and replay them under load')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recorder = commands.add_parser('record', help='Analyze wallets live and save their upstream responses')
+    recorder.add_argument('--pairs', required=True, help='File of "wallet,coin" lines')
+    recorder.add_argument('--limit', type=int, default=100)
+    recorder.add_argument('--out', required=True, help='Fixture directory to write')
+    recorder.add_argument('--upstream', help='Record from a stub-compatible server at this base URL instead')
+    recorder.set_defaults(func=record)
+
+    runner = commands.add_parser('run', help='Replay fixtures under load and report per-chain results')
+    runner.add_argument('--fixtures', help='Fixture directory; the synthetic stub when omitted')
+    runner.add_argument('--repeat', type=int, default=10, help='Times each recorded analysis is replayed')
+    runner.add_argument('--wallets', type=int, default=50, help='Synthetic wallets per chain')
+    runner.add_argument('--pages', type=int, default=2, help='Synthetic Moralis pages per wallet')
+    runner.add_argument('--targets', nargs='+', choices=TARGETS, default=TARGETS)
+    runner.add_argument('--concurrency', type=int, default=16)
+    runner.add_argument('--latency', type=float, default=0.05, help='Seconds every upstream call takes')
+    runner.add_argument('--jitter', type=float, default=0.02, help='Up to this many extra seconds per call')
+    runner.add_argument('--throttle-rate', type=float, default=0.01, help='Share of calls answered 429')
+    runner.add_argument('--retry-after', type=float, default=0.05, help='Retry-After seconds on injected 429s')
+    runner.add_argument('--seed', type=int, default=1)
+    runner.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
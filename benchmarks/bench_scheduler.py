@@ -0,0 +1,65 @@
+"""Benchmark: bare requests vs the scheduler against a rate-limited stub upstream
+
+The stub allows --quota requests per second and answers the rest with 429 +
+Retry-After. Each mode sends --requests GETs from --threads threads:
+- bare: http_pool.http_get, so every 429 reaches the caller
+- scheduled: scheduler.http_get with a bucket matching the quota
+- scheduled-over: a bucket at 4x the quota, relying on Retry-After and backoff
+
+Usage: python benchmarks/bench_scheduler.py [--quota 50] [--requests 300] [--threads 16]
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_pool
+import scheduler
+from stub_server import StubServer, default_route, make_throttled_route
+
+def run(get, url, total, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = Counter(pool.map(lambda _: get(url).status_code, range(total)))
+    return time.perf_counter() - start, statuses
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the rate-limit-aware scheduler')
+    parser.add_argument('--quota', type=int, default=50, help='Requests per second the stub accepts')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    with StubServer(make_throttled_route(default_route, args.quota)) as server:
+        url = f'{server.url}/api/v2.2/0xabc'
+        scheduler.UPSTREAM_BUCKETS['127.0.0.1'] = 'stub'
+
+        modes = [
+            ('bare', None),
+            ('scheduled', (args.quota, max(1, args.quota // 5))),
+            ('scheduled-over', (args.quota * 4, args.quota)),
+        ]
+        for name, limits in modes:
+            time.sleep(1)  # Start each mode on a fresh quota window
+            server.reset_stats()
+            if limits is None:
+                get = http_pool.http_get
+            else:
+                scheduler.buckets['stub'] = scheduler.TokenBucket(*limits)
+                get = scheduler.http_get
+            elapsed, statuses = run(get, url, args.requests, args.threads)
+            failed = args.requests - statuses[200]
+            line = (f'{name:<15} {elapsed:6.2f} s  {statuses[200] / elapsed:6.1f} ok/s  '
+                    f'failed {failed:>4}  upstream requests {server.requests:>4}')
+            if limits is not None:
+                stats = scheduler.buckets['stub'].stats()
+                line += (f'  max queued {stats["maxQueued"]:>3}  max wait {stats["maxWaitSeconds"]:5.2f} s  '
+                         f'throttled {stats["throttled"]}')
+            print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark cold start of the CLI and the API
+
+Each measurement runs in a fresh interpreter, median of --runs:
+
+- python:            bare interpreter start, for reference
+- import analyzer:   import wallet_analyzer
+- cli lookup:        import plus one wallet analysis against the local stub
+- import api:        import api (Flask app, job runner, caches)
+- gunicorn first 200: spawn gunicorn -c gunicorn.conf.py with one worker
+                     until GET /price-sources answers
+
+Usage: python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_server import STUB_PATHS, StubServer, make_upstream_route
+
+# Points the upstreams at the stub without importing stub_server, whose imports aren't the CLI's
+CLI_LOOKUP = '''
+import wallet_analyzer
+for name, prefix in {paths!r}.items():
+    setattr(wallet_analyzer, name, {url!r} + prefix)
+wallet_analyzer.main({wallet!r}, {coin!r}, 100)
+'''
+
+def run_python(code, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def gunicorn_first_response(env, timeout=30):
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', '1', '--bind', f'127.0.0.1:{port}', 'api:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/price-sources', timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError('gunicorn did not answer in time')
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CLI and API cold start')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ, MORALIS_API_KEY=os.getenv('MORALIS_API_KEY', 'benchmark'), PYTHONDONTWRITEBYTECODE='1')
+    with StubServer(make_upstream_route(pages=1), process=True) as server:
+        cases = [
+            ('python', lambda: run_python('pass', env)),
+            ('import analyzer', lambda: run_python('import wallet_analyzer', env)),
+            ('cli lookup', lambda: run_python(
+                CLI_LOOKUP.format(paths=STUB_PATHS, url=server.url, wallet='0x' + '1' * 40, coin='ETH'), env)),
+            ('import api', lambda: run_python('import api', env)),
+            ('gunicorn first 200', lambda: gunicorn_first_response(env)),
+        ]
+        for name, run in cases:
+            run()  # Warm the OS file cache and bytecode
+            times = [run() for _ in range(args.runs)]
+            print(f'{name:<20} median {statistics.median(times) * 1000:7.1f} ms  '
+                  f'min {min(times) * 1000:7.1f} ms')
+
+if __name__ == '__main__':
+    main()
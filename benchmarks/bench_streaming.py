@@ -0,0 +1,68 @@
+"""Benchmark: materialized vs streamed page aggregation for a limit=0 analysis
+
+Each mode sums one wallet's full native history served by a local stub:
+- materialize: collect every page into one list, then native_flows (the old path)
+- stream: stream_flows over pages as they arrive, fetching on demand
+- stream+prefetch: the same, with the next page fetched while one is aggregated
+
+Reports wall time and the peak Python heap (tracemalloc) for each mode.
+
+Usage: python benchmarks/bench_streaming.py [--pages 200] [--page-size 100] [--latency 0.005]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import wallet_analyzer as wa
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+WALLET = '0x742d35cc6634c0532925a3b844bc454e4438f44e'
+
+def materialize(url):
+    params = wa.page_params('eth', 0)
+    transactions = [tx for data in wa.iter_pages(url, params, 'native transfers') for tx in wa.page_txs(data)]
+    return wa.native_flows(transactions, WALLET)
+
+def stream(url):
+    return wa.stream_flows(wa.iter_tx_pages(url, 'eth', 0, 'native transfers'), wa.native_flows, WALLET)
+
+def measure(fn, url):
+    # Timed without tracemalloc, whose hooks would dominate the run
+    start = time.perf_counter()
+    result = fn(url)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark materialized vs streamed page aggregation')
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.005, help='Stub latency per request in seconds')
+    args = parser.parse_args()
+
+    route = make_upstream_route(pages=args.pages, page_size=args.page_size)
+    with StubServer(route, latency=args.latency, process=True) as server:
+        use_stub_upstreams(wa, server.url)
+        url = f'{wa.MORALIS_API}/{WALLET}'
+        materialize(url)  # Warm the connection pool
+
+        results = []
+        print(f'{args.pages * args.page_size} txs in {args.pages} pages, {args.latency * 1000:.0f} ms upstream latency')
+        for name, fn, depth in (('materialize', materialize, 0), ('stream', stream, 0), ('stream+prefetch', stream, 1)):
+            wa.PAGE_PREFETCH = depth
+            elapsed, peak, result = measure(fn, url)
+            results.append(result)
+            print(f'{name:<16} {elapsed * 1000:>8.1f} ms  peak heap {peak / 2 ** 20:>7.2f} MiB')
+        print(f'identical totals: {all(result == results[0] for result in results)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark historical USD valuation: local OHLC index vs a price request per tx
+
+Loads an hourly ETH index from the stub's klines, then over --pages pages
+of native txs compares:
+
+- spot:         analyze_period at today's price (no per-tx valuation)
+- index:        analyze_period with valuation='historical', each tx valued
+                from the memory-mapped price_history index
+- per-tx API:   one klines request per tx for its hour, as valuing without
+                an index would; run on --sample txs and extrapolated
+
+and the raw cost of one index lookup. The index and per-tx totals are
+checked to agree on the sample.
+
+Usage: python benchmarks/bench_valuation.py [--pages 50] [--latency 0.02] [--sample 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+os.environ.setdefault('PRICE_HISTORY_DIR', tempfile.mkdtemp(prefix='price_history'))
+
+import price_history
+import wallet_analyzer as wa
+from scheduler import http_get
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+WALLET = '0x' + '1' * 40
+
+def per_tx_api(txs):
+    """Cost basis with a klines request per tx"""
+    inflow_usd = outflow_usd = Decimal(0)
+    for tx in txs:
+        opened = price_history.epoch(wa.tx_timestamp(tx)) // 3600 * 3600
+        resp = http_get(f'{wa.BINANCE_API}/klines', params={
+            'symbol': 'ETHUSDT', 'interval': '1h', 'startTime': opened * 1000, 'limit': 1})
+        price = float(resp.json()[0][4])
+        tx_in, tx_out = wa.native_flows([tx], WALLET)
+        inflow_usd += wa.to_usd(wa.to_display(tx_in, 18), price)
+        outflow_usd += wa.to_usd(wa.to_display(tx_out, 18), price)
+    return inflow_usd, outflow_usd
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark index vs per-tx historical valuation')
+    parser.add_argument('--pages', type=int, default=50, help='Pages of 100 txs to value')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds every upstream call takes')
+    parser.add_argument('--sample', type=int, default=200, help='Txs valued with per-tx requests')
+    args = parser.parse_args()
+
+    with StubServer(make_upstream_route(pages=args.pages), latency=args.latency, process=True) as server:
+        use_stub_upstreams(wa, server.url)
+        wa.get_native_price(WALLET, 'eth', 'ETH')  # Price cached up front, so only listings are counted
+
+        start = time.perf_counter()
+        index = price_history.load('ETH', price_history.epoch('2024-01-01T00:00:00'))
+        print(f'loaded {len(index.rows)} hourly candles in {time.perf_counter() - start:.2f} s '
+              f'({server.requests} requests)')
+
+        txs = args.pages * 100
+        print(f'{txs} txs, {args.latency * 1000:.0f} ms per call')
+        for name, valuation in [('spot', None), ('index', 'historical')]:
+            server.reset_stats()
+            start = time.perf_counter()
+            result = wa.analyze_period(WALLET, 'ETH', 'eth', 0, valuation=valuation)
+            elapsed = time.perf_counter() - start
+            print(f'{name:<12} {elapsed * 1000:>8.0f} ms  {server.requests:>6} requests')
+
+        sample = wa.get_native_transactions(WALLET, 'eth', 'ETH', args.sample)
+        server.reset_stats()
+        start = time.perf_counter()
+        expected = per_tx_api(sample)
+        elapsed = time.perf_counter() - start
+        print(f'{"per-tx API":<12} {elapsed / len(sample) * txs * 1000:>8.0f} ms  {server.requests / len(sample) * txs:>6.0f} '
+              f'requests (extrapolated from {len(sample)} txs)')
+
+        valued = wa.valued_flows(wa.native_flows, index, 18)(sample, WALLET)
+        if valued[2:4] != expected:
+            sys.exit(f'index valuation {valued[2:4]} differs from per-tx {expected}')
+
+        timestamps = [wa.tx_timestamp(tx) for tx in sample] * 50
+        start = time.perf_counter()
+        for timestamp in timestamps:
+            index.close_at(timestamp)
+        print(f'index lookup {(time.perf_counter() - start) / len(timestamps) * 1e6:.2f} µs; '
+              f'index total {result[5][0]:,.2f} in / {result[5][1]:,.2f} out USD')
+
+if __name__ == '__main__':
+    main()
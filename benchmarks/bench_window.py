@@ -0,0 +1,67 @@
+"""Benchmark a date-windowed analysis against fetching the full history
+
+The stub lists --pages pages of native txs, blocks an hour apart (two txs
+each), and honors from_date/to_date like Moralis. For windows of the last
+1, 7 and 30 days, compares:
+
+- full + filter: fetch the whole history and keep the window's txs
+                 client-side (what a caller had to do without windows)
+- windowed:      analyze_period with the window, so only its pages are listed
+- windowed daily: the same with bucket='day'
+
+and checks every variant's totals agree. Reports upstream requests and wall time.
+
+Usage: python benchmarks/bench_window.py [--pages 20] [--latency 0.05]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+
+import wallet_analyzer as wa
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+WALLET = '0x' + '1' * 40
+# The stub's newest block time
+HEAD = datetime(2024, 6, 1)
+
+def full_then_filter(window):
+    txs = wa.get_native_transactions(WALLET, 'eth', 'ETH', 0)
+    return wa.native_flows([tx for tx in txs if wa.in_window(wa.tx_timestamp(tx), window)], WALLET)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark windowed vs full-history analysis')
+    parser.add_argument('--pages', type=int, default=20, help='Pages of 100 txs in the stub history')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds every upstream call takes')
+    args = parser.parse_args()
+
+    with StubServer(make_upstream_route(pages=args.pages), latency=args.latency, process=True) as server:
+        use_stub_upstreams(wa, server.url)
+        wa.get_native_price(WALLET, 'eth', 'ETH')  # Price cached up front, so only listings are counted
+        print(f'{args.pages * 100} txs over {args.pages * 50 / 24:.0f} days, {args.latency * 1000:.0f} ms per call')
+        print(f'{"window":<8} {"variant":<16} {"requests":>8} {"time":>10}')
+
+        for days in (1, 7, 30):
+            window = wa.parse_window((HEAD - timedelta(days=days)).strftime('%Y-%m-%d'))
+            variants = [
+                ('full + filter', lambda: full_then_filter(window)),
+                ('windowed', lambda: wa.analyze_period(WALLET, 'ETH', 'eth', 0, window)[:2]),
+                ('windowed daily', lambda: wa.analyze_period(WALLET, 'ETH', 'eth', 0, window, 'day')[:2]),
+            ]
+            expected = None
+            for name, run in variants:
+                server.reset_stats()
+                start = time.perf_counter()
+                flows = run()
+                elapsed = time.perf_counter() - start
+                expected = expected or flows
+                if flows != expected:
+                    sys.exit(f'{days}d {name}: flows differ from full + filter')
+                print(f'{days:>2} days  {name:<16} {server.requests:>8} {elapsed * 1000:>7.0f} ms')
+
+if __name__ == '__main__':
+    main()
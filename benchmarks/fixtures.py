@@ -0,0 +1,102 @@
+"""Record upstream responses into fixtures and replay them through the stub server
+
+A fixture directory holds responses.ndjson, one {"path", "query", "status",
+"body"} record per distinct upstream request with paths rewritten to the
+stub's layout (STUB_PATHS), and requests.json, the {"wallet", "coin",
+"limit"} analyses that produced them. API keys travel in headers and are
+never written.
+"""
+import json
+import os
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import http_pool
+import scheduler
+from stub_server import STUB_PATHS
+
+RESPONSES_FILE = 'responses.ndjson'
+REQUESTS_FILE = 'requests.json'
+
+def query_key(query):
+    return tuple(sorted(query.items()))
+
+class Recorder:
+    """Capture every upstream response module's analyses receive while installed"""
+
+    def __init__(self, module):
+        # Longest base first, so a base that prefixes another can't claim its URLs
+        bases = [(getattr(module, name), prefix) for name, prefix in STUB_PATHS.items()]
+        self.bases = sorted(bases, key=lambda item: -len(item[0]))
+        self.responses = {}
+        self._lock = threading.Lock()
+        self._http_get = None
+
+    def stub_path(self, url):
+        path = unquote(urlsplit(url).path)
+        for base, prefix in self.bases:
+            base_path = urlsplit(base).path
+            if urlsplit(url).netloc == urlsplit(base).netloc and path.startswith(base_path):
+                return prefix + path[len(base_path):]
+        return None
+
+    def record(self, resp):
+        path = self.stub_path(resp.url)
+        if path is None or resp.status_code in scheduler.RETRY_STATUSES:
+            return  # Throttling is injected at replay time instead
+        try:
+            body = resp.json()
+        except ValueError:
+            return
+        query = {k: v[-1] for k, v in parse_qs(urlsplit(resp.url).query).items()}
+        with self._lock:
+            self.responses[(path, query_key(query))] = {
+                'path': path, 'query': query, 'status': resp.status_code, 'body': body}
+
+    def __enter__(self):
+        self._http_get = http_pool.http_get
+
+        def http_get(url, **kwargs):
+            resp = self._http_get(url, **kwargs)
+            self.record(resp)
+            return resp
+
+        http_pool.http_get = http_get
+        return self
+
+    def __exit__(self, *exc):
+        http_pool.http_get = self._http_get
+
+def save(directory, responses, requests):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, RESPONSES_FILE), 'w') as f:
+        for response in responses:
+            f.write(json.dumps(response) + '\n')
+    with open(os.path.join(directory, REQUESTS_FILE), 'w') as f:
+        json.dump(requests, f, indent=1)
+
+def load(directory):
+    """Return (responses, requests) from a fixture directory"""
+    with open(os.path.join(directory, RESPONSES_FILE)) as f:
+        responses = [json.loads(line) for line in f if line.strip()]
+    with open(os.path.join(directory, REQUESTS_FILE)) as f:
+        requests = json.load(f)
+    return responses, requests
+
+def make_replay_route(responses, fallback=None):
+    """Route serving recorded responses by exact path and query
+
+    Requests with no fixture go to fallback, or get a 404 naming the path.
+    """
+    recorded = {(response['path'], query_key(response['query'])): (response['status'], response['body'])
+                for response in responses}
+
+    def route(path, query):
+        hit = recorded.get((unquote(path), query_key(query)))
+        if hit is not None:
+            return hit
+        if fallback is not None:
+            return fallback(path, query)
+        return 404, {'message': f'No fixture for {unquote(path)}'}
+
+    return route
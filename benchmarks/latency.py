@@ -0,0 +1,6 @@
+"""Latency percentiles shared by the benchmarks"""
+import math
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of sorted samples, e.g. fraction 0.99 for p99; 1.0 is the maximum"""
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(len(ordered) * fraction) - 1))]
@@ -0,0 +1,117 @@
+"""Load test the ASGI /analyze route against local mock upstreams
+
+Drives asgi.app in-process with many concurrent requests, reports
+requests/sec and latency percentiles, and runs the same wallets through the
+sync Flask route on a thread pool for comparison. A sample of responses is
+checked to be identical between the two paths.
+
+Usage: python benchmarks/load_async.py [--wallets 500] [--concurrency 200] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MORALIS_API_KEY', 'benchmark')
+# Both apps share one in-process response cache; disable it so each engine does its own work
+os.environ.setdefault('ANALYZE_CACHE_TTL', '0')
+
+import api
+import asgi
+import wallet_analyzer
+from latency import percentile
+from stub_server import StubServer, make_upstream_route, use_stub_upstreams
+
+COINS = ['ETH', 'BNB', 'SOL', 'BTC']
+
+def request_bodies(count):
+    return [{'wallet': f'0x{n:040x}', 'coin': COINS[n % len(COINS)], 'limit': 0} for n in range(count)]
+
+async def asgi_post(body):
+    """Call asgi.app directly and return (status, decoded JSON)"""
+    messages = []
+    payload = json.dumps(body).encode()
+
+    async def receive():
+        return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/analyze', 'headers': []}
+    await asgi.app(scope, receive, send)
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+async def run_async(bodies, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    results = []
+
+    async def one(body):
+        async with semaphore:
+            start = time.perf_counter()
+            results.append((body['wallet'], await asgi_post(body)))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in bodies))
+    elapsed = time.perf_counter() - start
+    await asgi.close_session()
+    return elapsed, latencies, dict(results)
+
+def run_sync(bodies, threads):
+    client = api.app.test_client()
+    latencies = []
+    results = []
+
+    def one(body):
+        start = time.perf_counter()
+        resp = client.post('/analyze', json=body)
+        latencies.append(time.perf_counter() - start)
+        results.append((body['wallet'], (resp.status_code, resp.get_json())))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, bodies))
+    return time.perf_counter() - start, latencies, dict(results)
+
+def report(name, elapsed, latencies):
+    latencies = sorted(latencies)
+    p50 = percentile(latencies, 0.5)
+    p99 = percentile(latencies, 0.99)
+    print(f'{name:<22} {len(latencies) / elapsed:>8.1f} req/s  '
+          f'p50 {p50 * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the async /analyze engine')
+    parser.add_argument('--wallets', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16, help='Flask worker threads for the sync baseline')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each mock upstream call takes')
+    parser.add_argument('--pages', type=int, default=2, help='Moralis pages per wallet')
+    args = parser.parse_args()
+
+    bodies = request_bodies(args.wallets)
+    with StubServer(make_upstream_route(pages=args.pages), latency=args.latency, process=True) as server:
+        use_stub_upstreams(wallet_analyzer, server.url)
+
+        elapsed, latencies, async_results = asyncio.run(run_async(bodies, args.concurrency))
+        report(f'asgi (c={args.concurrency})', elapsed, latencies)
+        async_calls = server.requests
+
+        server.reset_stats()
+        elapsed, latencies, sync_results = run_sync(bodies, args.threads)
+        report(f'flask (threads={args.threads})', elapsed, latencies)
+        print(f'upstream calls: async {async_calls}, sync {server.requests}')
+
+    mismatched = [wallet for wallet in async_results if async_results[wallet] != sync_results[wallet]]
+    print(f'identical results: {len(async_results) - len(mismatched)}/{len(async_results)}')
+    if mismatched:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Local HTTP stub standing in for Moralis/BlockCypher/price upstreams"""
+import json
+import multiprocessing
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # Every new TCP connection is one handshake a real upstream would charge us
+        with self.server.connections.get_lock():
+            self.server.connections.value += 1
+
+    def do_GET(self):
+        with self.server.requests.get_lock():
+            self.server.requests.value += 1
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        # Routes return (status, body) or (status, body, extra headers)
+        status, body, *extra = self.server.route(parts.path, query)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (extra[0] if extra else {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(ThreadingHTTPServer):
+    # The default backlog of 5 drops SYNs under load and adds 1s retransmits
+    request_queue_size = 1024
+    daemon_threads = True
+
+def default_route(path, query):
+    return 200, {'result': [], 'cursor': None, 'usdPrice': 1.0}
+
+def make_upstream_route(pages=2, page_size=100):
+    """Route that imitates every upstream with deterministic per-wallet data
+
+    Point wallet_analyzer at it with use_stub_upstreams(module, server.url).
+    """
+    total = pages * page_size
+    head_block = 20_000_000
+    # Blocks an hour apart, so a couple of pages span several days
+    head_time = int(datetime(2024, 6, 1, tzinfo=timezone.utc).timestamp())
+    block_seconds = 3600
+    btc_head = 850_000
+
+    def block_timestamp(blocks_back):
+        moment = datetime.fromtimestamp(head_time - blocks_back * block_seconds, timezone.utc)
+        return moment.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def seconds_back(text):
+        # Seconds before head_time of a from_date/to_date parameter
+        return head_time - datetime.fromisoformat(text).timestamp()
+
+    def wallet_tx(wallet, n):
+        # n = 0 is the newest tx; two txs per block exercise same-block overlap
+        value = str((n % 7 + 1) * 10 ** 16 + n)
+        tx = {'hash': f'0x{n:064x}', 'block_number': str(head_block - n // 2), 'value': value,
+              'block_timestamp': block_timestamp(n // 2)}
+        if n % 3:
+            tx.update(to_address=wallet, from_address=f'0x{n:040x}')
+        else:
+            tx.update(from_address=wallet, to_address=f'0x{n:040x}')
+        return tx
+
+    def listing(wallet, query):
+        """Newest-first page honoring limit, cursor, from_block/to_block and from_date/to_date"""
+        # Tx n is in block head_block - n // 2, so block and time bounds map straight to a range of n
+        first, end = 0, total
+        if 'from_block' in query:
+            end = min(end, 2 * (head_block - int(query['from_block'])) + 2)
+        if 'to_block' in query:
+            first = max(first, 2 * (head_block - int(query['to_block'])))
+        if 'from_date' in query:
+            end = min(end, 2 * (int(seconds_back(query['from_date']) // block_seconds) + 1))
+        if 'to_date' in query:
+            first = max(first, 2 * -int(-seconds_back(query['to_date']) // block_seconds))
+        size = int(query.get('limit', page_size))
+        offset = int(query.get('cursor', '0'))
+        start = first + offset
+        cursor = str(offset + size) if start + size < end else None
+        return {'result': [wallet_tx(wallet, n) for n in range(start, min(end, start + size))], 'cursor': cursor}
+
+    def btc_tx(address, n):
+        # n = 0 is unconfirmed; then three txs per block, the newest few short of final
+        height = btc_head - (n - 1) // 3 if n else -1
+        value = (n % 7 + 1) * 10 ** 6 + n
+        tx = {
+            'hash': f'{address}:{n}',
+            'block_height': height,
+            'confirmations': btc_head - height + 1 if n else 0,
+            'confirmed': block_timestamp(btc_head - height) if n else None,
+            'inputs': [{'addresses': [f'src{n}'], 'output_value': value}],
+            'outputs': [{'addresses': [f'dst{n}'], 'value': value}],
+        }
+        if n % 3:
+            tx['outputs'].append({'addresses': [address], 'value': value})
+        else:
+            tx['inputs'].append({'addresses': [address], 'output_value': value})
+        return tx
+
+    def btc_listing(address, query):
+        """Newest-first /addrs/{address}/full page honoring limit, before and after"""
+        # Tx n >= 1 is in block btc_head - (n - 1) // 3, so height bounds map straight to a range of n
+        first, end = 0, total + 1
+        if 'before' in query:
+            first = max(1, 3 * (btc_head - int(query['before'])) + 4)
+        if 'after' in query:
+            end = min(end, 3 * (btc_head - int(query['after'])) + 1)
+        size = min(50, int(query.get('limit', 10)))
+        txs = [btc_tx(address, n) for n in range(first, min(end, first + size))]
+        return {'address': address, 'txs': txs, 'hasMore': first + size < end}
+
+    def hourly_price(opened):
+        # Deterministic price per hour, so historical valuations are checkable
+        return 2000.0 + opened // 3600 % 500
+
+    def klines(query):
+        """Binance /klines rows honoring interval, startTime, endTime and limit"""
+        seconds = {'1h': 3600, '1d': 86400}[query['interval']]
+        opened = -(-int(query['startTime']) // 1000 // seconds) * seconds
+        end = min(int(query.get('endTime', head_time * 1000)) // 1000, head_time)
+        rows = []
+        while opened <= end and len(rows) < int(query.get('limit', 500)):
+            price = str(hourly_price(opened))
+            rows.append([opened * 1000, price, price, price, price, '1.0', (opened + seconds) * 1000 - 1])
+            opened += seconds
+        return rows
+
+    def route(path, query):
+        parts = path.strip('/').split('/')
+        if path.startswith('/klines'):
+            return 200, klines(query)
+        if path.startswith('/coins/') and parts[-1] == 'range':
+            start, end = int(query['from']) // 3600 * 3600, min(int(query['to']), head_time)
+            return 200, {'prices': [[opened * 1000, hourly_price(opened)] for opened in range(start, end + 1, 3600)]}
+        if path.startswith('/simple/price'):
+            return 200, {coin_id: {'usd': 2500.0} for coin_id in query.get('ids', 'bitcoin').split(',')}
+        if path.startswith('/ticker/price'):
+            if 'symbols' in query:
+                return 200, [{'symbol': symbol, 'price': '2500.0'} for symbol in json.loads(query['symbols'])]
+            return 200, {'price': '2500.0'}
+        if path.startswith('/exchange-rates'):
+            return 200, {'data': {'currency': 'USD', 'rates': {'BTC': '0.0004', 'ETH': '0.0004', 'SOL': '0.0004'}}}
+        if 'price' in parts:
+            return 200, {'usdPrice': 2500.0}
+        if path.startswith('/prices/'):
+            return 200, {'data': {'amount': '2500.0'}}
+        if path.startswith('/v1/btc/main/addrs/') and parts[-1] == 'full':
+            listings = [btc_listing(address, query) for address in parts[4].split(';')]
+            return 200, listings if len(listings) > 1 else listings[0]
+        if path.startswith('/v1/btc/main/addrs/'):
+            return 200, {'address': parts[4], 'total_received': 123456789, 'total_sent': 23456789}
+        if path.startswith('/account/mainnet/'):
+            wallet, kind = parts[2], parts[3]
+            if kind == 'balance':
+                return 200, {'solana': '1.5'}
+            if kind == 'transfers':
+                return 200, {'result': [
+                    {'type': 'sol', 'amount': '2.25', 'to_address': wallet, 'from_address': 'Src1',
+                     'block_timestamp': block_timestamp(3)},
+                    {'type': 'sol', 'amount': '0.75', 'from_address': wallet, 'to_address': 'Dst1',
+                     'block_timestamp': block_timestamp(40)},
+                ]}
+            return 200, {'result': []}
+        if path.startswith('/api/v2.2/'):
+            return 200, listing(parts[2], query)
+        return 404, {'message': 'not found'}
+
+    return route
+
+def make_throttled_route(route, per_second):
+    """Wrap route so it serves at most per_second requests per one-second window
+
+    Excess requests get a 429 with Retry-After set to the end of the window,
+    like a metered upstream.
+    """
+    lock = threading.Lock()
+    window = {'start': time.monotonic(), 'count': 0}
+
+    def throttled(path, query):
+        with lock:
+            now = time.monotonic()
+            if now - window['start'] >= 1:
+                window['start'], window['count'] = now, 0
+            window['count'] += 1
+            if window['count'] > per_second:
+                retry_after = f'{window["start"] + 1 - now:.3f}'
+                return 429, {'message': 'Rate limit exceeded'}, {'Retry-After': retry_after}
+        return route(path, query)
+
+    return throttled
+
+def make_faulty_route(route, jitter=0.0, throttle_rate=0.0, retry_after=0.05, seed=None):
+    """Wrap route with up to jitter seconds of random extra latency and a throttle_rate share of 429s
+
+    Injected 429s carry Retry-After: retry_after, so the scheduler's retries
+    show up in the upstream call counts and tail latencies.
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def faulty(path, query):
+        with lock:
+            delay = rng.uniform(0, jitter) if jitter else 0.0
+            throttled = rng.random() < throttle_rate
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            return 429, {'message': 'Rate limit exceeded'}, {'Retry-After': f'{retry_after:g}'}
+        return route(path, query)
+
+    return faulty
+
+# Path prefix each upstream URL constant is served under by the stub
+STUB_PATHS = {
+    'MORALIS_API': '/api/v2.2',
+    'SOLANA_GATEWAY': '',
+    'COINGECKO_API': '',
+    'BINANCE_API': '',
+    'COINBASE_API': '',
+    'BLOCKCYPHER_API': '/v1/btc/main',
+}
+
+def use_stub_upstreams(module, base_url):
+    """Point a module's upstream URL constants at the stub server"""
+    for name, prefix in STUB_PATHS.items():
+        setattr(module, name, base_url + prefix)
+
+class StubServer:
+    """Threaded keep-alive stub that counts connections and requests
+
+    With process=True the server runs in a forked child so it doesn't compete
+    with the code under test for the GIL.
+    """
+
+    def __init__(self, route=default_route, latency=0.0, port=0, process=False):
+        self.httpd = _Server(('127.0.0.1', port), _Handler)
+        self.httpd.route = route
+        self.httpd.latency = latency
+        self.httpd.connections = multiprocessing.Value('l', 0)
+        self.httpd.requests = multiprocessing.Value('l', 0)
+        if process:
+            self.runner = multiprocessing.get_context('fork').Process(target=self.httpd.serve_forever, daemon=True)
+        else:
+            self.runner = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def connections(self):
+        return self.httpd.connections.value
+
+    @property
+    def requests(self):
+        return self.httpd.requests.value
+
+    def reset_stats(self):
+        self.httpd.connections.value = 0
+        self.httpd.requests.value = 0
+
+    def __enter__(self):
+        self.runner.start()
+        return self
+
+    def __exit__(self, *exc):
+        if isinstance(self.runner, threading.Thread):
+            self.httpd.shutdown()
+        else:
+            self.runner.terminate()
+            self.runner.join()
+        self.httpd.server_close()
@@ -0,0 +1,287 @@
+"""Pluggable TTL cache with stale-while-revalidate and single-flight loads
+
+Backends store JSON-able entries of the form
+{'value': ..., 'fresh_until': epoch, 'stale_until': epoch} and provide short
+leases so that only one process refreshes a key at a time:
+
+- MemoryBackend: per-process LRU dict
+- SQLiteBackend: a file shared by every worker on the host
+- RedisBackend: any redis-py compatible client (get/set/delete)
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class MemoryBackend:
+    """In-process LRU store; leases only coordinate threads of this process"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def acquire_lease(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            if self._leases.get(key, 0) > now:
+                return False
+            self._leases[key] = now + ttl
+            return True
+
+    def has_lease(self, key):
+        with self._lock:
+            return self._leases.get(key, 0) > time.time()
+
+    def release_lease(self, key):
+        with self._lock:
+            self._leases.pop(key, None)
+
+class SQLiteConnections:
+    """Callable returning this thread's autocommit connection to a SQLite file
+
+    Connections must not cross threads or forked workers, so each thread of
+    each process opens its own.
+    """
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+class SQLiteBackend:
+    """Entries in a SQLite file, shared by every process that opens it"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = SQLiteConnections(path, timeout=5)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, entry TEXT NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL)')
+
+    def get(self, key):
+        row = self._conn().execute('SELECT entry FROM entries WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, entry):
+        self._conn().execute('INSERT OR REPLACE INTO entries (key, entry) VALUES (?, ?)', (key, json.dumps(entry)))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def acquire_lease(self, key, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('DELETE FROM leases WHERE key = ? AND expires <= ?', (key, now))
+        cur = conn.execute('INSERT OR IGNORE INTO leases (key, expires) VALUES (?, ?)', (key, now + ttl))
+        return cur.rowcount == 1
+
+    def has_lease(self, key):
+        row = self._conn().execute('SELECT 1 FROM leases WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return row is not None
+
+    def release_lease(self, key):
+        self._conn().execute('DELETE FROM leases WHERE key = ?', (key,))
+
+class RedisBackend:
+    """Entries in Redis; client defaults to redis.Redis.from_url(url)"""
+
+    def __init__(self, url='redis://localhost:6379/0', client=None, prefix='wallet-analyzer:'):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError('The redis cache backend needs the redis package: pip install redis')
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, entry):
+        # Let Redis drop the entry once even the stale copy is useless
+        px = max(1, int((entry['stale_until'] - time.time()) * 1000))
+        self.client.set(self.prefix + key, json.dumps(entry), px=px)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def acquire_lease(self, key, ttl):
+        return bool(self.client.set(f'{self.prefix}lease:{key}', '1', nx=True, px=int(ttl * 1000)))
+
+    def has_lease(self, key):
+        return self.client.get(f'{self.prefix}lease:{key}') is not None
+
+    def release_lease(self, key):
+        self.client.delete(f'{self.prefix}lease:{key}')
+
+def make_backend(kind='memory', path='cache.sqlite3', url='redis://localhost:6379/0', max_entries=1024):
+    """Build a backend by name: memory, sqlite or redis"""
+    if kind == 'memory':
+        return MemoryBackend(max_entries)
+    if kind == 'sqlite':
+        return SQLiteBackend(path)
+    if kind == 'redis':
+        return RedisBackend(url)
+    raise ValueError(f'Unknown cache backend: {kind}')
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def running(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class TTLCache:
+    """Per-key TTL cache on a backend with stale-while-revalidate and single-flight
+
+    ttls maps keys to fresh lifetimes in seconds (default_ttl otherwise).
+    After going stale an entry is still served for stale_ttl seconds while
+    one background refresh runs.
+    """
+
+    def __init__(self, backend, default_ttl=300, ttls=None, stale_ttl=600, lease_ttl=10):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.stale_ttl = stale_ttl
+        self.lease_ttl = lease_ttl
+        self.flight = SingleFlight()
+
+    def ttl(self, key):
+        return self.ttls.get(key, self.default_ttl)
+
+    def lookup(self, key):
+        """Return (value, is_fresh), or (None, False) if missing or expired"""
+        entry = self.backend.get(key)
+        now = time.time()
+        if entry is None or now >= entry['stale_until']:
+            return None, False
+        return entry['value'], now < entry['fresh_until']
+
+    def expires_in(self, key):
+        """Seconds until key goes stale (negative once it has), or None if it isn't cached"""
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        return entry['fresh_until'] - time.time()
+
+    def get(self, key):
+        """Get a fresh value or None"""
+        value, fresh = self.lookup(key)
+        return value if fresh else None
+
+    def set(self, key, value):
+        now = time.time()
+        fresh_until = now + self.ttl(key)
+        self.backend.set(key, {'value': value, 'fresh_until': fresh_until, 'stale_until': fresh_until + self.stale_ttl})
+
+    def get_or_load(self, key, load):
+        """Get key, calling load() at most once across concurrent misses"""
+        value, fresh = self.lookup(key)
+        if fresh:
+            return value
+        if value is not None:
+            self.refresh_in_background(key, load)
+            return value
+        return self.flight.do(key, lambda: self._load_exclusive(key, load))
+
+    def refresh_in_background(self, key, load):
+        if self.flight.running(key):
+            return
+
+        def refresh():
+            try:
+                self.flight.do(key, lambda: self._load_exclusive(key, load))
+            except Exception:
+                pass  # Keep serving the stale value; the next miss retries
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _load_exclusive(self, key, load):
+        # Another process may already be loading this key; wait for its result
+        acquired = self.backend.acquire_lease(key, self.lease_ttl)
+        if not acquired:
+            deadline = time.time() + self.lease_ttl
+            while time.time() < deadline and self.backend.has_lease(key):
+                time.sleep(0.05)
+                value = self.get(key)
+                if value is not None:
+                    return value
+            value = self.get(key)
+            if value is not None:
+                return value
+
+        try:
+            value = load()
+            self.set(key, value)
+            return value
+        finally:
+            if acquired:
+                self.backend.release_lease(key)
@@ -0,0 +1,49 @@
+"""Gunicorn settings for the Flask API: gunicorn -c gunicorn.conf.py api:app
+
+preload_app imports the app once in the master, so workers fork with every
+module already loaded and share those pages copy-on-write instead of each
+importing Flask and the analyzer. With PRELOAD_PRICES=1 the master also
+prices every coin before forking, so workers start with a warm in-memory
+price cache. post_fork drops what a worker must not share with its parent
+(pooled HTTP connections); thread pools and the price refresher are
+recreated per worker on first use.
+
+With more than one worker, job status goes to a SQLite file (JOB_STORE_PATH,
+jobs.sqlite3 by default), since a job polled from another worker than the one
+that queued it would otherwise not be found.
+"""
+import os
+
+from dotenv import load_dotenv
+
+# Before reading WEB_CONCURRENCY, and before the JOB_STORE_PATH default below would shadow a value in .env
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+preload_app = True
+
+if workers > 1:
+    # Read when the app is loaded, which is after this file
+    os.environ.setdefault('JOB_STORE_PATH', 'jobs.sqlite3')
+
+def on_starting(server):
+    # With preload_app the app, and so wallet_analyzer and .env, is already loaded here
+    import jobs
+    import wallet_analyzer
+
+    if not os.getenv('MORALIS_API_KEY'):
+        server.log.warning('Moralis API key not found in .env file; only BTC analyses will work')
+    if server.cfg.workers > 1 and not jobs.JOB_STORE_PATH:
+        server.log.warning('Jobs are kept in memory by each of %d workers; set JOB_STORE_PATH so any worker '
+                           'can answer GET /analyze/jobs/<id>', server.cfg.workers)
+    if os.getenv('PRELOAD_PRICES') == '1':
+        prices = wallet_analyzer.get_prices(['BTC'] + list(wallet_analyzer.CHAIN_MAP))
+        server.log.info('Preloaded prices for %s', ', '.join(sorted(prices)) or 'no coins')
+
+def post_fork(server, worker):
+    import http_pool
+
+    # Sockets opened by the master (e.g. while preloading prices) must not be shared between workers
+    http_pool.close_sessions()
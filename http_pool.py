@@ -0,0 +1,47 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connection pool settings, tunable from the environment
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+
+# One keep-alive session per upstream host, shared by every thread
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+def get_session(url):
+    """Get the pooled session for the host serving url"""
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, pool_block=False)
+            session.mount(key, adapter)
+            _sessions[key] = session
+        return session
+
+def http_get(url, **kwargs):
+    """GET url through the host's pooled session with default timeouts"""
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(url).get(url, **kwargs)
+
+def close_sessions():
+    """Close every pooled session, e.g. after forking a worker"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
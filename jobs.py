@@ -0,0 +1,201 @@
+"""Background analysis jobs for long (e.g. limit=0) analyses
+
+POST /analyze/jobs queues an analysis and returns its id straight away; a
+pool of JOB_WORKERS threads runs it and records progress (Moralis pages and
+txs fetched so far) and then the result. Jobs live in memory, or in SQLite
+when JOB_STORE_PATH is set, so any worker process on the host can report on
+a job another one is running.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import wallet_analyzer
+from analysis_cache import cache_key
+from cache import SQLiteConnections
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH')
+# Seconds a finished job's result is kept
+JOB_RETENTION = float(os.getenv('JOB_RETENTION', '3600'))
+
+# Stored job fields, in column order; result is JSON
+FIELDS = ('id', 'key', 'status', 'wallet', 'coin', 'limit', 'pages', 'transactions',
+          'result', 'error', 'created', 'started', 'finished', 'pid')
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class MemoryJobStore:
+    """Jobs in a dict, visible to this process only"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def progress(self, job_id, txs):
+        with self._lock:
+            job = self._jobs[job_id]
+            job['pages'] += 1
+            job['transactions'] += txs
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def prune(self, before):
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job['finished'] and job['finished'] < before]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+class SQLiteJobStore:
+    """Jobs in a SQLite file shared by every worker process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = SQLiteConnections(path, timeout=30)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                wallet TEXT NOT NULL,
+                coin TEXT NOT NULL,
+                "limit" INTEGER NOT NULL,
+                pages INTEGER NOT NULL,
+                transactions INTEGER NOT NULL,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                pid INTEGER NOT NULL
+            )
+        ''')
+
+    def add(self, job):
+        row = dict(job, result=json.dumps(job['result']) if job['result'] is not None else None)
+        self._conn().execute(
+            f'INSERT INTO jobs VALUES ({", ".join("?" * len(FIELDS))})', [row[field] for field in FIELDS])
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        columns = ', '.join(f'"{name}" = ?' for name in fields)
+        self._conn().execute(f'UPDATE jobs SET {columns} WHERE id = ?', [*fields.values(), job_id])
+
+    def progress(self, job_id, txs):
+        self._conn().execute(
+            'UPDATE jobs SET pages = pages + 1, transactions = transactions + ? WHERE id = ?', (txs, job_id))
+
+    def get(self, job_id):
+        row = self._conn().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(FIELDS, row))
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def prune(self, before):
+        self._conn().execute('DELETE FROM jobs WHERE finished < ?', (before,))
+
+class JobRunner:
+    """Queue analyses on a thread pool and report their progress from a job store
+
+    A job for a (wallet, coin, limit) that is already queued or running in
+    this process is returned instead of starting another.
+    """
+
+    def __init__(self, store, max_workers=JOB_WORKERS, retention=JOB_RETENTION):
+        self.store = store
+        self.retention = retention
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, wallet, coin, chain, limit, window=None, bucket=None, valuation=None):
+        """Queue an analysis and return its job"""
+        self.store.prune(time.time() - self.retention)
+        key = cache_key(wallet, coin, limit, window, bucket, valuation)
+        with self._lock:
+            job = self.store.get(self._active[key]) if key in self._active else None
+            if job is not None:
+                return self.view(job)
+            job = {
+                'id': uuid.uuid4().hex, 'key': key, 'status': 'queued',
+                'wallet': wallet, 'coin': coin, 'limit': limit, 'pages': 0, 'transactions': 0,
+                'result': None, 'error': None, 'created': time.time(), 'started': None, 'finished': None,
+                'pid': os.getpid(),
+            }
+            self.store.add(job)
+            self._active[key] = job['id']
+        self._pool.submit(self._run, job['id'], key, wallet, coin, chain, limit, window, bucket, valuation)
+        return self.view(job)
+
+    def _run(self, job_id, key, wallet, coin, chain, limit, window, bucket, valuation):
+        self.store.update(job_id, status='running', started=time.time())
+        token = wallet_analyzer.analysis_progress.set(lambda txs: self.store.progress(job_id, txs))
+        try:
+            record = wallet_analyzer.analyze_pair(wallet, coin, chain, limit, window, bucket, valuation)
+        except Exception as e:
+            record = {'wallet': wallet, 'coin': coin, 'error': str(e) or type(e).__name__}
+        finally:
+            # Pool threads are reused; the next job must not report into this one
+            wallet_analyzer.analysis_progress.reset(token)
+
+        try:
+            if 'error' in record:
+                self.store.update(job_id, status='failed', error=record['error'], finished=time.time())
+            else:
+                self.store.update(job_id, status='done', result=record, finished=time.time())
+        finally:
+            with self._lock:
+                self._active.pop(key, None)
+
+    def get(self, job_id):
+        """The job's public view, or None if it is unknown or expired"""
+        job = self.store.get(job_id)
+        return self.view(job) if job is not None else None
+
+    def view(self, job):
+        if job['status'] in ('queued', 'running') and not pid_alive(job['pid']):
+            # Its worker process exited before finishing
+            job['status'] = 'failed'
+            job['error'] = 'Job was interrupted; submit it again'
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'wallet': job['wallet'],
+            'coin': job['coin'],
+            'limit': job['limit'],
+            'progress': {'pages': job['pages'], 'transactions': job['transactions']},
+            'result': job['result'],
+            'error': job['error'],
+            'created': job['created'],
+            'started': job['started'],
+            'finished': job['finished'],
+        }
+
+runner = JobRunner(SQLiteJobStore(JOB_STORE_PATH) if JOB_STORE_PATH else MemoryJobStore())
@@ -0,0 +1,196 @@
+"""In-process metrics: timing spans, upstream counters and Prometheus exposition
+
+span(name) times a block into a per-span histogram. Upstream calls count
+requests by status, response bytes, retries and latency per upstream.
+render() formats everything, plus registered collectors, in the Prometheus
+text format for GET /metrics. Metrics are per process; scrape each worker.
+
+With SERVER_TIMING=1 the apps also time each request's spans separately
+and return them in a Server-Timing header.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+SERVER_TIMING = os.getenv('SERVER_TIMING', '0') == '1'
+
+# Histogram bucket bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_spans = {}
+_upstream_seconds = {}
+_upstream_requests = {}
+_upstream_bytes = {}
+_upstream_retries = {}
+_collectors = []
+
+# The current request's RequestTiming, when Server-Timing is on
+_request_timing = contextvars.ContextVar('request_timing', default=None)
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+def _observe(histograms, key, seconds):
+    with _lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+def _add(counters, key, value=1):
+    with _lock:
+        counters[key] = counters.get(key, 0) + value
+
+class span:
+    """Time a block: `with span('aggregate'):` or `with span('price_source', source='binance'):`"""
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_span(self.name, time.perf_counter() - self.start, self.labels)
+
+async def timed(name, awaitable, **labels):
+    """Await awaitable inside span(name), for coroutines run concurrently with gather"""
+    with span(name, **labels):
+        return await awaitable
+
+def record_span(name, seconds, labels=None):
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items()))) if labels else (name, ())
+    _observe(_spans, key, seconds)
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.add(key, seconds)
+
+def upstream_response(upstream, status, nbytes, seconds):
+    """Count one upstream response"""
+    if METRICS_ENABLED:
+        _add(_upstream_requests, (upstream, str(status)))
+        _add(_upstream_bytes, upstream, nbytes)
+        _observe(_upstream_seconds, upstream, seconds)
+
+def upstream_retry(upstream, reason):
+    """Count one retried upstream request; reason is 'throttled' or 'connection'"""
+    if METRICS_ENABLED:
+        _add(_upstream_retries, (upstream, reason))
+
+def register(name, help_text, collect, label='name', kind='gauge'):
+    """Export collect() -> {label value: number} (or a plain number) as a gauge or counter on every render"""
+    _collectors.append((name, help_text, collect, label, kind))
+
+class RequestTiming:
+    """Span durations summed per span for one request, for its Server-Timing header"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, seconds):
+        with self._lock:
+            self.spans[key] = self.spans.get(key, 0.0) + seconds
+
+    def header(self):
+        entries = []
+        with self._lock:
+            for (name, labels), seconds in self.spans.items():
+                metric = '.'.join([name] + [str(value) for _, value in labels])
+                entries.append(f'{metric};dur={seconds * 1000:.1f}')
+        entries.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.1f}')
+        return ', '.join(entries)
+
+def start_request():
+    """Begin timing the current request if SERVER_TIMING is on; returns a token for finish_request"""
+    if not SERVER_TIMING:
+        return None
+    timing = RequestTiming()
+    return timing, _request_timing.set(timing)
+
+def finish_request(token):
+    """Stop timing and return the Server-Timing header value, or None if timing is off"""
+    if token is None:
+        return None
+    timing, reset = token
+    _request_timing.reset(reset)
+    return timing.header()
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _histogram_lines(name, help_text, histograms, label_pairs):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for key, histogram in sorted(histograms.items(), key=lambda item: str(item[0])):
+        pairs = label_pairs(key)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(pairs + [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_labels(pairs)} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{_labels(pairs)} {histogram.count}')
+    return lines
+
+def _counter_lines(name, help_text, counters, label_pairs):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+    for key, value in sorted(counters.items(), key=lambda item: str(item[0])):
+        lines.append(f'{name}{_labels(label_pairs(key))} {value}')
+    return lines
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    with _lock:
+        spans = {key: _copy(histogram) for key, histogram in _spans.items()}
+        upstream_seconds = {key: _copy(histogram) for key, histogram in _upstream_seconds.items()}
+        requests, nbytes, retries = dict(_upstream_requests), dict(_upstream_bytes), dict(_upstream_retries)
+
+    lines = []
+    lines += _histogram_lines('wallet_span_seconds', 'Time spent in instrumented analysis steps', spans,
+                              lambda key: [('span', key[0])] + list(key[1]))
+    lines += _histogram_lines('wallet_upstream_request_seconds', 'Upstream response time per request', upstream_seconds,
+                              lambda key: [('upstream', key)])
+    lines += _counter_lines('wallet_upstream_requests_total', 'Upstream responses by status code', requests,
+                            lambda key: [('upstream', key[0]), ('status', key[1])])
+    lines += _counter_lines('wallet_upstream_response_bytes_total', 'Upstream response body bytes', nbytes,
+                            lambda key: [('upstream', key)])
+    lines += _counter_lines('wallet_upstream_retries_total', 'Upstream requests retried, by reason', retries,
+                            lambda key: [('upstream', key[0]), ('reason', key[1])])
+    for name, help_text, collect, label, kind in _collectors:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        values = collect()
+        if not isinstance(values, dict):
+            values = {None: values}
+        for key, value in sorted(values.items(), key=lambda item: str(item[0])):
+            if value is not None:
+                lines.append(f'{name}{_labels([(label, key)] if key is not None else [])} {value}')
+    return '\n'.join(lines) + '\n'
+
+def _copy(histogram):
+    copy = Histogram()
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    copy.count = histogram.count
+    return copy
@@ -0,0 +1,192 @@
+"""Offline re-aggregation of exported transaction dumps on a process pool
+
+Dumps are NDJSON files of exported upstream pages, one record per line:
+
+    {"wallet": "0x...", "coin": "ETH", "page": <Moralis native tx page>}
+    {"wallet": "addr1;addr2", "coin": "BTC", "page": <BlockCypher /addrs/{address}/full response, or a list of them>}
+    {"wallet": "...", "coin": "SOL", "kind": "swaps", "page": <Solana gateway transfers (the default) or swaps page>}
+
+A .json file may hold a list of such records instead. NDJSON files are
+memory-mapped and cut at line boundaries into chunks of about
+OFFLINE_CHUNK_BYTES; OFFLINE_PROCESSES worker processes parse their chunks
+and sum flows per (wallet, coin) with the live analysis' flows functions,
+and the parent merges the partial sums. A wallet's pages may be spread
+over any number of chunks and files. Nothing is fetched, so results carry
+amounts but no USD values.
+
+Merging can't tell a page exported twice from two pages, so dumps must hold
+each page once. A BTC tx between addresses of one set is in each of their
+listings; it is counted only in the listing of the first address of the
+set (in sorted order) that it touches.
+"""
+import mmap
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import page_decode
+import wallet_analyzer as wa
+
+OFFLINE_PROCESSES = int(os.getenv('OFFLINE_PROCESSES', str(os.cpu_count() or 1)))
+# Several chunks per process keep the pool evenly loaded as chunks finish unevenly
+OFFLINE_CHUNK_BYTES = int(os.getenv('OFFLINE_CHUNK_BYTES', str(16 * 1024 * 1024)))
+
+def chunk_ranges(path, chunk_bytes=None):
+    """(path, start, end) byte ranges of a dump, each ending at a line boundary; .json files are one range"""
+    if chunk_bytes is None:
+        chunk_bytes = OFFLINE_CHUNK_BYTES
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    if path.endswith('.json'):
+        return [(path, 0, size)]
+    ranges = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            newline = data.find(b'\n', min(start + chunk_bytes, size) - 1)
+            end = size if newline < 0 else newline + 1
+            ranges.append((path, start, end))
+            start = end
+    return ranges
+
+def wallet_key(wallet, coin_symbol):
+    """(wallet, COIN) as analysis_cache normalizes it: 0x addresses are case-insensitive"""
+    wallet = wallet.strip()
+    return wallet.lower() if wallet.startswith('0x') else wallet, coin_symbol.strip().upper()
+
+def btc_listing_flows(listing, addresses):
+    """(received, sent, txs) of one BlockCypher address listing for an address set, counting shared txs once"""
+    listed = listing.get('address')
+    inflow = outflow = count = 0
+    for tx in listing.get('txs') or []:
+        if tx.get('block_height', -1) < 0:
+            continue
+        if listed in addresses and len(addresses) > 1:
+            touched = {address for item in (tx.get('inputs') or []) + (tx.get('outputs') or [])
+                       for address in item.get('addresses') or () if address in addresses}
+            if listed != min(touched, default=listed):
+                continue
+        compact = wa.btc_tx(tx, addresses)
+        inflow += compact['received']
+        outflow += compact['sent']
+        count += 1
+    return inflow, outflow, count
+
+def record_flows(record):
+    """((wallet, COIN), inflow, outflow, txs) of one dump record, in base units; raises ValueError if malformed"""
+    try:
+        key = wallet_key(record['wallet'], record['coin'])
+        page = record['page']
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError('records need wallet, coin and page')
+    wallet, coin_symbol = key
+    if coin_symbol == 'BTC':
+        addresses = set(wa.btc_addresses(wallet))
+        totals = [btc_listing_flows(listing, addresses) for listing in (page if isinstance(page, list) else [page])]
+        inflow, outflow, count = (sum(column) for column in zip(*totals)) if totals else (0, 0, 0)
+        return key, inflow, outflow, count
+    if wa.resolve_chain(coin_symbol) is None:
+        raise ValueError(f'{coin_symbol} is not supported')
+    if coin_symbol == 'SOL':
+        swaps = record.get('kind') == 'swaps'
+        txs = wa.build_sol_transactions(wallet, 0, [] if swaps else page, page if swaps else [], 0)
+        return (key, *wa.sol_flows(txs, wallet), len(txs))
+    txs = wa.page_txs(page)
+    return (key, *wa.native_flows(txs, wallet), len(txs))
+
+def iter_records(data, start, end, json_file):
+    """Yield (offset, record or the exception decoding it) for a byte range of a mapped dump"""
+    if json_file:
+        records = page_decode.loads(data[start:end])
+        for record in records if isinstance(records, list) else [records]:
+            yield start, record
+        return
+    position = start
+    while position < end:
+        newline = data.find(b'\n', position, end)
+        line_end = end if newline < 0 else newline
+        line = data[position:line_end].strip()
+        if line:
+            try:
+                yield position, page_decode.loads(line)
+            except ValueError as e:
+                yield position, e
+        position = line_end + 1
+
+def aggregate_range(path, start, end):
+    """Partial sums of one chunk: ({(wallet, COIN): [inflow, outflow, txs]}, bad records, first error)"""
+    totals = {}
+    bad = 0
+    first_error = None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for offset, record in iter_records(data, start, end, path.endswith('.json')):
+            try:
+                if isinstance(record, Exception):
+                    raise ValueError(f'invalid JSON: {record}')
+                key, inflow, outflow, count = record_flows(record)
+            except (ValueError, TypeError, AttributeError, KeyError) as e:
+                bad += 1
+                first_error = first_error or f'{path} at byte {offset}: {e}'
+                continue
+            partial = totals.get(key)
+            if partial is None:
+                totals[key] = [inflow, outflow, count]
+            else:
+                partial[0] += inflow
+                partial[1] += outflow
+                partial[2] += count
+    return totals, bad, first_error
+
+def merge(partials):
+    """Merge aggregate_range results into one (totals, bad records, first error)"""
+    totals = {}
+    bad = 0
+    first_error = None
+    for part, part_bad, part_error in partials:
+        for key, (inflow, outflow, count) in part.items():
+            merged = totals.setdefault(key, [0, 0, 0])
+            merged[0] += inflow
+            merged[1] += outflow
+            merged[2] += count
+        bad += part_bad
+        first_error = first_error or part_error
+    return totals, bad, first_error
+
+def aggregate_dumps(paths, processes=None, chunk_bytes=None):
+    """Sum flows per (wallet, COIN) over dump files on a pool of processes; see merge for the result"""
+    if processes is None:
+        processes = OFFLINE_PROCESSES
+    ranges = [chunk for path in paths for chunk in chunk_ranges(path, chunk_bytes)]
+    if processes <= 1 or len(ranges) <= 1:
+        return merge(aggregate_range(*chunk) for chunk in ranges)
+    with ProcessPoolExecutor(max_workers=min(processes, len(ranges))) as pool:
+        # Partials come back in chunk order; each only holds its own chunk's wallets, so they stay small
+        return merge(pool.map(aggregate_range, *zip(*ranges)))
+
+def format_totals(wallet, coin_symbol, inflow, outflow, count):
+    """An NDJSON result record, shaped like format_analysis' without the USD fields"""
+    decimals = wa.coin_decimals(coin_symbol)
+    return {
+        'wallet': wallet,
+        'coin': coin_symbol,
+        'received': f'{wa.to_display(inflow, decimals):.8f}',
+        'sent': f'{wa.to_display(outflow, decimals):.8f}',
+        'net': f'{wa.to_display(inflow - outflow, decimals):.8f}',
+        'transactionsAnalyzed': count
+    }
+
+def main_offline(paths, processes=None):
+    """Aggregate dump files and print one NDJSON record per (wallet, coin), sorted"""
+    import json
+
+    for path in paths:
+        if not os.path.isfile(path):
+            print(f'Error: {path} is not a file')
+            exit(1)
+    totals, bad, first_error = aggregate_dumps(paths, processes)
+    out = sys.stdout
+    for (wallet, coin_symbol), (inflow, outflow, count) in sorted(totals.items()):
+        out.write(json.dumps(format_totals(wallet, coin_symbol, inflow, outflow, count)) + '\n')
+    if bad:
+        print(f'Skipped {bad} malformed records; first: {first_error}', file=sys.stderr)
@@ -0,0 +1,135 @@
+"""Fast JSON decoding, and compact records for Moralis native tx pages
+
+Native flows only read each tx's value, addresses and block time, yet a
+page decodes into 100 dicts of ~25 keys each. native_page decodes a page into NativeTx
+records holding just those fields instead: with msgspec the decoder builds
+them directly and skips every other field; otherwise orjson (or the stdlib
+json) parses the page and the fields are copied out.
+
+PAGE_DECODER picks the library: auto (msgspec, then orjson, then json),
+msgspec, orjson or json; dict turns compact pages off and keeps full dicts.
+"""
+import json
+import os
+from typing import List, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PAGE_DECODER = os.getenv('PAGE_DECODER', 'auto')
+
+def _resolve(name):
+    if name == 'auto':
+        return 'msgspec' if msgspec is not None else 'orjson' if orjson is not None else 'json'
+    if name == 'msgspec' and msgspec is None:
+        raise ImportError('PAGE_DECODER=msgspec needs the msgspec package: pip install msgspec')
+    if name == 'orjson' and orjson is None:
+        raise ImportError('PAGE_DECODER=orjson needs the orjson package: pip install orjson')
+    if name not in ('msgspec', 'orjson', 'json', 'dict'):
+        raise ValueError(f'Unknown page decoder: {name}')
+    return name
+
+class NativeTx:
+    """The fields of a Moralis native tx that flows read; from_ holds the short 'from' name"""
+
+    __slots__ = ('value', 'native_value', 'to_address', 'to', 'from_address', 'from_', 'block_timestamp')
+
+    def __init__(self, value=None, native_value=None, to_address=None, to=None, from_address=None, from_=None,
+                 block_timestamp=None):
+        self.value = value
+        self.native_value = native_value
+        self.to_address = to_address
+        self.to = to
+        self.from_address = from_address
+        self.from_ = from_
+        self.block_timestamp = block_timestamp
+
+    @classmethod
+    def from_dict(cls, tx):
+        return cls(tx.get('value'), tx.get('native_value'), tx.get('to_address'), tx.get('to'),
+                   tx.get('from_address'), tx.get('from'), tx.get('block_timestamp'))
+
+if msgspec is not None:
+    class _StructTx(msgspec.Struct, gc=False):
+        """NativeTx as a msgspec struct, so pages decode straight into it"""
+        value: Union[str, int, None] = None
+        native_value: Union[str, int, None] = None
+        to_address: Optional[str] = None
+        to: Optional[str] = None
+        from_address: Optional[str] = None
+        from_: Optional[str] = msgspec.field(default=None, name='from')
+        block_timestamp: Union[str, int, None] = None
+
+    class _StructPage(msgspec.Struct, gc=False):
+        result: List[_StructTx] = []
+        cursor: Optional[str] = None
+
+def make_loads(name):
+    """loads(raw) for a resolved decoder name, falling back to json for what the library rejects"""
+    if name == 'msgspec':
+        fast, errors = msgspec.json.decode, msgspec.DecodeError
+    elif name == 'orjson':
+        fast, errors = orjson.loads, orjson.JSONDecodeError
+    else:
+        return json.loads
+
+    def loads(raw):
+        try:
+            return fast(raw)
+        except errors:
+            # e.g. integers past 64 bits; json also raises the usual error for bad input
+            return json.loads(raw)
+
+    return loads
+
+def make_native_page(name):
+    """native_page(raw) for a resolved decoder name"""
+    generic_loads = make_loads(name)
+    decoder = msgspec.json.Decoder(_StructPage) if name == 'msgspec' else None
+
+    def native_page(raw):
+        """Decode a Moralis native tx page into {'result': [NativeTx], 'cursor': ...} (or a bare list of them)"""
+        if decoder is not None:
+            try:
+                page = decoder.decode(raw)
+                return {'result': page.result, 'cursor': page.cursor}
+            except msgspec.DecodeError:
+                pass  # Not the usual shape (e.g. a bare list); take the generic path
+        data = generic_loads(raw)
+        if isinstance(data, list):
+            return [NativeTx.from_dict(tx) for tx in data]
+        if isinstance(data, dict):
+            return {'result': [NativeTx.from_dict(tx) for tx in data.get('result', [])], 'cursor': data.get('cursor')}
+        return data
+
+    return native_page
+
+DECODER = _resolve(PAGE_DECODER)
+COMPACT_PAGES = DECODER != 'dict'
+loads = make_loads(DECODER)
+native_page = make_native_page(DECODER)
+
+def native_flows(transactions, wallet):
+    """wallet_analyzer.native_flows over NativeTx records"""
+    wallet = wallet.lower()
+    inflow = 0
+    outflow = 0
+
+    for tx in transactions:
+        value = tx.value or tx.native_value
+        if not value:
+            continue
+
+        if (tx.to_address or tx.to or '').lower() == wallet:
+            inflow += int(value)
+        elif (tx.from_address or tx.from_ or '').lower() == wallet:
+            outflow += int(value)
+
+    return inflow, outflow
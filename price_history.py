@@ -0,0 +1,207 @@
+"""Local OHLC price history, memory-mapped for O(1) lookups by time
+
+Each coin's candles live in PRICE_HISTORY_DIR/<COIN>.ohlc: a 32-byte
+header (magic, interval seconds, first candle's open time, candle count)
+followed by one float64 (open, high, low, close) row per interval, with no
+gaps (a missing candle repeats the previous close). The price at time t is
+row (t - start) // interval, read straight from the mapped file, so
+valuing a tx needs neither a network call nor parsing the whole history.
+
+Indexes are bulk-loaded from Binance USDT klines, or built from CoinGecko
+prices for coins Binance doesn't list. Loading again extends an index from
+its last candle, so a nightly run only fetches the new ones:
+
+    python price_history.py load ETH BTC SOL --from 2021-01-01 --interval 1h
+"""
+import argparse
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+import wallet_analyzer as wa
+from scheduler import http_get
+
+PRICE_HISTORY_DIR = os.getenv('PRICE_HISTORY_DIR', 'price_history')
+
+INTERVALS = {'1h': 3600, '1d': 86400}
+MAGIC = b'OHLCv1'  # Null-padded to 8 bytes in the header
+HEADER = np.dtype([('magic', 'S8'), ('interval', '<i8'), ('start', '<i8'), ('count', '<i8')])
+# Binance's largest klines page
+KLINES_LIMIT = 1000
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+def epoch(timestamp):
+    """Unix seconds of a wallet_analyzer.normalize_timestamp string"""
+    # Naive arithmetic, as the string is UTC already; a third of the cost of going through tzinfo
+    return int((datetime.fromisoformat(timestamp) - UNIX_EPOCH).total_seconds())
+
+class PriceIndex:
+    """Read-only view of one coin's candle file"""
+
+    def __init__(self, path):
+        header = np.fromfile(path, dtype=HEADER, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC:
+            raise ValueError(f'{path} is not a price history file')
+        self.path = path
+        self.interval = int(header['interval'][0])
+        self.start = int(header['start'][0])
+        count = int(header['count'][0])
+        # A plain ndarray over the mapping: np.memmap's subclass hooks cost microseconds per scalar lookup
+        self.rows = np.asarray(np.memmap(path, dtype='<f8', mode='r', offset=HEADER.itemsize, shape=(count, 4))
+                               if count else np.zeros((0, 4)))
+        self.closes = self.rows[:, 3]
+
+    @property
+    def end(self):
+        """Open time of the candle after the last one"""
+        return self.start + len(self.rows) * self.interval
+
+    def slot(self, timestamp):
+        """Row of the candle holding a normalized timestamp, or None if it has none or is outside the index"""
+        if timestamp is None:
+            return None
+        row = (epoch(timestamp) - self.start) // self.interval
+        return row if 0 <= row < len(self.rows) else None
+
+    def close(self, slot):
+        """Close of a slot's candle, or None for slot None"""
+        return None if slot is None else float(self.closes[slot])
+
+    def close_at(self, timestamp):
+        return self.close(self.slot(timestamp))
+
+_indexes = {}
+
+def index_path(coin_symbol):
+    # ARB and OP amounts are ETH, so they share its index
+    return os.path.join(PRICE_HISTORY_DIR, f'{wa.price_coin(coin_symbol.upper())}.ohlc')
+
+def get_index(coin_symbol):
+    """The coin's PriceIndex, or None if none was loaded; reopened when a load replaces the file"""
+    path = index_path(coin_symbol)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _indexes.get(path)
+    if cached is None or cached[0] != version:
+        cached = (version, PriceIndex(path))
+        _indexes[path] = cached
+    return cached[1]
+
+def binance_candles(coin_symbol, interval, start, end):
+    """(open time, open, high, low, close) candles in [start, end) unix seconds from Binance USDT klines"""
+    candles = []
+    while start < end:
+        params = {'symbol': f'{coin_symbol}USDT', 'interval': interval, 'startTime': start * 1000,
+                  'endTime': end * 1000 - 1, 'limit': KLINES_LIMIT}
+        resp = http_get(f'{wa.BINANCE_API}/klines', params=params, timeout=30)
+        if resp.status_code != 200:
+            raise Exception(f'Binance klines for {coin_symbol} (status {resp.status_code}): {resp.text}')
+        rows = resp.json()
+        if not rows:
+            break
+        candles.extend((row[0] // 1000, float(row[1]), float(row[2]), float(row[3]), float(row[4])) for row in rows)
+        start = rows[-1][0] // 1000 + INTERVALS[interval]
+    return candles
+
+def coingecko_candles(coin_symbol, interval, start, end):
+    """Candles in [start, end) unix seconds built from CoinGecko's market_chart prices
+
+    CoinGecko returns hourly points for ranges up to 90 days and daily ones
+    beyond, so long hourly indexes repeat each day's price.
+    """
+    coin_id = wa.COINGECKO_IDS.get(coin_symbol, coin_symbol.lower())
+    params = {'vs_currency': 'usd', 'from': start, 'to': end}
+    resp = http_get(f'{wa.COINGECKO_API}/coins/{coin_id}/market_chart/range', params=params, timeout=30)
+    if resp.status_code != 200:
+        raise Exception(f'CoinGecko prices for {coin_symbol} (status {resp.status_code}): {resp.text}')
+    seconds = INTERVALS[interval]
+    candles = {}
+    for ms, price in resp.json().get('prices', []):
+        opened = int(ms // 1000) // seconds * seconds
+        if opened in candles:
+            _, first, high, low, _ = candles[opened]
+            candles[opened] = (opened, first, max(high, price), min(low, price), price)
+        else:
+            candles[opened] = (opened, price, price, price, price)
+    return [candles[opened] for opened in sorted(candles) if start <= opened < end]
+
+def fetch_candles(coin_symbol, interval, start, end):
+    """Candles from Binance, or CoinGecko when Binance doesn't list the coin"""
+    try:
+        candles = binance_candles(coin_symbol, interval, start, end)
+        if candles:
+            return candles
+    except Exception as e:
+        print(f'{coin_symbol}: {e}; trying CoinGecko')
+    return coingecko_candles(coin_symbol, interval, start, end)
+
+def dense_rows(candles, start, seconds, previous_close=np.nan):
+    """(n, 4) rows from start to the last candle, gaps filled with the previous close"""
+    count = (candles[-1][0] - start) // seconds + 1 if candles else 0
+    rows = np.full((count, 4), np.nan)
+    for opened, *ohlc in candles:
+        rows[(opened - start) // seconds] = ohlc
+    filled = ~np.isnan(rows[:, 3])
+    last = np.maximum.accumulate(np.where(filled, np.arange(count), -1)) if count else np.zeros(0, dtype=int)
+    gaps = ~filled & (last >= 0)
+    rows[gaps] = rows[last[gaps], 3][:, None]
+    rows[last < 0] = previous_close
+    return rows
+
+def write_index(path, seconds, start, rows):
+    """Replace path with an index of rows; readers keep their mapping of the old file"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    header = np.array([(MAGIC, seconds, start, len(rows))], dtype=HEADER)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(np.ascontiguousarray(rows, dtype='<f8').tobytes())
+    os.replace(tmp, path)
+
+def load(coin_symbol, start, end=None, interval='1h'):
+    """Create or extend a coin's index to cover [start, end) unix seconds; returns its PriceIndex"""
+    coin_symbol = wa.price_coin(coin_symbol.upper())
+    seconds = INTERVALS[interval]
+    start = start // seconds * seconds
+    end = end if end is not None else int(datetime.now(timezone.utc).timestamp()) // seconds * seconds
+    existing = get_index(coin_symbol)
+    if existing is not None and existing.interval == seconds and existing.start <= start and len(existing.rows):
+        # Only the candles after the stored ones; the last stored one may have closed since
+        head = np.array(existing.rows[:-1])
+        start, fetch_from = existing.start, existing.end - seconds
+        rows = dense_rows(fetch_candles(coin_symbol, interval, fetch_from, end), fetch_from, seconds, head[-1, 3] if len(head) else np.nan)
+        rows = np.concatenate([head, rows if len(rows) else np.array(existing.rows[-1:])])
+    else:
+        candles = fetch_candles(coin_symbol, interval, start, end)
+        if not candles:
+            raise Exception(f'No price history found for {coin_symbol}')
+        start = candles[0][0]
+        rows = dense_rows(candles, start, seconds)
+    write_index(index_path(coin_symbol), seconds, start, rows)
+    return get_index(coin_symbol)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load or extend local OHLC price history indexes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    loader = commands.add_parser('load', help='Fetch candles for coins into PRICE_HISTORY_DIR')
+    loader.add_argument('coins', nargs='+', help='Coin symbols, e.g. ETH BTC SOL')
+    loader.add_argument('--from', dest='from_date', required=True, help='First day to load (YYYY-MM-DD, UTC)')
+    loader.add_argument('--to', dest='to_date', help='Load up to this day, exclusive (default: now)')
+    loader.add_argument('--interval', choices=INTERVALS, default='1h')
+    args = parser.parse_args()
+
+    start = epoch(wa.parse_date(args.from_date))
+    end = epoch(wa.parse_date(args.to_date)) if args.to_date else None
+    for coin_symbol in args.coins:
+        index = load(coin_symbol, start, end, args.interval)
+        first = datetime.fromtimestamp(index.start, timezone.utc)
+        last = datetime.fromtimestamp(index.end - index.interval, timezone.utc)
+        print(f'{coin_symbol.upper()}: {len(index.rows)} candles, {first:%Y-%m-%d %H:%M} to {last:%Y-%m-%d %H:%M} UTC')
+
+if __name__ == '__main__':
+    main()
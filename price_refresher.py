@@ -0,0 +1,167 @@
+"""Background refresher that keeps every coin's price fresh in the price cache
+
+Each coin (BTC plus everything in CHAIN_MAP, with ARB and OP priced as ETH) is re-priced shortly before its
+cached price goes stale, so /analyze finds a fresh price in the cache
+instead of fetching one. Due coins are priced together with one batched
+request per source; coins no batch source knows fall back to their own
+hedged lookup. A coin that hasn't refreshed successfully for
+PRICE_STALE_ALARM seconds raises a staleness alarm.
+
+Run it inside the web process (PRICE_REFRESHER=thread), or on its own
+next to a shared sqlite/redis price cache:
+
+    python price_refresher.py
+"""
+import os
+import sys
+import threading
+import time
+
+import wallet_analyzer as wa
+from cache import MemoryBackend
+
+# Seconds between checks for coins that are due
+PRICE_REFRESH_INTERVAL = float(os.getenv('PRICE_REFRESH_INTERVAL', '5'))
+# Re-price a coin once its cached price has fewer than this many seconds of freshness left
+PRICE_REFRESH_LEAD = float(os.getenv('PRICE_REFRESH_LEAD', '60'))
+# Alarm when a coin hasn't refreshed successfully for this many seconds
+PRICE_STALE_ALARM = float(os.getenv('PRICE_STALE_ALARM', '600'))
+
+def fetch_coin_price(coin_symbol):
+    """Price one coin from the fallback sources, without a wallet to ask Moralis about"""
+    if coin_symbol == 'BTC':
+        return wa.fetch_btc_price()
+    if coin_symbol == 'SOL':
+        try:
+            return wa.fetch_sol_price()
+        except wa.MissingApiKey:
+            pass  # Moralis needs a key; the other sources don't
+    return wa.resolve_price(coin_symbol, wa.price_sources(coin_symbol, wa.COINGECKO_IDS.get(coin_symbol, coin_symbol.lower())))
+
+def refresh_coins():
+    """Every coin an analysis prices, once each"""
+    return list(dict.fromkeys(wa.price_coin(coin) for coin in ['BTC'] + list(wa.CHAIN_MAP)))
+
+class PriceRefresher:
+    """Re-price coins before their cached prices expire and watch for staleness"""
+
+    def __init__(self, coins, interval=PRICE_REFRESH_INTERVAL, lead=PRICE_REFRESH_LEAD, stale_after=PRICE_STALE_ALARM):
+        self.coins = list(coins)
+        self.interval = interval
+        self.lead = lead
+        self.stale_after = stale_after
+        self.started = time.time()
+        self.last_ok = {}
+        self.failures = {coin: 0 for coin in self.coins}
+        self.alarms = set()
+        self.refreshes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def due(self):
+        """Coins whose cached price is missing or within lead seconds of going stale"""
+        due = []
+        for coin in self.coins:
+            left = wa.price_cache.expires_in(wa.price_key(coin))
+            if left is None or left < self.lead:
+                due.append(coin)
+        return due
+
+    def refresh(self, coins):
+        """Price coins (batched where possible) and publish them to the cache"""
+        try:
+            prices = wa.fetch_prices(coins)
+        except Exception:
+            prices = {}
+        for coin in coins:
+            if coin not in prices:
+                try:
+                    prices[coin] = fetch_coin_price(coin)
+                except Exception:
+                    self.failures[coin] += 1
+                    continue
+            wa.set_cached_price(wa.price_key(coin), prices[coin])
+            self.last_ok[coin] = time.time()
+        self.refreshes += 1
+        return prices
+
+    def check_staleness(self):
+        """Raise or clear the alarm for each coin; returns the coins currently alarmed"""
+        now = time.time()
+        for coin in self.coins:
+            age = now - self.last_ok.get(coin, self.started)
+            if age > self.stale_after and coin not in self.alarms:
+                self.alarms.add(coin)
+                print(f'Price alarm: {coin} has not refreshed for {age:.0f}s '
+                      f'({self.failures[coin]} failed attempts)', file=sys.stderr)
+            elif age <= self.stale_after and coin in self.alarms:
+                self.alarms.discard(coin)
+                print(f'Price alarm cleared: {coin} refreshed', file=sys.stderr)
+        return set(self.alarms)
+
+    def run_once(self):
+        due = self.due()
+        if due:
+            self.refresh(due)
+        self.check_staleness()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f'Price refresher error: {e}', file=sys.stderr)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Run in a daemon thread; returns self"""
+        self._thread = threading.Thread(target=self.run, name='price-refresher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def status(self):
+        """Per-coin cached price, last successful refresh and alarm state"""
+        now = time.time()
+        coins = {}
+        for coin in self.coins:
+            price, fresh = wa.price_cache.lookup(wa.price_key(coin))
+            last_ok = self.last_ok.get(coin)
+            coins[coin] = {
+                'price': price,
+                'fresh': fresh,
+                'lastRefresh': last_ok,
+                'ageSeconds': round(now - last_ok, 1) if last_ok is not None else None,
+                'failures': self.failures[coin],
+                'alarm': coin in self.alarms,
+            }
+        return {'running': self._thread is not None and self._thread.is_alive(), 'refreshes': self.refreshes, 'coins': coins}
+
+refresher = None
+_refresher_pid = None
+
+def start_refresher():
+    """Start the in-process refresher if PRICE_REFRESHER=thread; safe to call more than once
+
+    A forked worker starts its own, since the parent's thread doesn't survive the fork.
+    """
+    global refresher, _refresher_pid
+    if os.getenv('PRICE_REFRESHER') == 'thread' and (refresher is None or _refresher_pid != os.getpid()):
+        refresher = PriceRefresher(refresh_coins()).start()
+        _refresher_pid = os.getpid()
+    return refresher
+
+def status():
+    if refresher is None:
+        return {'running': False}
+    return refresher.status()
+
+if __name__ == '__main__':
+    if isinstance(wa.price_cache.backend, MemoryBackend):
+        print('Warning: PRICE_CACHE_BACKEND=memory is private to this process; '
+              'use sqlite or redis so web workers see the refreshed prices', file=sys.stderr)
+    PriceRefresher(refresh_coins()).run()
@@ -0,0 +1,297 @@
+"""Hedged price resolution across redundant price sources
+
+Sources are tried fastest-healthy-first, ranked by per-source EWMAs of
+latency and error rate. In hedge mode the next source is fired once the
+current one has run past its own p95 latency (or failed); in race mode
+every source is fired at once. The first valid price wins and the rest
+are cancelled.
+
+PriceBatcher collects lookups for many coins over a short window and
+prices them together, for sources that accept many ids per request.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+class PriceUnavailable(Exception):
+    """No source produced a valid price"""
+
+class SourceHealth:
+    """Latency and error EWMAs plus a window of recent latencies for one source"""
+
+    def __init__(self, alpha, window):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.recent = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0
+
+    def record(self, seconds, ok):
+        self.requests += 1
+        self.recent.append(seconds)
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.errors += 1
+
+    def p95(self):
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+class PriceResolver:
+    """Resolve a price from (name, fn) sources, where fn() returns a price or raises
+
+    mode is 'hedge' or 'race'. hedge_delay is used until a source has
+    min_samples latencies, and every hedge delay is clamped to
+    [min_hedge_delay, hedge_delay * 4]. timeout bounds a whole resolution.
+    """
+
+    def __init__(self, mode='hedge', hedge_delay=0.3, min_hedge_delay=0.02, timeout=10.0,
+                 alpha=0.2, window=100, min_samples=5, max_workers=16):
+        if mode not in ('hedge', 'race'):
+            raise ValueError(f'Unknown price resolver mode: {mode}')
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.timeout = timeout
+        self.alpha = alpha
+        self.window = window
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self._health = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    def _source(self, name):
+        health = self._health.get(name)
+        if health is None:
+            health = self._health[name] = SourceHealth(self.alpha, self.window)
+        return health
+
+    def _record(self, name, seconds, ok):
+        with self._lock:
+            self._source(name).record(seconds, ok)
+        metrics.record_span('price_source', seconds, {'source': name})
+
+    def _score(self, name):
+        # Expected seconds to a good answer; unmeasured sources assume the default hedge delay
+        health = self._health.get(name)
+        if health is None or health.latency is None:
+            return self.hedge_delay
+        return health.latency / max(0.05, 1.0 - health.error_rate)
+
+    def rank(self, calls):
+        """Sources ordered fastest-healthy first; ties keep the given priority"""
+        with self._lock:
+            return sorted(calls, key=lambda call: self._score(call[0]))
+
+    def delay_for(self, name):
+        """Seconds to give a source before hedging to the next one"""
+        with self._lock:
+            health = self._health.get(name)
+            if health is None or len(health.recent) < self.min_samples:
+                return self.hedge_delay
+            return min(max(health.p95(), self.min_hedge_delay), self.hedge_delay * 4)
+
+    def _timed(self, name, fn):
+        start = time.perf_counter()
+        try:
+            price = fn()
+        except BaseException:
+            self._record(name, time.perf_counter() - start, False)
+            raise
+        self._record(name, time.perf_counter() - start, True)
+        return price
+
+    async def _timed_async(self, name, fn):
+        import asyncio  # Imported by the async paths only, to keep sync startup light
+        start = time.perf_counter()
+        try:
+            price = await fn()
+        except asyncio.CancelledError:
+            raise  # Lost the race; says nothing about the source's health
+        except BaseException:
+            self._record(name, time.perf_counter() - start, False)
+            raise
+        self._record(name, time.perf_counter() - start, True)
+        return price
+
+    def _won(self, name):
+        with self._lock:
+            self._source(name).wins += 1
+
+    def _executor(self):
+        with self._lock:
+            # A pool inherited through fork (e.g. gunicorn --preload) has no live threads; start a fresh one
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='price')
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def resolve(self, calls):
+        """First valid price from calls, launched per mode; raises PriceUnavailable"""
+        remaining = self.rank(calls)
+        pool = self._executor()
+        running = {}
+        errors = []
+        deadline = time.monotonic() + self.timeout
+        last = None
+
+        def launch():
+            nonlocal last
+            name, fn = remaining.pop(0)
+            # Run in the caller's context so the source's span lands in its request timing
+            running[pool.submit(contextvars.copy_context().run, self._timed, name, fn)] = name
+            last = name
+
+        launch()
+        while self.mode == 'race' and remaining:
+            launch()
+
+        while running:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            timeout = min(left, self.delay_for(last)) if remaining else left
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    price = future.result()
+                except Exception as e:
+                    errors.append(f'{name}: {e}')
+                    continue
+                # Requests already on the wire finish in the background and still feed the EWMAs
+                for other in running:
+                    other.cancel()
+                self._won(name)
+                return price
+            # The current source is slow or failed; bring in the next one
+            if remaining:
+                launch()
+
+        for future in running:
+            future.cancel()
+        raise PriceUnavailable('; '.join(errors) or 'timed out')
+
+    async def resolve_async(self, calls):
+        """Async counterpart of resolve; fn() returns an awaitable and losers are cancelled"""
+        import asyncio
+        remaining = self.rank(calls)
+        running = {}
+        errors = []
+        deadline = time.monotonic() + self.timeout
+        last = None
+
+        def launch():
+            nonlocal last
+            name, fn = remaining.pop(0)
+            running[asyncio.ensure_future(self._timed_async(name, fn))] = name
+            last = name
+
+        launch()
+        while self.mode == 'race' and remaining:
+            launch()
+
+        try:
+            while running:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                timeout = min(left, self.delay_for(last)) if remaining else left
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    try:
+                        price = task.result()
+                    except Exception as e:
+                        errors.append(f'{name}: {e}')
+                        continue
+                    self._won(name)
+                    return price
+                if remaining:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+        raise PriceUnavailable('; '.join(errors) or 'timed out')
+
+    def stats(self):
+        """Per-source request/error/win counts, latency EWMA and p95, and error-rate EWMA"""
+        with self._lock:
+            return {
+                name: {
+                    'requests': health.requests,
+                    'errors': health.errors,
+                    'wins': health.wins,
+                    'latencyMs': round(health.latency * 1000, 1) if health.latency is not None else None,
+                    'p95Ms': round(health.p95() * 1000, 1) if health.recent else None,
+                    'errorRate': round(health.error_rate, 3),
+                }
+                for name, health in self._health.items()
+            }
+
+class _Batch:
+    def __init__(self):
+        self.keys = set()
+        self.done = threading.Event()
+        self.result = {}
+        self.error = None
+
+class PriceBatcher:
+    """Coalesce price lookups arriving within window seconds into one fetch_many(keys) call
+
+    fetch_many returns {key: price} for the keys it could price; callers get
+    the subset they asked for, and missing keys are simply absent.
+    """
+
+    def __init__(self, fetch_many, window=0.02):
+        self.fetch_many = fetch_many
+        self.window = window
+        self._batch = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.lookups = 0
+
+    def get_many(self, keys):
+        keys = set(keys)
+        if not keys:
+            return {}
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch()
+                timer = threading.Timer(self.window, self._flush, (batch,))
+                timer.daemon = True
+                timer.start()
+            batch.keys |= keys
+            self.lookups += len(keys)
+
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return {key: batch.result[key] for key in keys if key in batch.result}
+
+    def _flush(self, batch):
+        with self._lock:
+            # Lookups from here on start the next batch
+            if self._batch is batch:
+                self._batch = None
+            self.batches += 1
+        try:
+            batch.result = self.fetch_many(sorted(batch.keys))
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
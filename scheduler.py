@@ -0,0 +1,255 @@
+"""Rate-limit-aware scheduling of upstream requests
+
+Every upstream (Moralis, BlockCypher, the price APIs) gets a token bucket
+sized from its plan's limits. Requests reserve tokens before they are sent
+and queue when the bucket is empty, instead of failing. A throttled
+response (429/503) pauses its whole upstream for Retry-After seconds, or a
+jittered exponential backoff, and the request is retried.
+
+Moralis meters by compute units (CU), so its bucket holds CUs and each
+request costs what its endpoint is billed at.
+"""
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+import http_pool
+import metrics
+
+# Which bucket each upstream host draws from; Moralis' hosts share one plan
+UPSTREAM_BUCKETS = {
+    'deep-index.moralis.io': 'moralis',
+    'solana-gateway.moralis.io': 'moralis',
+    'api.blockcypher.com': 'blockcypher',
+    'api.coingecko.com': 'coingecko',
+    'api.binance.com': 'binance',
+    'api.coinbase.com': 'coinbase',
+}
+
+# (units per second, burst) per bucket; overridden by RATE_LIMITS
+DEFAULT_LIMITS = {
+    'moralis': (float(os.getenv('MORALIS_CU_PER_SECOND', '1000')), float(os.getenv('MORALIS_CU_BURST', '1000'))),
+    'blockcypher': (3, 3),
+    'coingecko': (0.5, 5),
+    'binance': (20, 20),
+    'coinbase': (2.5, 10),
+}
+
+# Compute units per Moralis endpoint, first match wins; other upstreams cost 1 per request
+MORALIS_CU_COSTS = [
+    ('/erc20/transfers', 50),
+    ('/price', 50),
+    ('/swaps', 50),
+    ('/account/mainnet/', 10),
+]
+MORALIS_DEFAULT_CU = 30
+
+# Responses that mean "slow down" rather than "this request is wrong"
+RETRY_STATUSES = {429, 502, 503, 504}
+SCHEDULER_MAX_RETRIES = int(os.getenv('SCHEDULER_MAX_RETRIES', '5'))
+BACKOFF_BASE = float(os.getenv('SCHEDULER_BACKOFF_BASE', '0.5'))
+BACKOFF_CAP = float(os.getenv('SCHEDULER_BACKOFF_CAP', '30'))
+# A longer Retry-After (e.g. a daily quota reset) is returned to the caller instead of waited out
+MAX_RETRY_AFTER = float(os.getenv('SCHEDULER_MAX_RETRY_AFTER', '60'))
+
+def parse_limits(text):
+    """Parse "moralis=1500:3000,blockcypher=3" into {'moralis': (1500.0, 3000.0), 'blockcypher': (3.0, 3.0)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, spec = item.split('=')
+        rate, _, burst = spec.partition(':')
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+class TokenBucket:
+    """Token bucket handing out reservations, so waiting callers are served in arrival order
+
+    Tokens may go negative: each caller takes its tokens up front and sleeps
+    until the bucket has refilled past its reservation.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.max_queued = 0
+        self.requests = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.throttled = 0
+
+    def _refill(self, now):
+        # updated may be in the future while the upstream is paused
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, cost=1):
+        """Take cost tokens and return the seconds to wait before sending"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= cost
+            self.requests += 1
+            delay = max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+            if delay > 0:
+                self.waited += 1
+                self.wait_seconds += delay
+                self.max_wait_seconds = max(self.max_wait_seconds, delay)
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+            return delay
+
+    def _dequeue(self):
+        with self._lock:
+            self.queued -= 1
+
+    def wait(self, cost=1):
+        delay = self.reserve(cost)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                self._dequeue()
+
+    async def wait_async(self, cost=1):
+        import asyncio  # Only the async engine gets here; the sync CLI shouldn't pay for importing it
+        delay = self.reserve(cost)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._dequeue()
+
+    def pause(self, seconds):
+        """Hold every request to this upstream for seconds, then refill from empty"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            self.tokens = min(self.tokens, 0)
+            self.updated = max(self.updated, now + seconds)
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(self.tokens, 3),
+                'queued': self.queued,
+                'maxQueued': self.max_queued,
+                'requests': self.requests,
+                'waited': self.waited,
+                'waitSeconds': round(self.wait_seconds, 3),
+                'maxWaitSeconds': round(self.max_wait_seconds, 3),
+                'throttled': self.throttled,
+            }
+
+_limits = dict(DEFAULT_LIMITS, **parse_limits(os.getenv('RATE_LIMITS', '')))
+buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in _limits.items() if rate > 0}
+
+def upstream_name(url):
+    """Upstream label for metrics: the bucket name, or the host for unlisted upstreams"""
+    host = urlsplit(url).hostname
+    return UPSTREAM_BUCKETS.get(host, host)
+
+def bucket_for(url):
+    """The token bucket of url's upstream, or None if it isn't rate limited"""
+    return buckets.get(UPSTREAM_BUCKETS.get(urlsplit(url).hostname))
+
+def request_cost(url):
+    """Tokens a request to url takes from its bucket"""
+    bucket = UPSTREAM_BUCKETS.get(urlsplit(url).hostname)
+    path = urlsplit(url).path
+    if bucket == 'blockcypher' and '/addrs/' in path:
+        # Batched addresses (/addrs/a;b;c) each count as one request
+        return path.split('/addrs/')[1].split('/')[0].count(';') + 1
+    if bucket != 'moralis':
+        return 1
+    for fragment, cost in MORALIS_CU_COSTS:
+        if fragment in path:
+            return cost
+    return MORALIS_DEFAULT_CU
+
+def backoff(attempt):
+    """Full-jitter exponential backoff, so throttled callers don't retry in lockstep"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+def retry_after(headers):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None"""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(status, headers, attempt, max_retries=None):
+    """Seconds to hold off before retrying a response, or None if it should be returned as is"""
+    if max_retries is None:
+        max_retries = SCHEDULER_MAX_RETRIES
+    if status not in RETRY_STATUSES or attempt >= max_retries:
+        return None
+    delay = retry_after(headers)
+    if delay is None:
+        return backoff(attempt)
+    return delay if delay <= MAX_RETRY_AFTER else None
+
+def http_get(url, max_retries=None, **kwargs):
+    """GET url once its upstream has capacity, retrying throttled responses and dropped connections
+
+    max_retries overrides SCHEDULER_MAX_RETRIES, e.g. 0 for callers that
+    fall back to another upstream rather than wait this one out.
+    """
+    if max_retries is None:
+        max_retries = SCHEDULER_MAX_RETRIES
+    bucket = bucket_for(url)
+    cost = request_cost(url)
+    upstream = upstream_name(url)
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.wait(cost)
+        start = time.perf_counter()
+        try:
+            resp = http_pool.http_get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= max_retries:
+                raise
+            metrics.upstream_retry(upstream, 'connection')
+            time.sleep(backoff(attempt))
+            attempt += 1
+            continue
+        metrics.upstream_response(upstream, resp.status_code, len(resp.content), time.perf_counter() - start)
+
+        delay = retry_delay(resp.status_code, resp.headers, attempt, max_retries)
+        if delay is None:
+            return resp
+        metrics.upstream_retry(upstream, 'throttled')
+        if bucket is not None:
+            bucket.pause(delay)  # The next wait() sleeps it out, along with every other caller
+        else:
+            time.sleep(delay)
+        attempt += 1
+
+def stats():
+    """Queue depth, wait time and throttling counters per upstream"""
+    return {name: bucket.stats() for name, bucket in buckets.items()}
+
+metrics.register('wallet_upstream_queued', 'Requests waiting for upstream capacity',
+                 lambda: {name: bucket.queued for name, bucket in buckets.items()}, label='upstream')
@@ -0,0 +1,149 @@
+"""Local SQLite store of fetched wallet histories
+
+Each (chain, wallet, kind) history is kept as a contiguous run of the
+newest transactions, plus:
+- newest/oldest block, so re-analyses only ask Moralis for what's missing
+- whether the run reaches the wallet's first transaction (complete)
+- running inflow/outflow totals in base units, updated as txs are added
+"""
+import json
+import threading
+
+from cache import SQLiteConnections
+
+# Txs per list yielded by TxStore.pages, matching a Moralis page
+PAGE_SIZE = 100
+
+def tx_id(tx):
+    """Stable identity for a Moralis tx or transfer (one tx can hold many transfers)"""
+    tx_hash = tx.get('hash') or tx.get('transaction_hash') or ''
+    log_index = tx.get('log_index')
+    return f'{tx_hash}:{log_index}' if log_index is not None else tx_hash
+
+class TxStore:
+    def __init__(self, path):
+        self.path = path
+        self._conn = SQLiteConnections(path, timeout=30)
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS txs (
+                chain TEXT NOT NULL,
+                wallet TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                tx_id TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                block_number INTEGER NOT NULL,
+                tx TEXT NOT NULL,
+                PRIMARY KEY (chain, wallet, kind, tx_id)
+            );
+            CREATE INDEX IF NOT EXISTS txs_by_rank ON txs (chain, wallet, kind, rank);
+            CREATE TABLE IF NOT EXISTS histories (
+                chain TEXT NOT NULL,
+                wallet TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                tx_count INTEGER NOT NULL,
+                newest_rank INTEGER NOT NULL,
+                oldest_rank INTEGER NOT NULL,
+                newest_block INTEGER NOT NULL,
+                oldest_block INTEGER NOT NULL,
+                complete INTEGER NOT NULL,
+                inflow TEXT NOT NULL,
+                outflow TEXT NOT NULL,
+                PRIMARY KEY (chain, wallet, kind)
+            );
+        ''')
+
+    def state(self, chain, wallet, kind):
+        """Summary of the stored history, or None if nothing is stored"""
+        row = self._conn().execute(
+            'SELECT tx_count, newest_block, oldest_block, complete, inflow, outflow FROM histories '
+            'WHERE chain = ? AND wallet = ? AND kind = ?', (chain, wallet, kind)).fetchone()
+        if row is None:
+            return None
+        return {
+            'count': row[0],
+            'newest_block': row[1],
+            'oldest_block': row[2],
+            'complete': bool(row[3]),
+            'inflow': int(row[4]),
+            'outflow': int(row[5]),
+        }
+
+    def known_ids(self, chain, wallet, kind, block_number):
+        """Ids of stored txs in one block, to drop overlap at the edges of a fetch"""
+        rows = self._conn().execute(
+            'SELECT tx_id FROM txs WHERE chain = ? AND wallet = ? AND kind = ? AND block_number = ?',
+            (chain, wallet, kind, block_number))
+        return {row[0] for row in rows}
+
+    def add(self, chain, wallet, kind, txs, newer, complete=False, flow=None):
+        """Store newest-first txs just above (newer) or below the stored run
+
+        flow(tx) returns the (inflow, outflow) a tx adds to the running totals.
+        complete marks that the run now reaches the wallet's first tx.
+        """
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT tx_count, newest_rank, oldest_rank, newest_block, oldest_block, complete, inflow, outflow '
+                    'FROM histories WHERE chain = ? AND wallet = ? AND kind = ?', (chain, wallet, kind)).fetchone()
+                if row is None:
+                    row = (0, 0, 1, None, None, 0, '0', '0')
+                count, newest_rank, oldest_rank, newest_block, oldest_block, was_complete, inflow, outflow = row
+                inflow, outflow = int(inflow), int(outflow)
+
+                if newer:
+                    ranks = range(newest_rank + len(txs), newest_rank, -1)
+                else:
+                    ranks = range(oldest_rank - 1, oldest_rank - 1 - len(txs), -1)
+
+                for rank, tx in zip(ranks, txs):
+                    block_number = int(tx['block_number'])
+                    cur = conn.execute(
+                        'INSERT OR IGNORE INTO txs (chain, wallet, kind, tx_id, rank, block_number, tx) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (chain, wallet, kind, tx_id(tx), rank, block_number, json.dumps(tx, separators=(',', ':'))))
+                    if cur.rowcount != 1:
+                        continue
+                    count += 1
+                    newest_rank = max(newest_rank, rank)
+                    oldest_rank = min(oldest_rank, rank)
+                    newest_block = block_number if newest_block is None else max(newest_block, block_number)
+                    oldest_block = block_number if oldest_block is None else min(oldest_block, block_number)
+                    if flow is not None:
+                        tx_in, tx_out = flow(tx)
+                        inflow += tx_in
+                        outflow += tx_out
+
+                if newest_block is not None:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO histories (chain, wallet, kind, tx_count, newest_rank, oldest_rank, '
+                        'newest_block, oldest_block, complete, inflow, outflow) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (chain, wallet, kind, count, newest_rank, oldest_rank, newest_block, oldest_block,
+                         int(bool(was_complete) or complete), str(inflow), str(outflow)))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def pages(self, chain, wallet, kind, limit=0, page_size=PAGE_SIZE):
+        """Yield stored txs newest first in lists of page_size, at most limit of them (0 = all)"""
+        query = 'SELECT tx FROM txs WHERE chain = ? AND wallet = ? AND kind = ? ORDER BY rank DESC'
+        params = (chain, wallet, kind)
+        if limit > 0:
+            query += ' LIMIT ?'
+            params += (limit,)
+        cur = self._conn().execute(query, params)
+        while True:
+            rows = cur.fetchmany(page_size)
+            if not rows:
+                return
+            yield [json.loads(row[0]) for row in rows]
+
+    def latest(self, chain, wallet, kind, limit=0):
+        """Stored txs newest first, at most limit of them (0 = all)"""
+        return [tx for page in self.pages(chain, wallet, kind, limit) for tx in page]
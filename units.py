@@ -0,0 +1,6 @@
+"""Exact conversions from display amounts to integer base units"""
+from decimal import Decimal
+
+def to_base_units(amount, decimals):
+    """Exact integer base units for a display amount such as '2.25' or 2.25"""
+    return int(Decimal(str(amount)).scaleb(decimals).to_integral_value())
@@ -1,22 +1,65 @@
 import os
-import requests
-import argparse
+import sys
+import json
 from dotenv import load_dotenv
-import time
-from datetime import datetime, timedelta
 
-# Load Moralis API key from .env
+# Before the imports below, so settings in .env reach their module constants too
 load_dotenv()
-MORALIS_API_KEY = os.getenv('MORALIS_API_KEY')
 
-if not MORALIS_API_KEY:
-    print('Moralis API key not found in .env file.')
-    exit(1)
+from scheduler import http_get
+import argparse
+import contextvars
+import operator
+from contextlib import contextmanager
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from cache import TTLCache, make_backend
+from tx_store import TxStore, tx_id
+from units import to_base_units
+from price_resolver import PriceBatcher, PriceResolver, PriceUnavailable
+import metrics
+import page_decode
 
 # Cache for crypto prices
-price_cache = {}
 CACHE_DURATION = 300  # 5 minutes in seconds
 
+def parse_ttls(text):
+    """Parse "bitcoin=60,solana=120" into {'bitcoin': 60.0, 'solana': 120.0}"""
+    ttls = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        coin_id, seconds = item.split('=')
+        ttls[coin_id.strip()] = float(seconds)
+    return ttls
+
+# Backend is memory (per process), sqlite (shared by every worker on the host) or redis
+price_cache = TTLCache(
+    make_backend(
+        os.getenv('PRICE_CACHE_BACKEND', 'memory'),
+        path=os.getenv('PRICE_CACHE_PATH', 'price_cache.sqlite3'),
+        url=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    ),
+    default_ttl=float(os.getenv('PRICE_CACHE_TTL', CACHE_DURATION)),
+    ttls=parse_ttls(os.getenv('PRICE_CACHE_TTLS', '')),
+    stale_ttl=float(os.getenv('PRICE_CACHE_STALE_TTL', '600')),
+)
+
+# Price sources are raced ('race') or hedged after each source's p95 latency ('hedge')
+price_resolver = PriceResolver(
+    mode=os.getenv('PRICE_RESOLVER_MODE', 'hedge'),
+    hedge_delay=float(os.getenv('PRICE_HEDGE_DELAY', '0.3')),
+    timeout=float(os.getenv('PRICE_RESOLVE_TIMEOUT', '10')),
+)
+
+# Per-request timeout for a single price source
+PRICE_SOURCE_TIMEOUT = float(os.getenv('PRICE_SOURCE_TIMEOUT', '5'))
+
+# Seconds to collect concurrent multi-coin price lookups into one batch
+PRICE_BATCH_WINDOW = float(os.getenv('PRICE_BATCH_WINDOW', '0.02'))
+
 # Supported chains mapping for Moralis
 CHAIN_MAP = {
     'ETH': 'eth',
@@ -29,475 +72,1498 @@ CHAIN_MAP = {
     'OP': 'optimism',
 }
 
+# Base-unit decimals per coin (wei for EVM chains unless listed)
+DECIMALS = {
+    'BTC': 8,
+    'SOL': 9,
+}
+
+def coin_decimals(coin_symbol):
+    return DECIMALS.get(coin_symbol, 18)
+
+# CoinGecko ids for batched price lookups
+COINGECKO_IDS = {
+    'BTC': 'bitcoin',
+    'ETH': 'ethereum',
+    'BNB': 'binancecoin',
+    'MATIC': 'matic-network',
+    'SOL': 'solana',
+    'AVAX': 'avalanche-2',
+    'FTM': 'fantom',
+}
+
+# Chains whose native gas token is another coin; amounts there are priced as that coin
+PRICE_COINS = {
+    'ARB': 'ETH',
+    'OP': 'ETH',
+}
+
+def price_coin(coin_symbol):
+    """The coin whose USD price values a chain's native amounts"""
+    return PRICE_COINS.get(coin_symbol, coin_symbol)
+
+# Upper bound on concurrent Solana gateway calls per analysis
+SOL_FANOUT_WORKERS = int(os.getenv('SOL_FANOUT_WORKERS', '4'))
+
+# Concurrent analyses when processing a batch of wallet/coin pairs
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '8'))
+
+# Chains an EVM address is analyzed on by portfolio requests, and how many run at once
+EVM_COINS = [coin_symbol for coin_symbol in CHAIN_MAP if coin_symbol != 'SOL']
+PORTFOLIO_WORKERS = int(os.getenv('PORTFOLIO_WORKERS', str(len(EVM_COINS))))
+
+# Pages fetched ahead while the current one is aggregated (0 = fetch on demand)
+PAGE_PREFETCH = int(os.getenv('PAGE_PREFETCH', '1'))
+
+# BlockCypher batch size for /addrs/{a;b;...} requests (each address still counts against the rate limit)
+BTC_BATCH_SIZE = int(os.getenv('BTC_BATCH_SIZE', '3'))
+
+# Confirmations after which a BTC tx is treated as final and kept in the tx store for good
+BTC_FINAL_CONFIRMATIONS = int(os.getenv('BTC_FINAL_CONFIRMATIONS', '6'))
+
+# Txs per BlockCypher /full page (its maximum), and inputs/outputs returned per tx before paging them
+BTC_PAGE_SIZE = 50
+BTC_TX_IO_LIMIT = 1000
+
+# Optional local store of fetched histories, so re-analyses only fetch new transactions
+TX_STORE_PATH = os.getenv('TX_STORE_PATH')
+tx_store = TxStore(TX_STORE_PATH) if TX_STORE_PATH else None
+
+# Upstream API endpoints
+MORALIS_API = "https://deep-index.moralis.io/api/v2.2"
+SOLANA_GATEWAY = "https://solana-gateway.moralis.io"
+COINGECKO_API = "https://api.coingecko.com/api/v3"
+BINANCE_API = "https://api.binance.com/api/v3"
+COINBASE_API = "https://api.coinbase.com/v2"
+
 # BlockCypher API endpoint for Bitcoin
 BLOCKCYPHER_API = "https://api.blockcypher.com/v1/btc/main"
 
-headers = {
-    'accept': 'application/json',
-    'X-API-Key': MORALIS_API_KEY
-}
+# Wrapped SOL mint, used for the Moralis SOL price lookup
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+
+class MissingApiKey(Exception):
+    """MORALIS_API_KEY is not set"""
+
+class AnalysisError(Exception):
+    """An upstream call failed while analyzing a wallet"""
+
+@contextmanager
+def upstream_errors(label):
+    """Raise any failure inside as AnalysisError(f'{label}: ...'); AnalysisErrors already say what failed"""
+    try:
+        yield
+    except AnalysisError:
+        raise
+    except Exception as e:
+        raise AnalysisError(f'{label}: {e}') from e
+
+_headers = None
+
+def moralis_headers():
+    """Moralis request headers, built on first use so importing needs no key (BTC analyses never do)"""
+    global _headers
+    if _headers is None:
+        api_key = os.getenv('MORALIS_API_KEY')
+        if not api_key:
+            raise MissingApiKey('Moralis API key not found in .env file.')
+        _headers = {
+            'accept': 'application/json',
+            'X-API-Key': api_key
+        }
+    return _headers
+
+def resolve_chain(coin_symbol):
+    """Map an upper-case coin symbol to its chain, or None if unsupported"""
+    if coin_symbol == 'BTC':
+        return 'btc'
+    return CHAIN_MAP.get(coin_symbol)
 
 def get_cached_price(coin_id):
     """Get price from cache if available and not expired"""
-    if coin_id in price_cache:
-        cached_data = price_cache[coin_id]
-        if datetime.now() - cached_data['timestamp'] < timedelta(seconds=CACHE_DURATION):
-            return cached_data['price']
-    return None
+    return price_cache.get(coin_id)
 
 def set_cached_price(coin_id, price):
     """Set price in cache with current timestamp"""
-    price_cache[coin_id] = {
-        'price': price,
-        'timestamp': datetime.now()
-    }
+    price_cache.set(coin_id, price)
 
-def get_btc_transactions(wallet):
-    """Get Bitcoin transactions using BlockCypher API"""
-    url = f"{BLOCKCYPHER_API}/addrs/{wallet}"
-    try:
-        resp = requests.get(url)
+def btc_addresses(wallet):
+    """Addresses of a BTC wallet: one address, or several joined with ';' (e.g. an xpub's derived addresses)"""
+    return sorted({address.strip() for address in wallet.split(';') if address.strip()})
+
+def normalize_wallet(wallet):
+    """One spelling per wallet: EVM addresses are case-insensitive, base58 addresses are not, BTC address sets are unordered"""
+    wallet = wallet.strip()
+    if wallet.startswith('0x'):
+        return wallet.lower()
+    if ';' in wallet:
+        return ';'.join(btc_addresses(wallet))
+    return wallet
+
+def btc_json(url, params=None):
+    with metrics.span('btc_page'):
+        resp = http_get(url, params=params)
         if resp.status_code != 200:
-            print(f'Error fetching BTC transactions (status {resp.status_code}): {resp.text}')
-            exit(1)
+            raise AnalysisError(f'Error fetching BTC transactions (status {resp.status_code}): {resp.text}')
         return resp.json()
-    except Exception as e:
-        print(f'Error fetching BTC transactions: {e}')
-        exit(1)
 
-def get_btc_price():
-    """Get Bitcoin price using multiple sources with caching"""
-    cached_price = get_cached_price('bitcoin')
-    if cached_price is not None:
-        return cached_price
-
-    sources = [
-        lambda: requests.get("https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd").json()['bitcoin']['usd'],
-        lambda: float(requests.get("https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT").json()['price']),
-        lambda: float(requests.get("https://api.coinbase.com/v2/prices/BTC-USD/spot").json()['data']['amount'])
+def btc_results(addresses, data):
+    """{address: data} from a single or batched /addrs response"""
+    results = {}
+    for item in data if isinstance(data, list) else [data]:
+        if 'error' in item:
+            raise Exception(f'BlockCypher error for {item.get("address", ", ".join(addresses))}: {item["error"]}')
+        results[item.get('address')] = item
+    return results
+
+class BtcPager:
+    """Per-address `before` cursors for paging an address set through /addrs/{a;b;...}/full
+
+    Each round requests the next page of every unfinished address, batching
+    addresses that share a cursor. A cursor repeats the lowest height seen
+    (BlockCypher filters strictly below `before`), and the txs already seen
+    at that height are dropped, so a block split across two pages isn't lost.
+    BlockCypher can't page within a block, though: an address with a page or
+    more of txs in one block raises AnalysisError rather than undercount.
+    want > 0 stops an address once it has that many confirmed txs.
+    """
+
+    def __init__(self, addresses, want=0, params=None):
+        self.want = want
+        self.params = dict(params or {}, limit=BTC_PAGE_SIZE, txlimit=BTC_TX_IO_LIMIT)
+        self.cursors = dict.fromkeys(addresses)
+        self.seen = {address: set() for address in addresses}
+        self.counts = dict.fromkeys(addresses, 0)
+
+    @property
+    def done(self):
+        return not self.cursors
+
+    def requests(self):
+        """(addresses, url, params) for this round's requests"""
+        groups = {}
+        for address, before in self.cursors.items():
+            groups.setdefault(before, []).append(address)
+        requests = []
+        for before, group in groups.items():
+            params = self.params if before is None else dict(self.params, before=before)
+            for i in range(0, len(group), BTC_BATCH_SIZE):
+                batch = group[i:i + BTC_BATCH_SIZE]
+                requests.append((batch, f"{BLOCKCYPHER_API}/addrs/{';'.join(batch)}/full", params))
+        return requests
+
+    def advance(self, batch, data):
+        """Move the batch's cursors past a response and return its new raw txs"""
+        results = btc_results(batch, data)
+        new = []
+        for address in batch:
+            result = results.get(address, {})
+            txs = result.get('txs') or []
+            fresh = [tx for tx in txs if tx['hash'] not in self.seen[address]]
+            self.counts[address] += sum(tx.get('block_height', -1) >= 0 for tx in fresh)
+            new.extend(fresh)
+            heights = [tx['block_height'] for tx in txs if tx.get('block_height', -1) >= 0]
+            if not heights or not result.get('hasMore') or (self.want > 0 and self.counts[address] >= self.want):
+                del self.cursors[address]
+                continue
+            lowest = min(heights)
+            self.seen[address] = {tx['hash'] for tx in txs if tx.get('block_height') == lowest}
+            before = lowest + 1
+            if before == self.cursors[address]:
+                # The whole page below the cursor was this block, so the rest of it is out of reach
+                raise AnalysisError(f'{address} has {BTC_PAGE_SIZE} or more transactions in block {lowest}, '
+                                    f'which BlockCypher cannot page through; its totals would be incomplete')
+            self.cursors[address] = before
+        return new
+
+def full_io(tx, field, next_field):
+    """A tx's complete inputs or outputs, following BlockCypher's paging of large txs"""
+    items = list(tx.get(field) or [])
+    url = tx.get(next_field)
+    while url:
+        data = btc_json(url)
+        items += data.get(field) or []
+        url = data.get(next_field)
+    return items
+
+def btc_tx(tx, addresses, inputs=None, outputs=None):
+    """Compact a BlockCypher tx to the satoshis it moves into and out of an address set"""
+    received = 0
+    for output in tx.get('outputs') if outputs is None else outputs:
+        if addresses.intersection(output.get('addresses') or ()):
+            received += int(output.get('value', 0))
+    sent = 0
+    for tx_input in tx.get('inputs') if inputs is None else inputs:
+        if addresses.intersection(tx_input.get('addresses') or ()):
+            sent += int(tx_input.get('output_value', 0))
+    return {
+        'hash': tx['hash'],
+        'block_number': tx.get('block_height', -1),
+        'confirmations': tx.get('confirmations', 0),
+        'block_timestamp': tx.get('confirmed'),
+        'received': received,
+        'sent': sent,
+    }
+
+def compact_btc_txs(txs, addresses):
+    """Compact confirmed raw txs against an address set, fetching the rest of any truncated inputs/outputs"""
+    return [
+        btc_tx(tx, addresses, full_io(tx, 'inputs', 'next_inputs'), full_io(tx, 'outputs', 'next_outputs'))
+        for tx in txs if tx.get('block_height', -1) >= 0
     ]
 
-    for get_price in sources:
+def iter_btc_pages(addresses, want=0, params=None):
+    """Yield compact confirmed txs of an address set one response at a time; see BtcPager"""
+    address_set = set(addresses)
+    pager = BtcPager(addresses, want, params)
+    while not pager.done:
+        for batch, url, query in pager.requests():
+            page = compact_btc_txs(pager.advance(batch, btc_json(url, query)), address_set)
+            report_page(page)
+            yield page
+
+def unique_txs(pages):
+    """Drop txs already yielded, e.g. a payment between two addresses of the same set"""
+    seen = set()
+    for page in pages:
+        page = [tx for tx in page if tx['hash'] not in seen]
+        seen.update(tx['hash'] for tx in page)
+        yield page
+
+def newest_btc_txs(pages, limit):
+    """The newest limit txs across an address set's pages, newest first"""
+    txs = {tx['hash']: tx for page in pages for tx in page}
+    return sorted(txs.values(), key=lambda tx: tx['block_number'], reverse=True)[:limit]
+
+def iter_btc_txs(wallet, limit=100):
+    """Yield the newest limit confirmed txs (0 for all) of a BTC wallet page by page"""
+    addresses = btc_addresses(wallet)
+    pages = iter_btc_pages(addresses, limit)
+    if limit > 0:
+        # Every address has to be read to its limit-th tx before the set's newest are known
+        txs = newest_btc_txs(pages, limit)
+        for i in range(0, len(txs), BTC_PAGE_SIZE):
+            yield txs[i:i + BTC_PAGE_SIZE]
+        return
+    yield from unique_txs(pages) if len(addresses) > 1 else pages
+
+def get_btc_transactions(wallet, limit=100):
+    """Get the newest limit confirmed Bitcoin transactions (0 for all) using BlockCypher"""
+    with upstream_errors('Error fetching BTC transactions'):
+        return [tx for page in iter_btc_txs(wallet, limit) for tx in page]
+
+def sync_btc_history(wallet):
+    """Bring the stored final txs of a BTC wallet up to date; return (inflow, outflow) in satoshis
+
+    Final txs are stored for good; txs with fewer confirmations are summed
+    from this fetch only, so a reorg can't leave a dropped tx in the totals.
+    """
+    addresses = btc_addresses(wallet)
+    key = ('btc', ';'.join(addresses), 'btc')
+    state = tx_store.state(*key)
+    params = None
+    if state is not None and state['complete']:
+        # Only what's above the stored run; the top stored block is fetched again for safety
+        params = {'after': state['newest_block'] - 1}
+
+    pending_in = pending_out = 0
+    fresh = []
+    for page in unique_txs(iter_btc_pages(addresses, 0, params)):
+        final = [tx for tx in page if tx['confirmations'] >= BTC_FINAL_CONFIRMATIONS]
+        page_in, page_out = btc_flows([tx for tx in page if tx['confirmations'] < BTC_FINAL_CONFIRMATIONS])
+        pending_in += page_in
+        pending_out += page_out
+        if params is None:
+            tx_store.add(*key, final, newer=False, flow=btc_tx_flow)
+        else:
+            fresh.extend(final)
+    if params is None:
+        tx_store.add(*key, [], newer=False, complete=True, flow=btc_tx_flow)
+    elif fresh:
+        tx_store.add(*key, fresh, newer=True, flow=btc_tx_flow)
+
+    state = tx_store.state(*key)
+    stored_in, stored_out = (state['inflow'], state['outflow']) if state else (0, 0)
+    return stored_in + pending_in, stored_out + pending_out
+
+def price_sources(coin_symbol, coin_id):
+    """Fallback (name, url, headers, extract) sources for a coin's USD price, in priority order"""
+    return [
+        ('coingecko', f"{COINGECKO_API}/simple/price?ids={coin_id}&vs_currencies=usd", None, lambda data: data[coin_id]['usd']),
+        ('binance', f"{BINANCE_API}/ticker/price?symbol={coin_symbol}USDT", None, lambda data: data['price']),
+        ('coinbase', f"{COINBASE_API}/prices/{coin_symbol}-USD/spot", None, lambda data: data['data']['amount'])
+    ]
+
+def source_json(url, params=None, source_headers=None):
+    """Decoded JSON of a price source's 200 response; raises on any other status
+
+    Sent once, without the scheduler's retries: a slow or failing source is
+    covered by hedging to the next one, and a retrying call would hold its
+    price resolver thread long after the lookup gave up on it.
+    """
+    resp = http_get(url, headers=source_headers, params=params, timeout=PRICE_SOURCE_TIMEOUT, max_retries=0)
+    if resp.status_code != 200:
+        raise Exception(f'status {resp.status_code}')
+    return resp.json()
+
+def source_price(url, source_headers, extract):
+    """Fetch one source's price, raising unless it is a positive number"""
+    price = float(extract(source_json(url, source_headers=source_headers)))
+    if not price > 0:
+        raise ValueError(f'invalid price {price}')
+    return price
+
+def resolve_price(coin_symbol, sources):
+    """First valid price from the sources, hedged or raced by price_resolver"""
+    calls = [(name, lambda url=url, h=h, extract=extract: source_price(url, h, extract))
+             for name, url, h, extract in sources]
+    try:
+        return price_resolver.resolve(calls)
+    except PriceUnavailable:
+        raise PriceUnavailable(f"Unable to fetch {coin_symbol} price from any source")
+
+def optional_price(load, *args):
+    """load(*args), or None when no source has a price, so flows are still reported without USD values"""
+    try:
+        return load(*args)
+    except PriceUnavailable:
+        return None
+
+def price_key(coin_symbol):
+    """Price cache key for a coin, as used by get_btc_price, get_sol_price and get_native_price"""
+    coin_symbol = price_coin(coin_symbol)
+    return {'BTC': 'bitcoin', 'SOL': 'solana'}.get(coin_symbol, coin_symbol.lower())
+
+def coingecko_prices(symbols):
+    ids = {COINGECKO_IDS[symbol]: symbol for symbol in symbols if symbol in COINGECKO_IDS}
+    if not ids:
+        return {}
+    url = f"{COINGECKO_API}/simple/price?ids={','.join(ids)}&vs_currencies=usd"
+    data = source_json(url)
+    return {ids[coin_id]: quote['usd'] for coin_id, quote in data.items() if coin_id in ids}
+
+def binance_prices(symbols):
+    # Binance rejects the whole request if any pair is unknown; the next source picks those up
+    pairs = {f'{symbol}USDT': symbol for symbol in symbols}
+    data = source_json(f"{BINANCE_API}/ticker/price", params={'symbols': json.dumps(list(pairs), separators=(',', ':'))})
+    return {pairs[ticker['symbol']]: ticker['price'] for ticker in data if ticker.get('symbol') in pairs}
+
+def coinbase_prices(symbols):
+    # One call returns how much of every currency a dollar buys
+    rates = source_json(f"{COINBASE_API}/exchange-rates", params={'currency': 'USD'})['data']['rates']
+    return {symbol: 1 / float(rates[symbol]) for symbol in symbols if float(rates.get(symbol) or 0) > 0}
+
+def batch_price_sources():
+    """(name, fetch) sources that price many coins in one request, in priority order"""
+    return [
+        ('coingecko', coingecko_prices),
+        ('binance', binance_prices),
+        ('coinbase', coinbase_prices),
+    ]
+
+def fetch_prices(symbols):
+    """Price many coins with one request per source, each source covering what the previous ones missed"""
+    prices = {}
+    for name, fetch in batch_price_sources():
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        if not missing:
+            break
         try:
-            price = get_price()
-            set_cached_price('bitcoin', price)
-            return price
-        except Exception as e:
+            found = fetch(missing)
+        except Exception:
             continue
+        for symbol, price in found.items():
+            price = float(price)
+            if price > 0:
+                prices[symbol] = price
+    return prices
+
+price_batcher = PriceBatcher(fetch_prices, window=PRICE_BATCH_WINDOW)
+
+def get_prices(coin_symbols):
+    """{coin: price} for the coins a cached or batched lookup could price
+
+    Fresh cached prices are used as is; the rest are fetched together, and
+    concurrent callers within PRICE_BATCH_WINDOW share the same requests.
+    """
+    prices = {}
+    missing = {}
+    for coin_symbol in dict.fromkeys(coin_symbols):
+        price = price_cache.get(price_key(coin_symbol))
+        if price is not None:
+            prices[coin_symbol] = price
+        else:
+            missing.setdefault(price_coin(coin_symbol), []).append(coin_symbol)
+    
+    for priced, price in price_batcher.get_many(list(missing)).items():
+        price_cache.set(price_key(priced), price)
+        for coin_symbol in missing[priced]:
+            prices[coin_symbol] = price
+    return prices
 
-    # If all sources fail, return a default price or raise an error
-    raise Exception("Unable to fetch BTC price from any source")
+def get_btc_price():
+    """Get Bitcoin price using multiple sources with caching"""
+    return price_cache.get_or_load('bitcoin', fetch_btc_price)
+
+def fetch_btc_price():
+    """Fetch Bitcoin price from whichever source answers first"""
+    return resolve_price('BTC', price_sources('BTC', 'bitcoin'))
+
+def btc_tx_flow(tx):
+    return tx['received'], tx['sent']
+
+def btc_flows(transactions, wallet=None):
+    """Total received/sent in satoshis over compact BTC txs (see btc_tx)"""
+    inflow = 0
+    outflow = 0
+    for tx in transactions:
+        inflow += tx['received']
+        outflow += tx['sent']
+    return inflow, outflow
 
-def analyze_btc_transactions(wallet):
+def analyze_btc_transactions(wallet, limit=100):
     """Analyze Bitcoin transactions"""
-    data = get_btc_transactions(wallet)
-    price = get_btc_price()
+    with upstream_errors('Error processing BTC transactions'), metrics.span('btc_transactions'):
+        if tx_store is not None and limit == 0:
+            total_received, total_sent = sync_btc_history(wallet)
+        else:
+            total_received, total_sent = stream_flows(iter_btc_txs(wallet, limit), btc_flows, wallet)
+    with metrics.span('price'):
+        price = optional_price(get_btc_price)
     
-    # BlockCypher returns values in Satoshis (1e-8 BTC)
-    total_received = float(data.get('total_received', 0)) / 1e8
-    total_sent = float(data.get('total_sent', 0)) / 1e8
+    return total_received, total_sent, price, DECIMALS['BTC']
+
+def page_params(chain, limit):
+    """Query parameters for the first page of a Moralis listing"""
+    return {
+        'chain': chain,
+        'limit': min(100, limit) if limit > 0 else 100  # Max 100 per page, but respect user limit
+    }
+
+# Period sizes /analyze can split flows into
+BUCKETS = ('day',)
+# How /analyze values flows in USD: at today's price, or each tx at its time from the price_history index
+VALUATIONS = ('spot', 'historical')
+
+def parse_date(text, end_of_day=False):
+    """A 'YYYY-MM-DD' date or ISO 8601 time (UTC unless it has an offset) as a 'YYYY-MM-DDTHH:MM:SS' UTC string
+
+    A bare date stands for its first second, or with end_of_day its last. Raises ValueError.
+    """
+    text = str(text).strip()
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_of_day and len(text) == 10:
+        moment += timedelta(days=1, seconds=-1)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S')
+
+def parse_window(from_date=None, to_date=None):
+    """(start, end) UTC bounds, both inclusive and either None, or None when neither date is given
+
+    A bare to_date date covers that whole day. Raises ValueError.
+    """
+    if not from_date and not to_date:
+        return None
+    try:
+        start = parse_date(from_date) if from_date else None
+        end = parse_date(to_date, end_of_day=True) if to_date else None
+    except (TypeError, ValueError):
+        raise ValueError('from_date and to_date must be dates (YYYY-MM-DD) or ISO 8601 times')
+    if start is not None and end is not None and start > end:
+        raise ValueError('from_date must not be after to_date')
+    return start, end
+
+def parse_period(data, coin_symbol):
+    """(window, bucket, valuation) from a request's from_date, to_date, bucket and valuation; raises ValueError
+
+    valuation comes back None for the default spot valuation.
+    """
+    window = parse_window(data.get('from_date'), data.get('to_date'))
+    bucket = data.get('bucket')
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f'bucket must be one of: {", ".join(BUCKETS)}')
+    if coin_symbol == 'BTC' and (window is not None or bucket is not None):
+        raise ValueError('from_date, to_date and bucket are not supported for BTC')
+    valuation = data.get('valuation') or 'spot'
+    if valuation not in VALUATIONS:
+        raise ValueError(f'valuation must be one of: {", ".join(VALUATIONS)}')
+    if valuation == 'spot':
+        return window, bucket, None
+    import price_history  # Only historical valuations need NumPy
+    if price_history.get_index(coin_symbol) is None:
+        raise ValueError(f'No price history loaded for {coin_symbol}; load it with: python price_history.py load {coin_symbol} --from YYYY-MM-DD')
+    return window, bucket, valuation
+
+def parse_analysis(data):
+    """Validate an /analyze body into (wallet, coin, chain, limit, window, bucket, valuation), or return an error message"""
+    wallet = data.get('wallet')
+    coin = data.get('coin')
+    limit = data.get('limit', 100)  # Default to 100 if not specified
+
+    if not wallet or not coin:
+        return 'Wallet address and coin symbol are required'
+    # Cached and coalesced responses are shared by every spelling of the wallet, so they all echo this one
+    wallet = normalize_wallet(wallet)
+
+    # Validate coin symbol
+    coin = coin.upper()
+    chain = resolve_chain(coin)
+    if chain is None:
+        return f'{coin} is not supported. Supported coins: BTC, {", ".join(CHAIN_MAP.keys())}'
+    try:
+        window, bucket, valuation = parse_period(data, coin)
+    except ValueError as e:
+        return str(e)
+    return wallet, coin, chain, limit, window, bucket, valuation
+
+def window_params(window, names=('from_date', 'to_date')):
+    """Upstream query parameters restricting a listing to window"""
+    params = {}
+    if window is not None:
+        for name, bound in zip(names, window):
+            if bound is not None:
+                params[name] = bound + 'Z'
+    return params
+
+def normalize_timestamp(value):
+    """An upstream block time (ISO string or unix seconds) as a 'YYYY-MM-DDTHH:MM:SS' UTC string"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return datetime.fromtimestamp(int(value), timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    # Moralis sends UTC times like 2024-05-01T12:00:00.000Z, which compare as strings once cut to seconds
+    return str(value)[:19]
+
+def tx_timestamp(tx):
+    """Block time of a tx dict or page_decode record, normalized; None when it has none"""
+    return normalize_timestamp(tx.get('block_timestamp') if isinstance(tx, dict) else tx.block_timestamp)
+
+def in_window(timestamp, window):
+    """Whether a normalized timestamp falls inside window; txs without one are kept"""
+    start, end = window
+    return timestamp is None or ((start is None or timestamp >= start) and (end is None or timestamp <= end))
+
+def clip_page(page, window):
+    """(txs of a newest-first page inside window, whether the page went past the window's start)"""
+    start = window[0]
+    kept = []
+    for tx in page:
+        timestamp = tx_timestamp(tx)
+        if start is not None and timestamp is not None and timestamp < start:
+            return kept, True
+        if in_window(timestamp, window):
+            kept.append(tx)
+    return kept, False
+
+def page_txs(data):
+    """The tx list of a Moralis page (a dict with 'result', or a bare list)"""
+    if isinstance(data, dict):
+        return data.get('result', [])
+    return data if isinstance(data, list) else []
+
+def build_sol_transactions(wallet, native_balance, transfers_data, swaps_data, limit, window=None):
+    """Flatten the Solana gateway balance, transfers and swaps into tx dicts
+
+    With a window, only transfers and swaps inside it count; the balance has no date, so it is left out.
+    """
+    transactions = []
+    
+    # Add native balance as an incoming transaction if positive
+    if native_balance > 0 and window is None:
+        transactions.append({
+            'amount': native_balance,
+            'to_address': wallet.lower(),
+            'from_address': ''
+        })
+    
+    # Add transfer transactions
+    if isinstance(transfers_data, dict) and 'result' in transfers_data:
+        for transfer in transfers_data['result']:
+            timestamp = normalize_timestamp(transfer.get('block_timestamp') or transfer.get('blockTimestamp'))
+            if window is not None and not in_window(timestamp, window):
+                continue
+            if transfer.get('type') == 'sol':
+                amount = float(transfer.get('amount', 0))
+                if transfer.get('to_address') == wallet:
+                    transactions.append({
+                        'amount': amount,
+                        'to_address': wallet.lower(),
+                        'from_address': transfer.get('from_address', ''),
+                        'block_timestamp': timestamp
+                    })
+                elif transfer.get('from_address') == wallet:
+                    transactions.append({
+                        'amount': amount,
+                        'from_address': wallet.lower(),
+                        'to_address': transfer.get('to_address', ''),
+                        'block_timestamp': timestamp
+                    })
+                    
+            # Check if we've reached the user's limit
+            if limit > 0 and len(transactions) >= limit:
+                break
     
-    return total_received, total_sent, price, 8  # Bitcoin uses 8 decimals
+    # Add swap transactions if we haven't reached the limit
+    if limit == 0 or len(transactions) < limit:
+        if isinstance(swaps_data, dict) and 'result' in swaps_data:
+            for swap in swaps_data['result']:
+                timestamp = normalize_timestamp(swap.get('blockTimestamp') or swap.get('block_timestamp'))
+                if window is not None and not in_window(timestamp, window):
+                    continue
+                # Handle buy transactions
+                if swap.get('transactionType') == 'buy':
+                    sold_token = swap.get('sold', {})
+                    if sold_token.get('symbol') == 'SOL':
+                        transactions.append({
+                            'amount': float(sold_token.get('amount', 0)),
+                            'from_address': wallet.lower(),
+                            'to_address': swap.get('pairAddress', ''),
+                            'block_timestamp': timestamp
+                        })
+                # Handle sell transactions
+                elif swap.get('transactionType') == 'sell':
+                    bought_token = swap.get('bought', {})
+                    if bought_token.get('symbol') == 'SOL':
+                        transactions.append({
+                            'amount': float(bought_token.get('amount', 0)),
+                            'to_address': wallet.lower(),
+                            'from_address': swap.get('pairAddress', ''),
+                            'block_timestamp': timestamp
+                        })
+                        
+                # Check if we've reached the user's limit
+                if limit > 0 and len(transactions) >= limit:
+                    break
+    
+    return transactions[:limit] if limit > 0 else transactions
 
-def get_transactions(wallet, chain, coin_symbol, limit=100):
+def get_transactions(wallet, chain, coin_symbol, limit=100, include_portfolio=False, window=None):
     if coin_symbol == 'BTC':
-        return get_btc_transactions(wallet)
+        return get_btc_transactions(wallet, limit)
     elif coin_symbol == 'SOL':
         # Get balance and tokens using Solana gateway
-        balance_url = f'https://solana-gateway.moralis.io/account/mainnet/{wallet}/balance'
-        portfolio_url = f'https://solana-gateway.moralis.io/account/mainnet/{wallet}/portfolio'
-        swaps_url = f'https://solana-gateway.moralis.io/account/mainnet/{wallet}/swaps'
-        transfers_url = f'https://solana-gateway.moralis.io/account/mainnet/{wallet}/transfers'
+        balance_url = f'{SOLANA_GATEWAY}/account/mainnet/{wallet}/balance'
+        portfolio_url = f'{SOLANA_GATEWAY}/account/mainnet/{wallet}/portfolio'
+        swaps_url = f'{SOLANA_GATEWAY}/account/mainnet/{wallet}/swaps'
+        transfers_url = f'{SOLANA_GATEWAY}/account/mainnet/{wallet}/transfers'
+        history_params = {
+            'limit': min(100, limit) if limit > 0 else 100,
+            'order': 'DESC',
+            **window_params(window, ('fromDate', 'toDate'))
+        }
         
-        try:
-            # Get native balance
-            balance_resp = requests.get(balance_url, headers=headers)
-            if balance_resp.status_code != 200:
-                print(f'Error: Invalid Solana wallet address or API error: {balance_resp.text}')
-                exit(1)
-            
-            balance_data = balance_resp.json()
-            native_balance = float(balance_data.get('solana', 0))  # Get SOL amount directly
-            
-            # Get portfolio data
-            portfolio_resp = requests.get(portfolio_url, headers=headers)
-            if portfolio_resp.status_code != 200:
-                print(f'Error fetching SOL portfolio: {portfolio_resp.text}')
-                exit(1)
+        with upstream_errors('Error fetching SOL data'):
+            # The gateway calls are independent, so issue them all at once
+            headers = moralis_headers()
+            with ThreadPoolExecutor(max_workers=SOL_FANOUT_WORKERS) as pool:
+                balance_future = pool.submit(http_get, balance_url, headers=headers)
+                portfolio_future = pool.submit(http_get, portfolio_url, headers=headers) if include_portfolio else None
+                transfers_future = pool.submit(http_get, transfers_url, headers=headers, params=history_params)
+                swaps_future = pool.submit(http_get, swaps_url, headers=headers, params=history_params)
+
+                # Get native balance
+                balance_resp = balance_future.result()
+                if balance_resp.status_code != 200:
+                    raise AnalysisError(f'Error: Invalid Solana wallet address or API error: {balance_resp.text}')
                 
-            portfolio_data = portfolio_resp.json()
-            
-            # Get transfer history with pagination
-            transfers_params = {
-                'limit': min(100, limit) if limit > 0 else 100,
-                'order': 'DESC'
-            }
-            transfers_resp = requests.get(transfers_url, headers=headers, params=transfers_params)
-            transfers_data = []
-            if transfers_resp.status_code == 200:
-                transfers_data = transfers_resp.json()
-            
-            # Get swap history
-            swaps_params = {
-                'limit': min(100, limit) if limit > 0 else 100,
-                'order': 'DESC'
-            }
-            swaps_resp = requests.get(swaps_url, headers=headers, params=swaps_params)
-            swaps_data = []
-            if swaps_resp.status_code == 200:
-                swaps_data = swaps_resp.json()
-            
-            # Create transaction structure
-            transactions = []
-            
-            # Add native balance as an incoming transaction if positive
-            if native_balance > 0:
-                transactions.append({
-                    'amount': native_balance,
-                    'to_address': wallet.lower(),
-                    'from_address': ''
-                })
-            
-            # Add transfer transactions
-            if isinstance(transfers_data, dict) and 'result' in transfers_data:
-                for transfer in transfers_data['result']:
-                    if transfer.get('type') == 'sol':
-                        amount = float(transfer.get('amount', 0))
-                        if transfer.get('to_address') == wallet:
-                            transactions.append({
-                                'amount': amount,
-                                'to_address': wallet.lower(),
-                                'from_address': transfer.get('from_address', '')
-                            })
-                        elif transfer.get('from_address') == wallet:
-                            transactions.append({
-                                'amount': amount,
-                                'from_address': wallet.lower(),
-                                'to_address': transfer.get('to_address', '')
-                            })
-                            
-                    # Check if we've reached the user's limit
-                    if limit > 0 and len(transactions) >= limit:
-                        break
-            
-            # Add swap transactions if we haven't reached the limit
-            if limit == 0 or len(transactions) < limit:
-                if isinstance(swaps_data, dict) and 'result' in swaps_data:
-                    for swap in swaps_data['result']:
-                        # Handle buy transactions
-                        if swap.get('transactionType') == 'buy':
-                            sold_token = swap.get('sold', {})
-                            if sold_token.get('symbol') == 'SOL':
-                                transactions.append({
-                                    'amount': float(sold_token.get('amount', 0)),
-                                    'from_address': wallet.lower(),
-                                    'to_address': swap.get('pairAddress', '')
-                                })
-                        # Handle sell transactions
-                        elif swap.get('transactionType') == 'sell':
-                            bought_token = swap.get('bought', {})
-                            if bought_token.get('symbol') == 'SOL':
-                                transactions.append({
-                                    'amount': float(bought_token.get('amount', 0)),
-                                    'to_address': wallet.lower(),
-                                    'from_address': swap.get('pairAddress', '')
-                                })
-                                
-                        # Check if we've reached the user's limit
-                        if limit > 0 and len(transactions) >= limit:
-                            break
+                balance_data = balance_resp.json()
+                native_balance = float(balance_data.get('solana', 0))  # Get SOL amount directly
+                
+                # Get portfolio data (only when the caller asked for it)
+                portfolio_data = None
+                if portfolio_future is not None:
+                    portfolio_resp = portfolio_future.result()
+                    if portfolio_resp.status_code != 200:
+                        raise AnalysisError(f'Error fetching SOL portfolio: {portfolio_resp.text}')
+                    portfolio_data = portfolio_resp.json()
+                
+                # Get transfer history
+                transfers_resp = transfers_future.result()
+                transfers_data = []
+                if transfers_resp.status_code == 200:
+                    transfers_data = transfers_resp.json()
+                report_page(page_txs(transfers_data))
+                
+                # Get swap history
+                swaps_resp = swaps_future.result()
+                swaps_data = []
+                if swaps_resp.status_code == 200:
+                    swaps_data = swaps_resp.json()
+                report_page(page_txs(swaps_data))
             
-            return {'result': transactions[:limit] if limit > 0 else transactions}
+            transactions = build_sol_transactions(wallet, native_balance, transfers_data, swaps_data, limit, window)
             
-        except Exception as e:
-            print(f'Error fetching SOL data: {str(e)}')
-            exit(1)
+            result = {'result': transactions}
+            if include_portfolio:
+                result['portfolio'] = portfolio_data
+            return result
     else:
-        url = f'https://deep-index.moralis.io/api/v2.2/{wallet}/erc20/transfers'
-        params = {
-            'chain': chain,
-            'limit': min(100, limit) if limit > 0 else 100  # Max 100 per page, but respect user limit
-        }
+        url = f'{MORALIS_API}/{wallet}/erc20/transfers'
         
-        all_transfers = []
-        cursor = None
+        with upstream_errors('Error fetching ERC20 transfers'):
+            if tx_store is not None and window is None:
+                sync_history('erc20', url, chain, wallet, limit, 'transactions')
+                return tx_store.latest(chain, wallet.lower(), 'erc20', limit)
+            return paginate(url, chain, limit, 'transactions', window)
+
+def iter_pages(url, params, label, want=0, decode=None):
+    """Yield Moralis pages, following the cursor until the listing ends or want txs (0 = all) were fetched
+
+    decode(raw bytes) replaces resp.json(), e.g. page_decode.native_page for compact records.
+    """
+    params = dict(params)
+    fetched = 0
+    while True:
+        with metrics.span('moralis_page'):
+            resp = http_get(url, headers=moralis_headers(), params=params)
+            if resp.status_code != 200:
+                raise AnalysisError(f'Error fetching {label} (status {resp.status_code}): {resp.text}')
+            data = decode(resp.content) if decode is not None else resp.json()
+        yield data
+        fetched += len(page_txs(data))
         
-        try:
-            while True:
-                if cursor:
-                    params['cursor'] = cursor
-                    
-                resp = requests.get(url, headers=headers, params=params)
-                if resp.status_code != 200:
-                    print(f'Error fetching transactions (status {resp.status_code}): {resp.text}')
-                    exit(1)
-                    
-                data = resp.json()
-                if isinstance(data, dict) and 'result' in data:
-                    transfers = data['result']
-                    all_transfers.extend(transfers)
-                    
-                    # Check if we've reached the user's limit
-                    if limit > 0 and len(all_transfers) >= limit:
-                        all_transfers = all_transfers[:limit]
-                        break
-                    
-                    # Check if there are more pages
-                    cursor = data.get('cursor')
-                    if not cursor:
-                        break
-                else:
-                    all_transfers.extend(data if isinstance(data, list) else [])
-                    if limit > 0:
-                        all_transfers = all_transfers[:limit]
-                    break
-                    
-            return all_transfers
-        except Exception as e:
-            print(f'Error fetching ERC20 transfers: {e}')
-            exit(1)
+        # Check if there are more pages
+        cursor = data.get('cursor') if isinstance(data, dict) else None
+        if not cursor or (want > 0 and fetched >= want):
+            return
+        params['cursor'] = cursor
 
-def get_native_transactions(wallet, chain, coin_symbol, limit=100):
-    """Get native token transactions using Moralis API"""
-    url = f'https://deep-index.moralis.io/api/v2.2/{wallet}'
-    params = {
-        'chain': chain,
-        'limit': min(100, limit) if limit > 0 else 100  # Max 100 per page, but respect user limit
-    }
+# Called with each Moralis page's tx count as the current analysis consumes it (set by background jobs)
+analysis_progress = contextvars.ContextVar('analysis_progress', default=None)
+
+def report_page(txs):
+    report = analysis_progress.get()
+    if report is not None:
+        report(len(txs))
+
+_DONE = object()
+
+def prefetch(items, depth=None):
+    """Iterate items while a background thread produces up to depth (default PAGE_PREFETCH) of them ahead"""
+    if depth is None:
+        depth = PAGE_PREFETCH
+    if depth <= 0:
+        yield from items
+        return
+    
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    
+    def put(entry):
+        # Give up once the consumer has gone away, rather than block forever
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
     
-    all_transactions = []
-    cursor = None
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            # Whatever the producer raised is re-raised in the consumer
+            put((_DONE, e))
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
     
+    # In the consumer's context, so its page spans count toward the same request
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
     try:
         while True:
-            if cursor:
-                params['cursor'] = cursor
-                
-            resp = requests.get(url, headers=headers, params=params)
-            if resp.status_code != 200:
-                print(f'Error fetching native transfers (status {resp.status_code}): {resp.text}')
-                exit(1)
-                
-            data = resp.json()
-            if isinstance(data, dict) and 'result' in data:
-                transactions = data['result']
-                all_transactions.extend(transactions)
-                
-                # Check if we've reached the user's limit
-                if limit > 0 and len(all_transactions) >= limit:
-                    all_transactions = all_transactions[:limit]
-                    break
-                
-                # Check if there are more pages
-                cursor = data.get('cursor')
-                if not cursor:
-                    break
-            else:
-                all_transactions.extend(data if isinstance(data, list) else [])
-                if limit > 0:
-                    all_transactions = all_transactions[:limit]
-                break
-                
-        return all_transactions
-    except Exception as e:
-        print(f'Error fetching native transactions: {e}')
-        exit(1)
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+def iter_tx_pages(url, chain, limit, label, decode=None, window=None):
+    """Yield the newest limit txs (0 for all) of a Moralis listing one page at a time
+
+    A window (see parse_window) is sent as from_date/to_date, so Moralis
+    only lists txs inside it and the cursor runs out at its start.
+    """
+    params = dict(page_params(chain, limit), **window_params(window))
+    remaining = limit
+    for data in prefetch(iter_pages(url, params, label, limit, decode)):
+        page = page_txs(data)
+        passed = False
+        if window is not None:
+            # Also stops at the window's start should a listing ignore the date filters
+            page, passed = clip_page(page, window)
+        if limit > 0:
+            page = page[:remaining]
+            remaining -= len(page)
+        report_page(page)
+        yield page
+        if passed:
+            return
+
+def paginate(url, chain, limit, label, window=None):
+    """Collect the newest limit txs (0 for all) of a Moralis listing, inside window if given"""
+    return [tx for page in iter_tx_pages(url, chain, limit, label, window=window) for tx in page]
+
+def iter_new_pages(url, params, label, want, known):
+    """Yield (txs, reached_end) per page, skipping txs whose id is in known, until want txs (0 = all)"""
+    remaining = want
+    # Skipped txs are at most len(known), so this many fetched txs always covers want
+    for data in prefetch(iter_pages(url, params, label, want + len(known) if want > 0 else 0)):
+        page = [tx for tx in page_txs(data) if tx_id(tx) not in known]
+        if want > 0:
+            page = page[:remaining]
+            remaining -= len(page)
+        report_page(page)
+        if want > 0 and remaining <= 0:
+            yield page, False
+            return
+        yield page, not (isinstance(data, dict) and data.get('cursor'))
+
+def collect_new(url, params, label, want, known):
+    """Page through a listing keeping txs whose id isn't in known; return (txs, reached_end)"""
+    txs = []
+    reached_end = True
+    for page, reached_end in iter_new_pages(url, params, label, want, known):
+        txs.extend(page)
+    return txs, reached_end
+
+def sync_history(kind, url, chain, wallet, limit, label, flow=None):
+    """Fetch only what the tx store lacks for the newest limit txs (0 for all); return its state"""
+    key = (chain, wallet.lower(), kind)
+    state = tx_store.state(*key)
+    
+    if state is None:
+        # Stored page by page as they arrive, each one below the last
+        for txs, reached_end in iter_new_pages(url, page_params(chain, limit), label, limit, set()):
+            tx_store.add(*key, txs, newer=False, complete=reached_end, flow=flow)
+        return tx_store.state(*key)
+    
+    # Everything newer than the stored run; one page for a recently analyzed wallet
+    params = page_params(chain, 0)
+    params['from_block'] = state['newest_block']
+    txs, _ = collect_new(url, params, label, 0, tx_store.known_ids(*key, state['newest_block']))
+    if txs:
+        tx_store.add(*key, txs, newer=True, flow=flow)
+        state = tx_store.state(*key)
+    
+    # Older history, only when the caller wants more than the stored run holds
+    if not state['complete'] and (limit == 0 or state['count'] < limit):
+        want = 0 if limit == 0 else limit - state['count']
+        params = page_params(chain, want)
+        params['to_block'] = state['oldest_block']
+        for txs, reached_end in iter_new_pages(url, params, label, want, tx_store.known_ids(*key, state['oldest_block'])):
+            tx_store.add(*key, txs, newer=False, complete=reached_end, flow=flow)
+        state = tx_store.state(*key)
+    
+    return state
+
+def native_flow(wallet):
+    """Per-tx (inflow, outflow) in wei for wallet, using the native_flows rules"""
+    wallet = wallet.lower()
+    
+    def flow(tx):
+        value = int(tx.get('value') or tx.get('native_value') or 0)
+        if (tx.get('to_address') or tx.get('to') or '').lower() == wallet:
+            return value, 0
+        if (tx.get('from_address') or tx.get('from') or '').lower() == wallet:
+            return 0, value
+        return 0, 0
+    
+    return flow
+
+def iter_native_pages(wallet, chain, limit=100, window=None):
+    """Yield the newest limit native txs (0 for all) page by page, from the tx store or Moralis
+
+    Windowed listings always come from Moralis: the store tracks block runs, not dates.
+    """
+    url = f'{MORALIS_API}/{wallet}'
+    if tx_store is not None and window is None:
+        sync_history('native', url, chain, wallet, limit, 'native transfers', native_flow(wallet))
+        return tx_store.pages(chain, wallet.lower(), 'native', limit)
+    return iter_tx_pages(url, chain, limit, 'native transfers', window=window)
+
+def get_native_transactions(wallet, chain, coin_symbol, limit=100, window=None):
+    """Get native token transactions using Moralis API"""
+    with upstream_errors('Error fetching native transactions'):
+        return [tx for page in iter_native_pages(wallet, chain, limit, window) for tx in page]
+
+def get_native_totals(wallet, chain):
+    """Bring the stored native history up to date and return its (inflow, outflow) in wei"""
+    with upstream_errors('Error fetching native transactions'):
+        state = sync_history('native', f'{MORALIS_API}/{wallet}', chain, wallet, 0, 'native transfers', native_flow(wallet))
+    if state is None:
+        return 0, 0
+    return state['inflow'], state['outflow']
 
 def get_token_price(chain, address):
-    url = f'https://deep-index.moralis.io/api/v2.2/{address}/erc20?chain={chain}'
-    resp = requests.get(url, headers=headers)
+    url = f'{MORALIS_API}/{address}/erc20?chain={chain}'
+    resp = http_get(url, headers=moralis_headers())
     if resp.status_code != 200:
-        print(f'Error fetching token price (status {resp.status_code}): {resp.text}')
-        exit(1)
+        raise AnalysisError(f'Error fetching token price (status {resp.status_code}): {resp.text}')
     return resp.json()['usdPrice']
 
 def get_native_price(wallet, chain, coin_symbol):
     """Get native token price from multiple sources with caching"""
-    coin_id = coin_symbol.lower()
-    cached_price = get_cached_price(coin_id)
-    if cached_price is not None:
-        return cached_price
+    return price_cache.get_or_load(price_key(coin_symbol), lambda: fetch_native_price(wallet, chain, coin_symbol))
 
-    # Try Moralis first
-    try:
-        url = f'https://deep-index.moralis.io/api/v2.2/erc20/{wallet}/price'
-        params = {'chain': chain}
-        resp = requests.get(url, headers=headers, params=params)
-        if resp.status_code == 200:
-            price = float(resp.json().get('usdPrice', 0))
-            if price > 0:
-                set_cached_price(coin_id, price)
-                return price
-    except Exception:
-        pass
-
-    # Fallback sources
-    sources = [
-        lambda: requests.get(f"https://api.coingecko.com/api/v3/simple/price?ids={coin_id}&vs_currencies=usd").json()[coin_id]['usd'],
-        lambda: float(requests.get(f"https://api.binance.com/api/v3/ticker/price?symbol={coin_symbol}USDT").json()['price']),
-        lambda: float(requests.get(f"https://api.coinbase.com/v2/prices/{coin_symbol}-USD/spot").json()['data']['amount'])
-    ]
-
-    for get_price in sources:
-        try:
-            price = get_price()
-            set_cached_price(coin_id, price)
-            return price
-        except Exception:
-            continue
+def native_price_sources(wallet, chain, coin_symbol):
+    """Moralis plus the fallback sources for a native coin's price (see price_coin)"""
+    if price_coin(coin_symbol) != coin_symbol:
+        coin_symbol = price_coin(coin_symbol)
+        chain = CHAIN_MAP[coin_symbol]
+    moralis = ('moralis', f'{MORALIS_API}/erc20/{wallet}/price?chain={chain}', moralis_headers(), lambda data: data['usdPrice'])
+    return [moralis] + price_sources(coin_symbol, COINGECKO_IDS.get(coin_symbol, coin_symbol.lower()))
 
-    # If all sources fail, return a default price or raise an error
-    raise Exception(f"Unable to fetch {coin_symbol} price from any source")
+def fetch_native_price(wallet, chain, coin_symbol):
+    """Fetch native token price from whichever source answers first"""
+    return resolve_price(price_coin(coin_symbol), native_price_sources(wallet, chain, coin_symbol))
 
 def get_sol_price(wallet):
     """Get SOL price from multiple sources with caching"""
-    cached_price = get_cached_price('solana')
-    if cached_price is not None:
-        return cached_price
+    return price_cache.get_or_load('solana', fetch_sol_price)
 
-    # Try Moralis first
-    try:
-        url = 'https://solana-gateway.moralis.io/token/mainnet/So11111111111111111111111111111111111111112/price'
-        resp = requests.get(url, headers=headers)
-        if resp.status_code == 200:
-            price_data = resp.json()
-            if 'usdPrice' in price_data:
-                price = float(price_data['usdPrice'])
-                set_cached_price('solana', price)
-                return price
-    except Exception:
-        pass
+def sol_price_sources():
+    """Moralis plus the fallback sources for the SOL price"""
+    moralis = ('moralis', f'{SOLANA_GATEWAY}/token/mainnet/{SOL_MINT}/price', moralis_headers(), lambda data: data['usdPrice'])
+    return [moralis] + price_sources('SOL', 'solana')
 
-    # Fallback sources
-    sources = [
-        lambda: requests.get("https://api.coingecko.com/api/v3/simple/price?ids=solana&vs_currencies=usd").json()['solana']['usd'],
-        lambda: float(requests.get("https://api.binance.com/api/v3/ticker/price?symbol=SOLUSDT").json()['price']),
-        lambda: float(requests.get("https://api.coinbase.com/v2/prices/SOL-USD/spot").json()['data']['amount'])
-    ]
+def fetch_sol_price():
+    """Fetch SOL price from whichever source answers first"""
+    return resolve_price('SOL', sol_price_sources())
 
-    for get_price in sources:
-        try:
-            price = get_price()
-            set_cached_price('solana', price)
-            return price
-        except Exception:
+def sol_flows(transactions, wallet):
+    """Sum SOL inflow/outflow in lamports for wallet over gateway tx dicts"""
+    wallet = wallet.lower()
+    inflow = 0
+    outflow = 0
+    
+    for tx in transactions:
+        if not tx.get('amount'):
+            continue
+        
+        if (tx.get('to_address') or '').lower() == wallet:
+            inflow += to_base_units(tx['amount'], DECIMALS['SOL'])  # Amount is in SOL
+        elif (tx.get('from_address') or '').lower() == wallet:
+            outflow += to_base_units(tx['amount'], DECIMALS['SOL'])
+    
+    return inflow, outflow
+
+def native_flows(transactions, wallet):
+    """Sum native coin inflow/outflow in wei for wallet over Moralis tx dicts"""
+    wallet = wallet.lower()
+    inflow = 0
+    outflow = 0
+    
+    for tx in transactions:
+        # Try both value fields that Moralis might return
+        value = tx.get('value') or tx.get('native_value')
+        if not value:
             continue
+        
+        # Check both address formats Moralis might return
+        if (tx.get('to_address') or tx.get('to') or '').lower() == wallet:
+            inflow += int(value)
+        elif (tx.get('from_address') or tx.get('from') or '').lower() == wallet:
+            outflow += int(value)
+    
+    return inflow, outflow
 
-    # If all sources fail, return a default price or raise an error
-    raise Exception("Unable to fetch SOL price from any source")
+def stream_flows(pages, flows, wallet):
+    """Aggregate flows(page, wallet) over pages as they arrive, holding one page at a time
 
-def analyze_transactions(wallet, coin_symbol, chain, limit=100):
-    if coin_symbol == 'BTC':
-        return analyze_btc_transactions(wallet)
+    Every field flows returns is summed: (inflow, outflow), or valued_flows' five.
+    """
+    totals = flows([], wallet)
+    for page in pages:
+        with metrics.span('aggregate'):
+            totals = tuple(map(operator.add, totals, flows(page, wallet)))
+    return totals
+
+def valued_flows(flows, index, decimals):
+    """flows(txs, wallet) extended to (inflow, outflow, inflow_usd, outflow_usd, unpriced)
+
+    Txs are grouped by candle of the price_history index and each group is
+    valued at its close, so a page costs one lookup per distinct candle and
+    no network calls. unpriced counts txs with flows but no candle (no block
+    time, or outside the index); they are in inflow/outflow but not the USD sums.
+    """
+    def valued(txs, wallet):
+        by_slot = {}
+        for tx in txs:
+            by_slot.setdefault(index.slot(tx_timestamp(tx)), []).append(tx)
+        inflow = outflow = unpriced = 0
+        inflow_usd = outflow_usd = Decimal(0)
+        for slot, group in by_slot.items():
+            group_in, group_out = flows(group, wallet)
+            inflow += group_in
+            outflow += group_out
+            if slot is None:
+                unpriced += sum(1 for tx in group if any(flows([tx], wallet)))
+                continue
+            price = index.close(slot)
+            inflow_usd += to_usd(to_display(group_in, decimals), price)
+            outflow_usd += to_usd(to_display(group_out, decimals), price)
+        return inflow, outflow, inflow_usd, outflow_usd, unpriced
     
-    inflow = 0.0
-    outflow = 0.0
-    decimals = 18  # Default for ETH and most ERC20 tokens
-    price = 0.0
+    return valued
+
+def add_daily_flows(days, page, flows, wallet):
+    """Add flows(txs, wallet) of a page's txs into days by the UTC day of their block time"""
+    by_day = {}
+    for tx in page:
+        timestamp = tx_timestamp(tx)
+        by_day.setdefault(timestamp[:10] if timestamp else None, []).append(tx)
+    for day, txs in by_day.items():
+        totals = flows(txs, wallet)
+        days[day] = tuple(map(operator.add, days[day], totals)) if day in days else totals
+
+def daily_flows(pages, flows, wallet):
+    """Like stream_flows, but summed per UTC day: {'YYYY-MM-DD': (inflow, outflow, ...)}
+
+    Txs without a block time land under None.
+    """
+    days = {}
+    for page in pages:
+        with metrics.span('aggregate'):
+            add_daily_flows(days, page, flows, wallet)
+    return days
+
+def day_rows(days):
+    """daily_flows' result as [(day, inflow, outflow, ...)], oldest first and undated last"""
+    return [(day, *totals) for day, totals in sorted(days.items(), key=lambda item: (item[0] is None, item[0] or ''))]
+
+def analyze_window(wallet, coin_symbol, chain, limit, window, aggregate, index=None):
+    """(aggregate(pages, flows, wallet), price, decimals) over the newest limit txs (0 for all) inside window
+
+    window None covers all history. Txs always come from the upstream, as
+    the tx store tracks block runs rather than dates; BTC takes no window
+    since BlockCypher can't filter address listings by date. With a
+    price_history index, flows are valued_flows'.
+    """
+    decimals = coin_decimals(coin_symbol)
+    
+    def value(flows):
+        return flows if index is None else valued_flows(flows, index, decimals)
+    
+    if coin_symbol == 'BTC':
+        if window is not None:
+            raise ValueError('from_date, to_date and bucket are not supported for BTC')
+        with upstream_errors('Error processing BTC transactions'), metrics.span('btc_transactions'):
+            result = aggregate(iter_btc_txs(wallet, limit), value(btc_flows), wallet)
+        with metrics.span('price'):
+            price = optional_price(get_btc_price)
+        return result, price, decimals
+    # Raise MissingApiKey as itself, rather than as a fetcher's AnalysisError
+    moralis_headers()
     
     if coin_symbol == 'SOL':
-        try:
-            txs = get_transactions(wallet, chain, coin_symbol, limit)
-            price = get_sol_price(wallet)
-            
-            if 'result' in txs:
-                transactions = txs['result']
-            else:
-                transactions = []
-            
-            for tx in transactions:
-                if not tx.get('amount'):
-                    continue
-                
-                value = float(tx.get('amount', '0'))  # Amount is already in SOL
-                
-                if tx.get('to_address', '').lower() == wallet.lower():
-                    inflow += value
-                elif tx.get('from_address', '').lower() == wallet.lower():
-                    outflow += value
-            
-            decimals = 9
-        except Exception as e:
-            print(f'Error processing SOL transactions: {e}')
-            exit(1)
-    else:
-        # Native coin (ETH, BNB, etc.)
-        try:
-            native_txs = get_native_transactions(wallet, chain, coin_symbol, limit)
-            price = get_native_price(wallet, chain, coin_symbol)
+        with upstream_errors('Error processing SOL transactions'):
+            # Fetch the price alongside the gateway calls instead of after them
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                price_future = pool.submit(contextvars.copy_context().run, get_sol_price, wallet)
+                with metrics.span('sol_gateway'):
+                    txs = get_transactions(wallet, chain, coin_symbol, limit, window=window)
+                price = optional_price(price_future.result)
             
-            # Process native transactions
-            if 'result' in native_txs:
-                transactions = native_txs['result']
+            result = aggregate([txs.get('result', [])], value(sol_flows), wallet)
+        return result, price, decimals
+    
+    # Native coin (ETH, BNB, etc.), summed page by page as they arrive so memory stays bounded even with limit=0
+    with upstream_errors('Error processing native transactions'):
+        url = f'{MORALIS_API}/{wallet}'
+        with metrics.span('native_transactions'):
+            if page_decode.COMPACT_PAGES:
+                # Only values, addresses and times are read, so decode pages into records of just those
+                pages = iter_tx_pages(url, chain, limit, 'native transfers', page_decode.native_page, window)
+                result = aggregate(pages, value(page_decode.native_flows), wallet)
             else:
-                transactions = native_txs if isinstance(native_txs, list) else []
-                
-            for tx in transactions:
-                if not tx.get('value') and not tx.get('native_value'):
-                    continue
-                    
-                # Try both value fields that Moralis might return
-                value = float(tx.get('value') or tx.get('native_value') or '0') / 1e18  # Convert from Wei to ETH
-                
-                # Check both address formats Moralis might return
-                to_address = tx.get('to_address', tx.get('to', '')).lower()
-                from_address = tx.get('from_address', tx.get('from', '')).lower()
-                
-                if to_address == wallet.lower():
-                    inflow += value
-                elif from_address == wallet.lower():
-                    outflow += value
-                    
-        except Exception as e:
-            print(f'Error processing native transactions: {e}')
-            print(f'Response data: {native_txs}')  # Debug print
-            exit(1)
+                pages = iter_tx_pages(url, chain, limit, 'native transfers', window=window)
+                result = aggregate(pages, value(native_flows), wallet)
+    with metrics.span('price'):
+        price = optional_price(get_native_price, wallet, chain, coin_symbol)
+    return result, price, decimals
 
-    # Round to 8 decimal places for consistency with BTC
-    inflow = round(inflow, 8)
-    outflow = round(outflow, 8)
+def analyze_transactions(wallet, coin_symbol, chain, limit=100, window=None):
+    """Return (inflow, outflow, price, decimals) with flows as exact ints in base units
+
+    window (see parse_window) restricts the analysis to a date range. price
+    is None when no source could price the coin (see optional_price).
+    """
+    if coin_symbol == 'BTC' and window is None:
+        return analyze_btc_transactions(wallet, limit)
+    if coin_symbol == 'SOL' or tx_store is None or window is not None:
+        (inflow, outflow), price, decimals = analyze_window(wallet, coin_symbol, chain, limit, window, stream_flows)
+        return inflow, outflow, price, decimals
+    moralis_headers()
+    
+    # Native coin history kept in the tx store
+    decimals = coin_decimals(coin_symbol)
+    with upstream_errors('Error processing native transactions'):
+        if limit == 0:
+            # Full history: the store keeps running totals, so no need to re-sum every tx
+            with metrics.span('native_transactions'):
+                inflow, outflow = get_native_totals(wallet, chain)
+        else:
+            with metrics.span('native_transactions'):
+                inflow, outflow = stream_flows(iter_native_pages(wallet, chain, limit), native_flows, wallet)
+    with metrics.span('price'):
+        price = optional_price(get_native_price, wallet, chain, coin_symbol)
     
     return inflow, outflow, price, decimals
 
-def main(wallet_address, coin_symbol):
+def period_totals(result, bucket, index):
+    """(inflow, outflow, days, cost_basis) from analyze_window's result for analyze_period"""
+    days = None
+    if bucket is not None:
+        days = day_rows(result)
+        result = [sum(column) for column in zip(*(row[1:] for row in days))] or [0] * (5 if index else 2)
+    return result[0], result[1], days, tuple(result[2:]) if index is not None else None
+
+def analyze_period(wallet, coin_symbol, chain, limit=100, window=None, bucket=None, valuation=None):
+    """analyze_transactions plus buckets and cost basis: (inflow, outflow, price, decimals, days, cost_basis)
+
+    With bucket='day', days is day_rows' [(day, inflow, outflow, ...)];
+    otherwise None. With valuation='historical', every tx is valued at its
+    time from the coin's price_history index: cost_basis is (inflow_usd,
+    outflow_usd, unpriced) and each day row carries its own three; otherwise
+    cost_basis is None.
+    """
+    index = None
+    if valuation == 'historical':
+        import price_history
+        index = price_history.get_index(coin_symbol)
+        if index is None:
+            raise ValueError(f'No price history loaded for {coin_symbol}')
+    elif bucket is None:
+        return (*analyze_transactions(wallet, coin_symbol, chain, limit, window), None, None)
+    result, price, decimals = analyze_window(wallet, coin_symbol, chain, limit, window,
+                                             stream_flows if bucket is None else daily_flows, index)
+    inflow, outflow, days, cost_basis = period_totals(result, bucket, index)
+    return inflow, outflow, price, decimals, days, cost_basis
+
+def to_display(units, decimals):
+    """Exact Decimal coin amount for an integer amount of base units"""
+    # Built from a string so no context precision or rounding applies
+    return Decimal(f'{units}e-{decimals}')
+
+def to_usd(amount, price):
+    return amount * Decimal(str(price))
+
+def cost_basis_fields(inflow_usd, outflow_usd, unpriced):
+    return {
+        'receivedUsd': f'{inflow_usd:,.2f}',
+        'sentUsd': f'{outflow_usd:,.2f}',
+        'netUsd': f'{inflow_usd - outflow_usd:,.2f}',
+        'unpricedTransactions': unpriced
+    }
+
+def format_analysis(wallet, coin, inflow, outflow, price, limit, decimals, window=None, days=None, cost_basis=None):
+    """Build the /analyze response body from base-unit flows; price None means USD values are unavailable
+
+    window adds the fromDate/toDate analyzed, days (analyze_period's) a
+    per-day breakdown and cost_basis the USD values of each tx at its time.
+    """
+    net_amount = to_display(inflow - outflow, decimals)
+    inflow = to_display(inflow, decimals)
+    outflow = to_display(outflow, decimals)
+    result = {
+        'wallet': wallet,
+        'coin': coin,
+        'received': f'{inflow:.8f}',
+        'sent': f'{outflow:.8f}',
+        'net': f'{net_amount:.8f}',
+        'transactionsAnalyzed': limit if limit > 0 else 'all'
+    }
+    if window is not None:
+        result['fromDate'], result['toDate'] = (bound and bound + 'Z' for bound in window)
+    if days is not None:
+        result['daily'] = [{
+            'date': day,
+            'received': f'{to_display(day_in, decimals):.8f}',
+            'sent': f'{to_display(day_out, decimals):.8f}',
+            'net': f'{to_display(day_in - day_out, decimals):.8f}',
+            **({'costBasis': cost_basis_fields(*day_usd)} if day_usd else {})
+        } for day, day_in, day_out, *day_usd in days]
+    if cost_basis is not None:
+        result['costBasis'] = cost_basis_fields(*cost_basis)
+
+    if price is None:
+        result.update({
+            'receivedUsd': 'Price Unavailable',
+            'sentUsd': 'Price Unavailable',
+            'netUsd': 'Price Unavailable',
+            'warning': 'Price data temporarily unavailable. USD values could not be calculated.'
+        })
+        return result
+
+    inflow_usd = to_usd(inflow, price)
+    outflow_usd = to_usd(outflow, price)
+    net_usd = inflow_usd - outflow_usd
+    result.update({
+        'receivedUsd': f'{inflow_usd:,.2f}',
+        'sentUsd': f'{outflow_usd:,.2f}',
+        'netUsd': f'{net_usd:,.2f}'
+    })
+    return result
+
+def parse_pair(text):
+    """Split a "wallet_address,coin_symbol" string into (wallet, COIN)"""
+    wallet_address, coin_symbol = text.split(',')
+    wallet_address = wallet_address.strip()
+    coin_symbol = coin_symbol.strip().upper()
+    if not wallet_address or not coin_symbol:
+        raise ValueError
+    return wallet_address, coin_symbol
+
+def warm_price(wallet, coin_symbol, chain):
+    """Fetch a coin's price once so a batch's analyses all hit the cache"""
+    try:
+        if coin_symbol == 'BTC':
+            get_btc_price()
+        elif coin_symbol == 'SOL':
+            get_sol_price(wallet)
+        else:
+            get_native_price(wallet, chain, coin_symbol)
+    except Exception:
+        pass  # Each analysis retries and reports the failure itself
+
+def analyze_pair(wallet, coin_symbol, chain, limit, window=None, bucket=None, valuation=None):
+    """Analyze one batch pair, returning a result or error record"""
+    try:
+        inflow, outflow, price, decimals, days, cost_basis = analyze_period(
+            wallet, coin_symbol, chain, limit, window, bucket, valuation)
+    except Exception as e:
+        return {'wallet': wallet, 'coin': coin_symbol, 'error': str(e)}
+    return format_analysis(wallet, coin_symbol, inflow, outflow, price, limit, decimals, window, days, cost_basis)
+
+def analyze_batch(pairs, limit=100, max_workers=BATCH_WORKERS):
+    """Analyze (wallet, coin) pairs concurrently, yielding each record as it finishes"""
+    # Drop duplicate pairs, keeping first-seen order
+    unique = dict.fromkeys((wallet, coin_symbol.upper()) for wallet, coin_symbol in pairs)
+    
+    # Group wallets by coin so each chain's price is fetched once and shared
+    groups = {}
+    for wallet, coin_symbol in unique:
+        chain = resolve_chain(coin_symbol)
+        if chain is None:
+            yield {'wallet': wallet, 'coin': coin_symbol,
+                   'error': f'{coin_symbol} is not supported. Supported coins: BTC, {", ".join(CHAIN_MAP.keys())}'}
+            continue
+        groups.setdefault((coin_symbol, chain), []).append(wallet)
+    
+    # Every coin's price in one request per source; coins it missed fall back to their own lookup
+    prices = get_prices(coin_symbol for coin_symbol, chain in groups)
+    
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = []
+        for (coin_symbol, chain), wallets in groups.items():
+            if coin_symbol not in prices:
+                warm_price(wallets[0], coin_symbol, chain)
+            futures.extend(pool.submit(analyze_pair, wallet, coin_symbol, chain, limit) for wallet in wallets)
+        
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Closed early when a streaming client disconnects: finish the running pairs but drop the queued ones
+        pool.shutdown(cancel_futures=True)
+
+def is_evm_address(wallet):
+    return len(wallet) == 42 and wallet.startswith('0x') and all(c in '0123456789abcdefABCDEF' for c in wallet[2:])
+
+def portfolio_summary(wallet, results, limit):
+    """Build the /portfolio body from {coin: (inflow, outflow, price, decimals) or error message}
+
+    Per-chain entries have the /analyze shape, in EVM_COINS order. USD totals
+    are summed exactly and cover only the chains that have a price.
+    """
+    chains = []
+    received_usd = sent_usd = Decimal(0)
+    priced = []
+    for coin_symbol in EVM_COINS:
+        result = results.get(coin_symbol)
+        if result is None:
+            continue
+        if isinstance(result, str):
+            chains.append({'wallet': wallet, 'coin': coin_symbol, 'error': result})
+            continue
+        inflow, outflow, price, decimals = result
+        chains.append(format_analysis(wallet, coin_symbol, inflow, outflow, price, limit, decimals))
+        if price is not None:
+            received_usd += to_usd(to_display(inflow, decimals), price)
+            sent_usd += to_usd(to_display(outflow, decimals), price)
+            priced.append(coin_symbol)
+    return {
+        'wallet': wallet,
+        'chains': chains,
+        'receivedUsd': f'{received_usd:,.2f}',
+        'sentUsd': f'{sent_usd:,.2f}',
+        'netUsd': f'{received_usd - sent_usd:,.2f}',
+        'pricedChains': priced,
+        'transactionsAnalyzed': limit if limit > 0 else 'all',
+    }
+
+def analyze_chain(wallet, coin_symbol, limit):
+    """(inflow, outflow, price, decimals) for one portfolio chain, or an error message"""
+    try:
+        return analyze_transactions(wallet, coin_symbol, CHAIN_MAP[coin_symbol], limit)
+    except Exception as e:
+        return str(e)
+
+def analyze_portfolio(wallet, limit=100, max_workers=PORTFOLIO_WORKERS):
+    """Analyze an EVM address on every EVM chain at once; see portfolio_summary"""
+    # Every chain's price in one request per source; chains it missed look theirs up concurrently
+    get_prices(EVM_COINS)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {coin_symbol: pool.submit(analyze_chain, wallet, coin_symbol, limit) for coin_symbol in EVM_COINS}
+        results = {coin_symbol: future.result() for coin_symbol, future in futures.items()}
+    return portfolio_summary(wallet, results, limit)
+
+def read_pairs(stream):
+    """Yield (wallet, coin) pairs from "wallet,coin" lines, or error records for bad lines"""
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield parse_pair(line)
+        except ValueError:
+            yield {'input': line, 'error': 'Input must be in the format "wallet_address,coin_symbol"'}
+
+def main_batch(stream, limit=100, max_workers=BATCH_WORKERS):
+    """Analyze every pair read from stream, writing NDJSON records to stdout"""
+    out = sys.stdout
+    pairs = []
+    for item in read_pairs(stream):
+        if isinstance(item, dict):
+            out.write(json.dumps(item) + '\n')
+        else:
+            pairs.append(item)
+    
+    for record in analyze_batch(pairs, limit, max_workers):
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+
+def main(wallet_address, coin_symbol, limit=100, from_date=None, to_date=None, bucket=None, valuation=None):
     # Validate coin symbol
     coin_symbol = coin_symbol.upper()
-    if coin_symbol == 'BTC':
-        chain = 'btc'
-    elif coin_symbol not in CHAIN_MAP:
+    chain = resolve_chain(coin_symbol)
+    if chain is None:
         print(f'Error: {coin_symbol} is not supported.')
         print(f'Supported coins: BTC, {", ".join(CHAIN_MAP.keys())}')
         exit(1)
-    else:
-        chain = CHAIN_MAP[coin_symbol]
+    if coin_symbol != 'BTC' and not os.getenv('MORALIS_API_KEY'):
+        print('Moralis API key not found in .env file.')
+        exit(1)
+    try:
+        window, bucket, valuation = parse_period(
+            {'from_date': from_date, 'to_date': to_date, 'bucket': bucket, 'valuation': valuation}, coin_symbol)
+    except ValueError as e:
+        print(f'Error: {e}')
+        exit(1)
     
-    inflow, outflow, price, decimals = analyze_transactions(wallet_address, coin_symbol, chain)
-    inflow_usd = inflow * price
-    outflow_usd = outflow * price
-    net_amount = inflow - outflow
-    net_usd = inflow_usd - outflow_usd
+    try:
+        inflow, outflow, price, decimals, days, cost_basis = analyze_period(
+            wallet_address, coin_symbol, chain, limit, window, bucket, valuation)
+    except AnalysisError as e:
+        print(e)
+        exit(1)
+    for day, day_in, day_out, *day_usd in days or []:
+        line = (f'{day or "undated"}: received {to_display(day_in, decimals):.8f}, sent {to_display(day_out, decimals):.8f}, '
+                f'net {to_display(day_in - day_out, decimals):.8f} {coin_symbol}')
+        if day_usd:
+            line += f' (cost basis ${day_usd[0]:,.2f} in, ${day_usd[1]:,.2f} out)'
+        print(line)
+    # Converted to coin units only here, for display
+    net_amount = to_display(inflow - outflow, decimals)
+    inflow = to_display(inflow, decimals)
+    outflow = to_display(outflow, decimals)
+    
+    def usd(amount):
+        return '' if price is None else f' (${to_usd(amount, price):,.2f})'
     
     print(f'\nWallet: {wallet_address}')
-    print(f'Total Received: {inflow:.8f} {coin_symbol} (${inflow_usd:,.2f})')
-    print(f'Total Sent: {outflow:.8f} {coin_symbol} (${outflow_usd:,.2f})')
-    print(f'Net Balance: {net_amount:.8f} {coin_symbol} (${net_usd:,.2f})')
+    if window is not None:
+        print(f'Period: {window[0] or "start"} to {window[1] or "now"} UTC')
+    print(f'Total Received: {inflow:.8f} {coin_symbol}{usd(inflow)}')
+    print(f'Total Sent: {outflow:.8f} {coin_symbol}{usd(outflow)}')
+    print(f'Net Balance: {net_amount:.8f} {coin_symbol}{usd(net_amount)}')
+    if price is None:
+        print('Price data temporarily unavailable. USD values could not be calculated.')
+    if cost_basis is not None:
+        inflow_usd, outflow_usd, unpriced = cost_basis
+        print(f'Cost Basis: received ${inflow_usd:,.2f}, sent ${outflow_usd:,.2f}, net ${inflow_usd - outflow_usd:,.2f}'
+              + (f' ({unpriced} transactions without a historical price)' if unpriced else ''))
+
+def main_portfolio(wallet_address, limit=100, max_workers=PORTFOLIO_WORKERS):
+    if not is_evm_address(wallet_address):
+        print('Error: --portfolio needs an EVM address (0x followed by 40 hex digits)')
+        exit(1)
+    
+    portfolio = analyze_portfolio(wallet_address, limit, max_workers)
+    
+    print(f'\nWallet: {wallet_address}')
+    for record in portfolio['chains']:
+        if 'error' in record:
+            print(f'{record["coin"]:<6} error: {record["error"]}')
+        else:
+            print(f'{record["coin"]:<6} received {record["received"]} (${record["receivedUsd"]}), '
+                  f'sent {record["sent"]} (${record["sentUsd"]}), net {record["net"]} (${record["netUsd"]})')
+    print(f'Total Received: ${portfolio["receivedUsd"]}')
+    print(f'Total Sent: ${portfolio["sentUsd"]}')
+    print(f'Net Balance: ${portfolio["netUsd"]}')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Analyze crypto wallet transactions')
-    parser.add_argument('input', help='Wallet address and coin symbol, comma separated (e.g., 0x123abc...,ETH). Supported coins: BTC, ' + ", ".join(CHAIN_MAP.keys()))
+    parser.add_argument('input', nargs='?', help='Wallet address and coin symbol, comma separated (e.g., 0x123abc...,ETH). Supported coins: BTC, ' + ", ".join(CHAIN_MAP.keys()))
+    parser.add_argument('--batch', metavar='FILE', help='Analyze one "wallet,coin" pair per line from FILE ("-" for stdin) and print NDJSON results')
+    parser.add_argument('--limit', type=int, default=100, help='Transactions to analyze per wallet (0 for all)')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help='Concurrent analyses in batch mode')
+    parser.add_argument('--portfolio', metavar='ADDRESS', help='Analyze an EVM address on every EVM chain at once (' + ", ".join(EVM_COINS) + ')')
+    parser.add_argument('--from-date', help='Only count transactions from this date (YYYY-MM-DD or ISO 8601 time, UTC)')
+    parser.add_argument('--to-date', help='Only count transactions up to this date, inclusive')
+    parser.add_argument('--bucket', choices=BUCKETS, help='Also print flows per period')
+    parser.add_argument('--valuation', choices=VALUATIONS, default='spot', help='historical also values each transaction at its time from the local price history (see price_history.py)')
+    parser.add_argument('--offline', metavar='DUMP', nargs='+', help='Re-aggregate exported upstream pages from NDJSON/JSON dump files, without network calls (see offline.py)')
+    parser.add_argument('--processes', type=int, help='Worker processes for --offline (default: OFFLINE_PROCESSES)')
     
     args = parser.parse_args()
     
+    if args.offline:
+        import offline
+        offline.main_offline(args.offline, args.processes)
+        sys.exit(0)
+    
+    if args.portfolio:
+        main_portfolio(args.portfolio, args.limit)
+        sys.exit(0)
+    
+    if args.batch:
+        if args.batch == '-':
+            main_batch(sys.stdin, args.limit, args.workers)
+        else:
+            with open(args.batch) as f:
+                main_batch(f, args.limit, args.workers)
+        sys.exit(0)
+    
+    if not args.input:
+        parser.error('either a "wallet_address,coin_symbol" input, --batch FILE, --portfolio ADDRESS or --offline DUMP is required')
+    
     # Split the input into wallet and coin
     try:
-        wallet_address, coin_symbol = args.input.split(',')
-        wallet_address = wallet_address.strip()
-        coin_symbol = coin_symbol.strip()
-        if not wallet_address or not coin_symbol:
-            raise ValueError
+        wallet_address, coin_symbol = parse_pair(args.input)
     except ValueError:
         print('Error: Input must be in the format "wallet_address,coin_symbol"')
         print('Example: 0x742d35Cc6634C0532925a3b844Bc454e4438f44e,ETH')
         exit(1)
         
-    main(wallet_address, coin_symbol) 
\ No newline at end of file
+    main(wallet_address, coin_symbol, args.limit, args.from_date, args.to_date, args.bucket, args.valuation)